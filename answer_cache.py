@@ -0,0 +1,149 @@
+"""
+Semantic answer cache in front of the LLM step.
+
+An answer is reused when a new question is close enough to a cached one
+(cosine similarity of the query embeddings ≥ ANSWER_SIMILARITY_THRESHOLD)
+AND the evidence is identical: the same set of retrieved chunk ids under
+the same prompt (template, chat history). Chunk ids include a content hash,
+so changed text never matches an old answer.
+
+Answers live in SQLite (answer_cache.db) and are shared by every process
+and session. Entries expire after ANSWER_CACHE_TTL seconds, the least
+recently used are evicted above ANSWER_CACHE_SIZE entries, and ingestion
+clears the cache whenever the collection changes.
+
+    python answer_cache.py            # hit-rate and size report
+    python answer_cache.py --clear    # drop every cached answer
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+ANSWER_CACHE_PATH = "answer_cache.db"
+ANSWER_CACHE_SIZE = 5000  # Max cached answers (least recently used evicted)
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # Seconds an answer stays valid
+ANSWER_SIMILARITY_THRESHOLD = 0.95  # Min query cosine similarity for a hit
+
+def evidence_key(chunk_ids, scope=""):
+    """Exact part of the key: the retrieved chunk id set plus the rest of the prompt"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(scope.encode("utf-8"))
+    for chunk_id in sorted(set(chunk_ids)):
+        digest.update(b"\0" + str(chunk_id).encode("utf-8"))
+    return digest.hexdigest()
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class AnswerCache:
+    """Persistent (question embedding, evidence) → answer cache.
+
+    Shared across Streamlit sessions, so every method takes the lock.
+    Hit/miss counters are kept per process and in the database (all time).
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_SIMILARITY_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, evidence TEXT, embedding BLOB,
+                                                question TEXT, answer TEXT, created REAL, last_used REAL,
+                                                hits INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_answers_evidence ON answers (evidence);
+            CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used);
+        """)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, name):
+        self.conn.execute("INSERT INTO counters VALUES (?, 1) "
+                          "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, embedding, chunk_ids, scope=""):
+        """Cached answer for this question and evidence, or None"""
+        query = _unit(embedding)
+        now = time.time()
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT id, embedding FROM answers WHERE evidence = ? AND created >= ?",
+                (evidence_key(chunk_ids, scope), now - self.ttl)).fetchall()
+            best, best_score = None, self.threshold
+            for row_id, blob in rows:
+                score = float(np.dot(query, np.frombuffer(blob, dtype=np.float32)))
+                if score >= best_score:
+                    best, best_score = row_id, score
+            if best is None:
+                self.misses += 1
+                self._count("misses")
+                return None
+            self.hits += 1
+            self._count("hits")
+            self.conn.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE id = ?", (now, best))
+            return self.conn.execute("SELECT answer FROM answers WHERE id = ?", (best,)).fetchone()[0]
+
+    def put(self, embedding, chunk_ids, answer, question="", scope=""):
+        if not answer:
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO answers (evidence, embedding, question, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (evidence_key(chunk_ids, scope), _unit(embedding).tobytes(), question, answer, now, now))
+            self.conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        """Drop every answer (the collection changed); counters are kept"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM answers")
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            counters = dict(self.conn.execute("SELECT name, value FROM counters"))
+        total = self.hits + self.misses
+        all_hits, all_misses = counters.get("hits", 0), counters.get("misses", 0)
+        all_total = all_hits + all_misses
+        return {"hits": self.hits, "misses": self.misses, "entries": entries,
+                "hit_rate": self.hits / total if total else 0.0,
+                "all_time_hits": all_hits, "all_time_misses": all_misses,
+                "all_time_hit_rate": all_hits / all_total if all_total else 0.0}
+
+def invalidate(path=ANSWER_CACHE_PATH):
+    """Clear the answer cache if one exists (called by ingestion)"""
+    if os.path.exists(path):
+        AnswerCache(path).clear()
+        print(f"🧹 Cleared cached answers in {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the semantic answer cache")
+    parser.add_argument("--path", default=ANSWER_CACHE_PATH)
+    parser.add_argument("--clear", action="store_true", help="drop every cached answer")
+    args = parser.parse_args()
+
+    cache = AnswerCache(args.path)
+    if args.clear:
+        cache.clear()
+    stats = cache.stats()
+    print(f"💬 Answer cache: {stats['entries']} answers in {args.path}, all-time hit rate "
+          f"{100 * stats['all_time_hit_rate']:.1f}% ({stats['all_time_hits']} hits, "
+          f"{stats['all_time_misses']} misses)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Token streaming of LLM answers with latency measurement.
+
+Wraps the chunk iterator of llm.stream(...) or chain.stream(...) so the
+front-ends can render text as it arrives, while recording time to first
+token and total time for the request.
+"""
+import time
+
+def chunk_text(chunk):
+    """Text of a streamed chunk (AIMessageChunk, str, or content-part list)"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+    return content or ""
+
+class TimedStream:
+    """Iterable of answer text pieces; fills in timings as it is consumed.
+
+    `start` defaults to now; pass the request start time to include the
+    retrieval step in time-to-first-token.
+    """
+
+    def __init__(self, chunks, start=None):
+        self.chunks = chunks
+        self.start = start if start is not None else time.perf_counter()
+        self.parts = []
+        self.first_token_seconds = None
+        self.total_seconds = None
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self.start
+            self.parts.append(text)
+            yield text
+        self.total_seconds = time.perf_counter() - self.start
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def timings(self):
+        return {"first_token_seconds": self.first_token_seconds, "total_seconds": self.total_seconds}
+
+    def summary(self):
+        if self.first_token_seconds is None:
+            return f"no tokens, total {self.total_seconds or 0:.2f}s"
+        return f"first token {self.first_token_seconds:.2f}s, total {self.total_seconds or 0:.2f}s"
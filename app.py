@@ -1,36 +1,30 @@
-import os
+import time
 import streamlit as st
-from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnableLambda
-
-# Load API key
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-
-# Config
-CHROMA_DB_DIR = "chroma_db"
-COLLECTION_NAME = "sec_filings"
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-
-# Init embedding + Chroma
-embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-vectorstore = Chroma(
-    collection_name=COLLECTION_NAME,
-    embedding_function=embedding_model,
-    persist_directory=CHROMA_DB_DIR
-)
-retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-
-# Gemini Flash via LangChain
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    temperature=0.2,
-    google_api_key=GOOGLE_API_KEY
-)
+from retrieval import source_records, chunk_ids
+from answer_stream import TimedStream
+from query_analyzer import decomposed_search, describe
+from conversation_memory import ConversationMemory, llm_summarizer, fit_prompt, MAX_QUESTION_CHARS
+from context_packing import pack_context, CONTEXT_TOKEN_BUDGET
+import resources
+
+st.set_page_config(page_title="SEC Filings QA", layout="wide")
+
+# Models and the vector store are loaded once per server process (not per
+# rerun or session); warm-up starts in the background on the first page load
+resources.warm_up()
+if not resources.wait_until_ready(timeout=0):
+    with st.spinner("Loading embedding model and vector store..."):
+        resources.wait_until_ready()
+if not resources.health()["ready"]:
+    st.error(f"Startup failed: {resources.health()['warmup']['error']}")
+    st.stop()
+
+search = resources.get_search()
+llm = resources.get_llm()
+answer_cache = resources.get_answer_cache()
+analyzer = resources.get_analyzer()
+reranker = resources.get_reranker()
 
 # Prompt
 prompt = PromptTemplate.from_template("""
@@ -63,77 +57,96 @@ Answer:
 # Chat session history init
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-
-# Combine: retrieve → prompt → Gemini
-def format_docs(docs):
-    return "\n\n".join(
-        f"[{d.metadata.get('ticker')}, {d.metadata.get('filing_type')}, {d.metadata.get('section')}, {d.metadata.get('filing_date')}]:\n{d.page_content}"
-        for d in docs
-    )
-
-chain = (
-    RunnableLambda(lambda q: retriever.get_relevant_documents(q))
-    | RunnableLambda(lambda docs: {
-        "context": format_docs(docs),
-        "question": docs[0].metadata.get("original_query", "") if docs else ""
-    })
-    | prompt
-    | llm
-)
-
+# What the prompt sees of the conversation: recent turns + running summary, token-budgeted
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
 
 # Streamlit UI
-st.set_page_config(page_title="SEC Filings QA", layout="wide")
 st.title("📄 SEC Filings QA System (LangChain + Gemini)")
 st.markdown("Ask questions about 10-K, 8-K, DEF 14A filings across companies.")
 
-query = st.text_input("🔍 Ask a financial question", placeholder="E.g. What are Tesla's recent risk factors?")
+query = st.text_input("🔍 Ask a financial question", placeholder="E.g. What are Tesla's recent risk factors?",
+                      max_chars=MAX_QUESTION_CHARS)
 run_button = st.button("🔎 Run Query")
 
 if run_button and query:
-    # Retrieve new context
-    docs = retriever.get_relevant_documents(query)
-    context = format_docs(docs)
-
-    # Build history as string
-    history_text = ""
-    for turn in st.session_state.chat_history:
-        history_text += f"Q: {turn['question']}\nA: {turn['answer']}\n\n"
+    # Older turns are folded into the running summary here, before the next question,
+    # not after an answer: the finished answer never disappears while the summarizer runs.
+    # That Gemini call is part of this turn's latency and is reported as its own stage
+    start = time.perf_counter()
+    folded = st.session_state.memory.compact(summarize=llm_summarizer(llm))
+    summary_seconds = time.perf_counter() - start if folded else None
+    # Retrieve new context, restricted to the tickers/forms/years the question names
+    # (one concurrent retrieval per company for multi-company questions)
+    # With RERANK=1, a wider candidate set is reordered by the cross-encoder within its latency budget
+    query_embedding, docs, analysis = decomposed_search(search, analyzer, query, reranker=reranker)
+
+    # History within its budget; context gets the rest of the prompt budget, with
+    # adjacent chunks merged, overlap and near-duplicates removed, under citation headers
+    # (history, then the question, are cut if the prompt would not fit otherwise)
+    question, history_text, budget = fit_prompt(prompt.template, query, st.session_state.memory.render())
+    docs, context, _ = pack_context(docs, min(CONTEXT_TOKEN_BUDGET, budget))
 
     # Send to LLM
     chain_input = {
-        "question": query,
+        "question": question,
         "context": context,
-        "history": history_text.strip()
+        "history": history_text
     }
-    with st.spinner("Thinking..."):
-        answer = llm.invoke(prompt.format(**chain_input)).content
-
-    # Store in session
+    # Same question (by embedding) over the same chunks, prompt and history: reuse the answer
+    evidence, scope = chunk_ids(docs), prompt.template + history_text
+    answer = answer_cache.get(query_embedding, evidence, scope=scope)
+    cached = answer is not None
+    if cached:
+        elapsed = time.perf_counter() - start
+        timings = {"first_token_seconds": elapsed, "total_seconds": elapsed}
+    else:
+        # Stream tokens as they arrive; timings count from the start of retrieval
+        stream = TimedStream(llm.stream(prompt.format(**chain_input)), start=start)
+        live = st.empty()
+        with live.container():
+            st.markdown(f"**Q:** {query}")
+            st.write_stream(stream)
+        # The finished turn is rendered with the history below
+        live.empty()
+        answer, timings = stream.text, stream.timings()
+        answer_cache.put(query_embedding, evidence, answer, question=query, scope=scope)
+    timings["summary_seconds"] = summary_seconds
+    st.session_state.memory.add_turn(query, answer, defer=True)
+
+    # Store in session, with the evidence this turn actually used
     st.session_state.chat_history.append({
         "question": query,
         "answer": answer,
-        "context": context
+        "sources": source_records(docs),
+        "timings": timings,
+        "cached": cached,
+        "filter": describe(analysis),
+        "rerank": analysis.get("rerank")
     })
 
-# st.subheader("📂 Retrieved Documents")
-# docs = retriever.get_relevant_documents(query)
-# for i, d in enumerate(docs):
-#     meta = d.metadata
-#     st.markdown(f"**{i+1}. [{meta.get('ticker')} - {meta.get('filing_type')} - {meta.get('section')} - {meta.get('filing_date')}]**")
-#     st.code(d.page_content[:800] + "...", language="markdown")
-
 # Display full conversation
 if st.session_state.chat_history:
     st.subheader("🧠 Conversation History")
     for i, turn in enumerate(st.session_state.chat_history):
         st.markdown(f"**Q{i+1}:** {turn['question']}")
         st.markdown(f"**A{i+1}:** {turn['answer']}")
+        timings = turn.get("timings")
+        if timings and timings["first_token_seconds"] is not None:
+            source = " · 💾 cached answer" if turn.get("cached") else ""
+            if timings.get("summary_seconds") is not None:
+                source += f" · 🧠 history summarized in {timings['summary_seconds']:.2f}s"
+            if turn.get("filter"):
+                source += f" · 🎯 {turn['filter']}"
+            rerank = turn.get("rerank")
+            if rerank:
+                outcome = "over budget, bi-encoder order" if rerank["fallback"] else "reranked"
+                source += f" · 🔀 {rerank['pairs']} candidates {outcome} in {rerank['seconds'] * 1000:.0f} ms"
+            st.caption(f"⏱️ first token {timings['first_token_seconds']:.2f}s · total {timings['total_seconds']:.2f}s{source}")
         with st.expander("🔍 Context used"):
-            # st.code(turn['context'][:2000] + "..." if len(turn['context']) > 2000 else turn['context'], language="markdown")
             st.subheader("📂 Retrieved Documents")
-            docs = retriever.get_relevant_documents(query)
-            for i, d in enumerate(docs):
-                meta = d.metadata
-                st.markdown(f"**{i+1}. [{meta.get('ticker')} - {meta.get('filing_type')} - {meta.get('section')} - {meta.get('filing_date')}]**")
-                st.code(d.page_content[:800] + "...", language="markdown")
\ No newline at end of file
+            # Rendered from the turn itself: no search on rerun, and the right query's results
+            for j, source in enumerate(turn.get("sources", [])):
+                meta = source["metadata"]
+                st.markdown(f"**{j+1}. [{meta.get('ticker')} - {meta.get('filing_type')} - {meta.get('section')} - {meta.get('filing_date')}]**")
+                st.code(source["snippet"] + ("..." if source["truncated"] else ""), language="markdown")
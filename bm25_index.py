@@ -0,0 +1,322 @@
+"""
+BM25 inverted index over the chunk texts, and hybrid lexical + vector retrieval.
+
+MiniLM similarity is weak on exact tokens that matter in filings (tickers,
+Item numbers, dollar figures, defined terms); BM25 is strong on exactly
+those. The index is exported from the Chroma collection into:
+  - vocab.json     term → term id
+  - postings.npz   CSR postings: per-term offsets, row (uint32) and
+                   term frequency (uint16) arrays, document lengths, and
+                   per-row value codes of the FILTER_FIELDS
+  - ids.json       chunk ids aligned with the rows, and the distinct
+                   values behind the filter codes (written last)
+
+Metadata filters (see query_analyzer.py) are evaluated on the row codes,
+so a filtered lexical lookup never round-trips to Chroma.
+
+A rebuild first removes ids.json, writes every file via a temporary file
+and os.replace, and writes ids.json last; all files carry the same build
+id, so a reader never pairs postings with another build's ids.
+
+HybridRetriever runs the vector search and the BM25 lookup in parallel
+and merges the two rankings with reciprocal-rank fusion (RRF). Because
+lexical matches cover the exact-token cases, the vector side fetches only
+VECTOR_FETCH_K candidates.
+"""
+import os
+import re
+import json
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+from retrieval import search_by_vector
+
+BM25_INDEX_DIR = "bm25_index"
+EXPORT_PAGE_SIZE = 5000  # Documents read from Chroma per get() call
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # Rank damping in 1 / (RRF_K + rank)
+VECTOR_FETCH_K = 10  # Vector candidates fused per query
+LEXICAL_FETCH_K = 20  # BM25 candidates fused per query
+FILTER_FIELDS = ("ticker", "filing_type", "filing_date")  # Metadata kept per row for local filtering
+
+# Words, tickers, item numbers ("1a"), figures ("1,234.5" → "1234.5")
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,&'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the their this to was were "
+    "which will with what did does do how about".split())
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+def tokenize(text):
+    """Lowercased terms; thousands separators dropped so "$1,234" matches "1234" """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        token = token.replace(",", "")
+        if token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+def export_documents(collection, page_size=EXPORT_PAGE_SIZE):
+    """Yield (ids, documents, metadatas) pages of a Chroma collection"""
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        yield page["ids"], page["documents"], page["metadatas"]
+        offset += len(page["ids"])
+
+class BM25Index:
+    def __init__(self, ids, vocab, offsets, rows, tfs, doc_lens, fields=None):
+        self.ids = ids
+        self.vocab = vocab
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        # field → (per-row uint32 codes, {value: code})
+        self.fields = fields or {}
+        self.avg_len = float(doc_lens.mean()) if len(doc_lens) else 0.0
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, pages, index_dir=BM25_INDEX_DIR):
+        """Index (ids, texts, metadatas) pages and write the index files to index_dir"""
+        os.makedirs(index_dir, exist_ok=True)
+        ids_path = os.path.join(index_dir, "ids.json")
+        # No ids.json until every file of this build is in place: readers see no index, not a mixed one
+        if os.path.exists(ids_path):
+            os.remove(ids_path)
+        build_id = uuid.uuid4().hex
+        ids, vocab, doc_lens = [], {}, []
+        term_parts, row_parts, tf_parts = [], [], []
+        values = {field: {} for field in FILTER_FIELDS}
+        codes = {field: [] for field in FILTER_FIELDS}
+        for page_ids, texts, metadatas in pages:
+            for chunk_id, text, metadata in zip(page_ids, texts, metadatas):
+                counts = Counter(tokenize(text or ""))
+                row = len(ids)
+                ids.append(chunk_id)
+                for field in FILTER_FIELDS:
+                    value = (metadata or {}).get(field)
+                    codes[field].append(values[field].setdefault(value, len(values[field])))
+                doc_lens.append(sum(counts.values()))
+                term_parts.append(np.fromiter((vocab.setdefault(t, len(vocab)) for t in counts), dtype=np.uint32,
+                                              count=len(counts)))
+                row_parts.append(np.full(len(counts), row, dtype=np.uint32))
+                tf_parts.append(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+
+        terms = np.concatenate(term_parts) if term_parts else np.empty(0, dtype=np.uint32)
+        rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.uint32)
+        tfs = np.concatenate(tf_parts) if tf_parts else np.empty(0, dtype=np.int64)
+        order = np.lexsort((rows, terms))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+        tmp_path = os.path.join(index_dir, "postings.tmp.npz")
+        np.savez(tmp_path, build=np.array(build_id),
+                 offsets=offsets, rows=rows[order],
+                 tfs=np.minimum(tfs[order], np.iinfo(np.uint16).max).astype(np.uint16),
+                 doc_lens=np.asarray(doc_lens, dtype=np.uint32),
+                 **{f"field_{field}": np.asarray(codes[field], dtype=np.uint32) for field in FILTER_FIELDS})
+        os.replace(tmp_path, os.path.join(index_dir, "postings.npz"))
+        _write_json(os.path.join(index_dir, "vocab.json"), {"build": build_id, "terms": vocab})
+        # ids.json is written last: its presence marks a complete index
+        _write_json(ids_path, {"build": build_id, "k1": BM25_K1, "b": BM25_B, "ids": ids,
+                               "fields": {field: list(values[field]) for field in FILTER_FIELDS}})
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir=BM25_INDEX_DIR):
+        """Load a complete index; ValueError if the files come from different builds"""
+        with open(os.path.join(index_dir, "ids.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        with np.load(os.path.join(index_dir, "postings.npz")) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        builds = {meta.get("build"), vocab.get("build"), str(arrays["build"]) if "build" in arrays else None}
+        if len(builds) != 1 or None in builds or len(arrays["doc_lens"]) != len(meta["ids"]):
+            raise ValueError(f"BM25 index files in {index_dir} are from different builds (rebuild in progress?)")
+        fields = {field: (arrays[f"field_{field}"], {value: code for code, value in enumerate(field_values)})
+                  for field, field_values in meta.get("fields", {}).items() if f"field_{field}" in arrays}
+        return cls(meta["ids"], vocab["terms"], arrays["offsets"], arrays["rows"], arrays["tfs"], arrays["doc_lens"],
+                   fields)
+
+    def scores(self, query):
+        """BM25 score of every row for the query terms"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens / max(self.avg_len, 1e-9))
+        for term, query_tf in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.rows[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            idf = np.log(1 + (len(self.ids) - len(rows) + 0.5) / (len(rows) + 0.5))
+            # Each row appears once per term, so plain fancy-index addition is safe
+            scores[rows] += query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm[rows])
+        return scores
+
+    def row_mask(self, where):
+        """Boolean mask of the rows matching a Chroma where clause, or None if it
+        uses a field or operator not indexed here ($and/$or, $eq/$ne/$in/$nin)"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, value in where.items():
+            if key in ("$and", "$or"):
+                parts = [self.row_mask(clause) for clause in value]
+                if any(part is None for part in parts):
+                    return None
+                combined = np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts)
+                mask &= combined
+                continue
+            if key not in self.fields:
+                return None
+            if isinstance(value, dict):
+                if len(value) != 1:
+                    return None
+                op, operand = next(iter(value.items()))
+            else:
+                op, operand = "$eq", value
+            if op in ("$eq", "$ne"):
+                operand = [operand]
+            elif op not in ("$in", "$nin"):
+                return None
+            codes, code_of = self.fields[key]
+            wanted = [code_of[v] for v in operand if v in code_of]
+            matches = np.isin(codes, np.asarray(wanted, dtype=np.uint32))
+            mask &= ~matches if op in ("$ne", "$nin") else matches
+        return mask
+
+    def search(self, query, k=LEXICAL_FETCH_K, rows=None, mask=None):
+        """(ids, scores) of the top-k rows with a positive score, optionally among `rows` or a row `mask`"""
+        scores = self.scores(query)
+        if rows is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[np.asarray(rows, dtype=np.int64)] = True
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [self.ids[row] for row in hits], scores[hits].tolist()
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def is_complete(index_dir=BM25_INDEX_DIR):
+    """True if index_dir holds a loadable, current-format index whose files all come from one build"""
+    if not os.path.exists(os.path.join(index_dir, "ids.json")):
+        return False
+    try:
+        return set(BM25Index.load(index_dir).fields) == set(FILTER_FIELDS)
+    except (OSError, ValueError, KeyError):
+        return False
+
+def build_from_collection(collection, index_dir=BM25_INDEX_DIR):
+    """Export the collection's texts and (re)build the BM25 index"""
+    index = BM25Index.build(export_documents(collection), index_dir=index_dir)
+    print(f"🔤 BM25 index: {len(index)} chunks, {len(index.vocab)} terms, "
+          f"{len(index.rows)} postings in {index_dir}")
+    return index
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """chunk id → fused score for several ranked id lists"""
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + vector search merged with RRF.
+
+    `vector_retriever` is what make_retriever returned (quantized or plain
+    Chroma). `search_kwargs` accepts k and an optional Chroma `filter`,
+    applied to both sides.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: BM25Index
+    vector_retriever: object
+    vectorstore: object
+    embeddings: object
+    search_kwargs: dict = {"k": 5}
+    vector_k: int = VECTOR_FETCH_K
+    lexical_k: int = LEXICAL_FETCH_K
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        query_vector = self.embeddings.embed_query(query)
+        return self.hybrid_search(query, query_vector, self.search_kwargs.get("k", 5),
+                                  self.search_kwargs.get("filter"))
+
+    def _lexical(self, query, where):
+        if not where:
+            return self.index.search(query, self.lexical_k)
+        mask = self.index.row_mask(where)
+        if mask is not None:
+            return self.index.search(query, self.lexical_k, mask=mask)
+        # Filter on a field the index doesn't keep: ask Chroma for the partition
+        allowed = self.vectorstore.get(where=where, include=[])["ids"]
+        rows = [self.index.row_of[i] for i in allowed if i in self.index.row_of]
+        return self.index.search(query, self.lexical_k, rows=rows)
+
+    def hybrid_search(self, query, query_vector, k=5, where=None):
+        """Top-k documents by RRF over the vector and BM25 rankings"""
+        vector_future = _executor.submit(search_by_vector, self.vector_retriever, query_vector,
+                                         max(k, self.vector_k), where)
+        lexical_ids, lexical_scores = self._lexical(query, where)
+        vector_docs = vector_future.result()
+
+        vector_ids = [doc.id for doc in vector_docs]
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids])
+        top = sorted(fused, key=lambda chunk_id: -fused[chunk_id])[:k]
+
+        by_id = {doc.id: doc for doc in vector_docs}
+        missing = [chunk_id for chunk_id in top if chunk_id not in by_id]
+        if missing:
+            found = self.vectorstore.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                by_id[chunk_id] = Document(page_content=text, metadata=dict(metadata or {}), id=chunk_id)
+
+        bm25_score = dict(zip(lexical_ids, lexical_scores))
+        docs = []
+        for chunk_id in top:
+            if chunk_id not in by_id:
+                # Deleted from Chroma since the index was built
+                continue
+            doc = by_id[chunk_id]
+            metadata = dict(doc.metadata)
+            if "score" in metadata:
+                metadata["vector_score"] = metadata["score"]
+            if chunk_id in bm25_score:
+                metadata["bm25_score"] = bm25_score[chunk_id]
+            metadata["score"] = fused[chunk_id]
+            docs.append(Document(page_content=doc.page_content, metadata=metadata, id=chunk_id))
+        return docs
+
+def make_hybrid_retriever(vector_retriever, vectorstore, embeddings, search_kwargs, index_dir=BM25_INDEX_DIR):
+    """Hybrid retriever when a BM25 index has been built, else vector_retriever unchanged"""
+    if os.path.exists(os.path.join(index_dir, "ids.json")):
+        try:
+            index = BM25Index.load(index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            # Being rebuilt, or left incomplete by a crash: vector-only until the next reload
+            print(f"⚠️ BM25 index unusable, using vector retrieval only: {e}")
+            return vector_retriever
+        print(f"Using hybrid BM25 + vector retrieval ({len(index)} chunks) from {index_dir}")
+        return HybridRetriever(index=index, vector_retriever=vector_retriever, vectorstore=vectorstore,
+                               embeddings=embeddings, search_kwargs=search_kwargs)
+    return vector_retriever
@@ -1,125 +1,531 @@
 import os
 import glob
-import yaml
+import json
+import hashlib
+import argparse
+import itertools
+import threading
+import queue
+import multiprocessing as mp
 import chromadb
-from uuid import uuid4
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from streaming_splitter import SectionAwareSplitter, read_frontmatter, iter_blocks, WINDOW_SIZE
+from embedding_backend import EmbeddingBackend, EmbeddingPool, check_compatibility, EMBEDDING_BACKENDS, POOL_SHARD_SIZE
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_SIZE
+from near_dedup import DedupIndex, minhash, DEDUP_INDEX_PATH
+import answer_cache
+from bm25_index import build_from_collection as build_bm25_index, is_complete as bm25_index_complete, BM25_INDEX_DIR
+from query_analyzer import build_catalog, METADATA_CATALOG_PATH
+from retrieval import mark_collection_changed
+from quantized_store import QuantizedIndex, build_from_collection, QUANTIZED_INDEX_DIR, QUANTIZATION_MODES
 import time
 
 # Setup paths
 MARKDOWN_DIR = "cleaned_filings"
 CHROMA_DB_DIR = "chroma_db"
+COLLECTION_NAME = "sec_filings"
+LEDGER_PATH = "ingest_ledger.json"
 
-# Load model
-print("Loading embedding model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-# Setup Chroma client
-print(f"Saving DB to: {os.path.abspath(CHROMA_DB_DIR)}")
-chroma_client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-collection = chroma_client.get_or_create_collection(name="sec_filings")
-
-# Text splitter config
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    separators=["\n\n", "\n", ".", " "]
-)
-
-# Helper to parse frontmatter
-def parse_markdown_file(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-    if content.startswith("---"):
-        parts = content.split("---", 2)
-        metadata = yaml.safe_load(parts[1])
-        body = parts[2].strip()
-        return metadata, body
+# Model + splitter config (stored in the ledger, a change forces a full rebuild)
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = "torch"  # "onnx" / "onnx-int8" are faster on CPU, see embedding_backend.py
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SEPARATORS = ["\n\n", "\n", ".", " "]
+BATCH_SIZE = 256  # Chunks per encode call (and per Chroma write)
+QUEUE_SIZE = 8  # Max in-flight messages between stages (backpressure)
+
+def ingest_config(dedup=False):
+    """Settings that change chunk boundaries, vectors or which chunks are stored"""
+    config = {
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "separators": SEPARATORS,
+        "window_size": WINDOW_SIZE,
+        "section_aware": "headings-attached",
+    }
+    if dedup:
+        config["dedup"] = "shared-vectors"
+    return config
+
+def file_fingerprint(filepath):
+    """SHA-256 of the file contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_chunk_id(accession, index, chunk):
+    """Deterministic chunk id: accession number + chunk position + content hash"""
+    content_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{accession}_{index:05d}_{content_hash}"
+
+def load_ledger(path=LEDGER_PATH):
+    """Load the per-file fingerprint ledger ({} if missing)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_ledger(ledger, path=LEDGER_PATH):
+    """Write the ledger atomically so a crash never leaves it half-written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ledger, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def plan_ingestion(filepaths, ledger):
+    """Split files into (to_ingest, to_delete) against the ledger.
+
+    Files whose size and mtime match the ledger are skipped without hashing;
+    otherwise the content hash decides. Changed files appear in both lists
+    so their old chunks are removed before the new ones are written.
+    """
+    files = ledger.get("files", {})
+    current = {os.path.basename(p): p for p in filepaths}
+
+    to_ingest = []
+    to_delete = [name for name in files if name not in current]
+
+    for name, path in current.items():
+        stat = os.stat(path)
+        entry = files.get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        fingerprint = file_fingerprint(path)
+        if entry and entry["fingerprint"] == fingerprint:
+            # Touched but not modified: just refresh the stat fields
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            continue
+        if entry:
+            to_delete.append(name)
+        to_ingest.append((path, fingerprint, stat.st_size, stat.st_mtime))
+
+    return to_ingest, to_delete
+
+def delete_source_docs(collection, ledger, names):
+    """Remove every chunk of the given source files from Chroma and the ledger"""
+    files = ledger.setdefault("files", {})
+    for name in names:
+        collection.delete(where={"source_doc": name})
+        files.pop(name, None)
+        print(f"Removed chunks of: {name}")
+
+def drop_files(collection, ledger, names, dedup=None, reingest=()):
+    """delete_source_docs, keeping the dedup index consistent.
+
+    Only same-filing duplicates are dropped and copies in other filings
+    keep their own row and vector, so no other file has to be re-ingested.
+    """
+    names = set(names)
+    delete_source_docs(collection, ledger, sorted(names))
+    if dedup is not None:
+        dedup.refresh_metadata(collection, dedup.forget_docs(names | set(reingest)))
+
+class StageStats:
+    """Busy time and item counts for one pipeline stage"""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+
+    def record(self, items, seconds):
+        self.items += items
+        self.busy += seconds
+
+    def report(self, wall_time):
+        rate = self.items / self.busy if self.busy else 0.0
+        utilization = 100 * self.busy / wall_time if wall_time else 0.0
+        print(f"  {self.name:<7} {self.items:>8} {self.unit:<7} busy {self.busy:8.2f}s "
+              f"({rate:8.1f} {self.unit}/s, {utilization:5.1f}% of wall time)")
+
+def split_file(path):
+    """Open one markdown file for streaming.
+
+    Returns (accession, generator of (chunk, metadata, id)). Only the
+    frontmatter is read up front; the body is read and split in windows as
+    the generator is consumed, which also closes the file.
+    """
+    name = os.path.basename(path)
+    f = open(path, "r", encoding="utf-8")
+    try:
+        metadata, first = read_frontmatter(f)
+    except Exception:
+        f.close()
+        raise
+    accession = metadata.get("accession_number") or os.path.splitext(name)[0]
+    return accession, iter_file_chunks(f, first, metadata, accession, name)
+
+def iter_file_chunks(f, first, metadata, accession, name):
+    with f:
+        blocks = iter_blocks(f, first)
+        # Skip near-empty bodies without streaming the whole file
+        head = ""
+        for block in blocks:
+            head += block
+            if len(head.strip()) >= 100:
+                break
+        if len(head.strip()) < 100:
+            return
+
+        # Chunks before the first PART/Item header keep the frontmatter section
+        default_section = metadata.get("section") or metadata.get("filing_type") or "Unknown"
+        splitter = SectionAwareSplitter(CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS,
+                                        default_section=default_section)
+        chunk_stream = splitter.split_stream(itertools.chain([head], blocks))
+        for i, (chunk, section) in enumerate(chunk_stream):
+            # Extend metadata with the real PART/Item section and chunk index
+            metadata_chunked = {
+                **metadata,
+                **section,
+                "chunk_index": i,
+                "source_doc": name
+            }
+            yield chunk, metadata_chunked, make_chunk_id(accession, i, chunk)
+
+def parse_worker(task_queue, chunk_queue, dedup=False):
+    """Process-pool worker: parse + split files and stream chunks downstream.
+
+    Emits ("chunks", ...) messages of at most BATCH_SIZE chunks (with MinHash
+    signatures when deduplicating, None otherwise) as soon as
+    they are split, then a ("file", name, entry) marker once every chunk of
+    that file has been sent, and finally ("done", chunk_count, busy_seconds,
+    file_count). Memory is bounded by the splitter window plus one batch.
+    """
+    busy = 0.0
+    files = 0
+    total_chunks = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        path, fingerprint, size, mtime = task
+        name = os.path.basename(path)
+        chunks, metadatas, ids, signatures = [], [], [], []
+        count = 0
+        start = time.time()
+        try:
+            accession, file_chunks = split_file(path)
+            for chunk, metadata, uid in file_chunks:
+                chunks.append(chunk)
+                metadatas.append(metadata)
+                ids.append(uid)
+                if dedup:
+                    signatures.append(minhash(chunk))
+                count += 1
+                if len(chunks) >= BATCH_SIZE:
+                    busy += time.time() - start
+                    chunk_queue.put(("chunks", chunks, metadatas, ids, signatures if dedup else None))
+                    chunks, metadatas, ids, signatures = [], [], [], []
+                    start = time.time()
+        except Exception as e:
+            busy += time.time() - start
+            total_chunks += count
+            chunk_queue.put(("error", name, str(e)))
+            continue
+        busy += time.time() - start
+        files += 1
+        total_chunks += count
+
+        if chunks:
+            chunk_queue.put(("chunks", chunks, metadatas, ids, signatures if dedup else None))
+        chunk_queue.put(("file", name, {
+            "fingerprint": fingerprint,
+            "size": size,
+            "mtime": mtime,
+            "accession": accession,
+            "chunks": count,
+        }))
+    chunk_queue.put(("done", total_chunks, busy, files))
+
+def writer_worker(collection, ledger, write_queue, stats, errors, dedup=None):
+    """Background thread: upsert embedded batches and commit finished files to the ledger"""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        chunks, metadatas, ids, embeddings, finished_files, canonical_ids, vector_of = item
+        start = time.time()
+        try:
+            if vector_of:
+                # Earlier batches are written by now, so every root vector is available
+                embeddings = dedup.fill_shared(collection, ids, embeddings, vector_of)
+            if chunks:
+                # Upsert so re-running a half-finished file never duplicates ids
+                collection.upsert(
+                    documents=chunks,
+                    metadatas=metadatas,
+                    ids=ids,
+                    embeddings=embeddings
+                )
+            if canonical_ids:
+                # After the upsert: canonicals from this very batch now exist
+                dedup.refresh_metadata(collection, canonical_ids)
+            # Every chunk of these files was queued before this batch, so they are complete
+            for name, entry in finished_files:
+                ledger["files"][name] = entry
+            save_ledger(ledger)
+        except Exception as e:
+            # Keep draining so upstream stages never block on a full queue;
+            # files in this batch stay out of the ledger and are retried next run
+            errors.append(("write", str(e)))
+            print(f"❌ Chroma write failed: {e}")
+        stats.record(len(chunks), time.time() - start)
+
+def run_pipeline(model, collection, ledger, to_ingest, workers, cache=None, batch_size=BATCH_SIZE,
+                 dedup=None):
+    """Parse/split (process pool) → encode (this thread) → write (background thread).
+
+    Stages are connected by bounded queues so a slow stage applies
+    backpressure instead of letting chunks pile up in memory. With a
+    cache, only chunks whose text has not been embedded before are encoded.
+    With a dedup index, near-duplicates of stored chunks are not encoded:
+    copies within a filing are dropped, copies from another filing are
+    written with the stored chunk's vector, and both are recorded on it.
+    """
+    parse_stats = StageStats("parse", "chunks")
+    encode_stats = StageStats("encode", "chunks")
+    write_stats = StageStats("write", "chunks")
+    errors = []
+
+    ctx = mp.get_context("spawn")
+    task_queue = ctx.Queue()
+    chunk_queue = ctx.Queue(maxsize=QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    for task in to_ingest:
+        task_queue.put(task)
+    workers = max(1, min(workers, len(to_ingest)))
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = [ctx.Process(target=parse_worker, args=(task_queue, chunk_queue, dedup is not None), daemon=True)
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    writer = threading.Thread(target=writer_worker,
+                              args=(collection, ledger, write_queue, write_stats, errors, dedup),
+                              daemon=True)
+    writer.start()
+
+    pipeline_start = time.time()
+    buffer_chunks, buffer_metadatas, buffer_ids, buffer_signatures = [], [], [], []
+    # Files whose chunks are all buffered; handed to the writer with the next flush
+    finished_files = []
+
+    def flush():
+        start = time.time()
+        canonical_ids, vector_of = set(), {}
+        to_encode = len(buffer_chunks)
+        if dedup is not None and buffer_chunks:
+            keep, shared, canonical_ids = dedup.filter_batch(buffer_signatures, buffer_metadatas, buffer_ids)
+            # Chunks to encode first, then those stored with a shared vector
+            rows = keep + sorted(shared)
+            vector_of = {buffer_ids[i]: shared[i] for i in sorted(shared)}
+            buffer_chunks[:] = [buffer_chunks[i] for i in rows]
+            buffer_metadatas[:] = [buffer_metadatas[i] for i in rows]
+            buffer_ids[:] = [buffer_ids[i] for i in rows]
+            to_encode = len(keep)
+        if not to_encode:
+            embeddings = []
+        elif cache is not None:
+            embeddings = cache.encode(model.encode, buffer_chunks[:to_encode]).tolist()
+        else:
+            embeddings = model.encode(buffer_chunks[:to_encode]).tolist()
+        embeddings += [None] * (len(buffer_chunks) - to_encode)
+        encode_stats.record(to_encode, time.time() - start)
+        write_queue.put((list(buffer_chunks), list(buffer_metadatas), list(buffer_ids),
+                         embeddings, list(finished_files), canonical_ids, vector_of))
+        buffer_chunks.clear()
+        buffer_metadatas.clear()
+        buffer_ids.clear()
+        buffer_signatures.clear()
+        finished_files.clear()
+
+    running = workers
+    while running:
+        try:
+            message = chunk_queue.get(timeout=1)
+        except queue.Empty:
+            # A worker that crashed (e.g. OOM-killed) never sends "done"
+            if not any(p.is_alive() for p in processes) and chunk_queue.empty():
+                errors.append(("parse", "worker processes exited unexpectedly"))
+                print("❌ Parse workers exited unexpectedly")
+                break
+            continue
+        kind = message[0]
+        if kind == "chunks":
+            _, chunks, metadatas, ids, signatures = message
+            buffer_chunks.extend(chunks)
+            buffer_metadatas.extend(metadatas)
+            buffer_ids.extend(ids)
+            buffer_signatures.extend(signatures or [])
+            if len(buffer_chunks) >= batch_size:
+                flush()
+        elif kind == "file":
+            _, name, entry = message
+            print(f"{name} → {entry['chunks']} chunks")
+            finished_files.append((name, entry))
+        elif kind == "error":
+            _, name, error = message
+            errors.append((name, error))
+            print(f"❌ Failed to split {name}: {error}")
+        elif kind == "done":
+            _, chunk_count, busy, _ = message
+            parse_stats.record(chunk_count, busy)
+            running -= 1
+
+    # Process remaining chunks (and commit any trailing file markers)
+    if buffer_chunks or finished_files:
+        flush()
+    write_queue.put(None)
+    writer.join()
+    for p in processes:
+        p.join()
+
+    wall_time = time.time() - pipeline_start
+    print(f"Pipeline finished in {wall_time:.2f}s ({workers} parse workers)")
+    parse_stats.report(wall_time * workers)
+    encode_stats.report(wall_time)
+    write_stats.report(wall_time)
+    if cache is not None:
+        cache.report()
+    if dedup is not None:
+        dedup.report()
+    if errors:
+        print(f"⚠️ {len(errors)} errors, affected files will be retried next run:")
+        for e in errors:
+            print("  -", e)
+        # A file can fail mid-stream after some of its chunks were written
+        failed_files = [name for name, _ in errors if name not in ("write", "parse")]
+        drop_files(collection, ledger, failed_files, dedup)
+        save_ledger(ledger)
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Split + embed cleaned filings into ChromaDB")
+    parser.add_argument("--full", action="store_true",
+                        help="drop the collection and ledger and rebuild from scratch")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="parse/split worker processes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always call the model, bypassing the embedding cache")
+    parser.add_argument("--cache-size", type=int, default=EMBEDDING_CACHE_SIZE,
+                        help="max vectors kept in the embedding cache")
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND,
+                        help="embedding runtime (vectors are checked against the torch model)")
+    parser.add_argument("--threads", type=int,
+                        help="intra-op threads per embedding model (default: runtime's choice, "
+                             "or cores / --embed-workers)")
+    parser.add_argument("--embed-workers", type=int, default=0,
+                        help="encode in this many processes, each with its own model copy (0: in-process)")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES,
+                        help=f"(re)build the compact first-pass index in {QUANTIZED_INDEX_DIR}/")
+    parser.add_argument("--quantize-dims", type=int,
+                        help="reduce vectors to this many PCA dimensions before quantizing")
+    parser.add_argument("--no-bm25", action="store_true",
+                        help=f"skip (re)building the BM25 lexical index in {BM25_INDEX_DIR}/")
+    parser.add_argument("--dedup", action="store_true",
+                        help=f"collapse near-duplicate chunks (MinHash/LSH index in {DEDUP_INDEX_PATH})")
+    args = parser.parse_args()
+
+    # Load model
+    print(f"Loading embedding model ({args.backend} backend)...")
+    if args.embed_workers:
+        model = EmbeddingPool(EMBEDDING_MODEL, args.backend, args.embed_workers, args.threads)
+        print(f"Embedding pool: {model.workers} workers x {model.threads} threads")
     else:
-        return {}, content.strip()
-
-# Process all markdown files with batching
-filepaths = glob.glob(os.path.join(MARKDOWN_DIR, "*.md"))
-print(f"Found {len(filepaths)} markdown files to split + ingest")
-
-# Batch processing variables
-all_chunks = []
-all_metadatas = []
-all_ids = []
-batch_size = 100  # Process chunks in batches
-
-start_time = time.time()
-
-for path in filepaths:
-    print(f"Processing: {os.path.basename(path)}")
-    metadata, body = parse_markdown_file(path)
-    if not body or len(body) < 100:
-        continue
-
-    chunks = text_splitter.split_text(body)
-    print(f"{os.path.basename(path)} → {len(chunks)} chunks")
-
-    # Prepare batch data
-    for i, chunk in enumerate(chunks):
-        uid = str(uuid4())
-        
-        # Extend metadata with chunk index
-        metadata_chunked = {
-            **metadata,
-            "chunk_index": i,
-            "source_doc": os.path.basename(path)
-        }
-
-        all_chunks.append(chunk)
-        all_metadatas.append(metadata_chunked)
-        all_ids.append(uid)
-
-        # Process in batches
-        if len(all_chunks) >= batch_size:
-            print(f"Generating embeddings for batch of {len(all_chunks)} chunks...")
-            batch_start = time.time()
-            
-            # Generate embeddings for the entire batch at once
-            embeddings = model.encode(all_chunks)
-            
-            # Add to ChromaDB in batch
-            collection.add(
-                documents=all_chunks,
-                metadatas=all_metadatas,
-                ids=all_ids,
-                embeddings=embeddings.tolist()
-            )
-            
-            batch_time = time.time() - batch_start
-            print(f"Batch processed in {batch_time:.2f}s ({len(all_chunks)} chunks)")
-            
-            # Reset batch
-            all_chunks = []
-            all_metadatas = []
-            all_ids = []
-
-# Process remaining chunks
-if all_chunks:
-    print(f"Processing final batch of {len(all_chunks)} chunks...")
-    batch_start = time.time()
-    
-    # Generate embeddings for the final batch
-    embeddings = model.encode(all_chunks)
-    
-    # Add to ChromaDB in batch
-    collection.add(
-        documents=all_chunks,
-        metadatas=all_metadatas,
-        ids=all_ids,
-        embeddings=embeddings.tolist()
-    )
-    
-    batch_time = time.time() - batch_start
-    print(f"Final batch processed in {batch_time:.2f}s ({len(all_chunks)} chunks)")
-
-# ChromaDB persists automatically in newer versions
-print("ChromaDB data is automatically persisted to disk")
-total_time = time.time() - start_time
-print(f"All documents chunked, embedded and stored in Chroma!")
-print(f"Total processing time: {total_time:.2f}s")
+        model = EmbeddingBackend(EMBEDDING_MODEL, args.backend, args.threads)
+    # Enough chunks per flush to give every pool worker two shards
+    batch_size = max(BATCH_SIZE, 2 * args.embed_workers * POOL_SHARD_SIZE)
+    if args.backend != "torch":
+        similarity = check_compatibility(model)
+        print(f"{args.backend} vectors match the torch model (min cosine {similarity:.4f})")
+
+    # Setup Chroma client
+    print(f"Saving DB to: {os.path.abspath(CHROMA_DB_DIR)}")
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+
+    ledger = load_ledger()
+    full = args.full
+    if not full and ledger.get("config") != ingest_config(args.dedup):
+        if ledger:
+            print("Chunking/model config changed since last run, rebuilding")
+        elif collection.count() > 0:
+            print("Collection has chunks but no ledger (random ids), rebuilding")
+        full = True
+
+    if full:
+        chroma_client.delete_collection(name=COLLECTION_NAME)
+        collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+        ledger = {}
+    ledger["config"] = ingest_config(args.dedup)
+    ledger.setdefault("files", {})
+
+    dedup = None
+    if args.dedup:
+        dedup = DedupIndex(DEDUP_INDEX_PATH)
+        if full:
+            dedup.reset()
+
+    filepaths = glob.glob(os.path.join(MARKDOWN_DIR, "*.md"))
+    to_ingest, to_delete = plan_ingestion(filepaths, ledger)
+    print(f"Found {len(filepaths)} markdown files: {len(to_ingest)} new/changed, "
+          f"{len(to_delete)} changed/removed to clean up")
+
+    planned = {os.path.basename(task[0]) for task in to_ingest}
+    drop_files(collection, ledger, to_delete, dedup, reingest=planned)
+    save_ledger(ledger)
+
+    cache = None
+    if not args.no_cache:
+        cache = EmbeddingCache(model.cache_name, model.get_sentence_embedding_dimension(),
+                               cache_dir=EMBEDDING_CACHE_DIR, max_entries=args.cache_size)
+        print(f"Embedding cache: {len(cache)} vectors in {cache.dir}")
+
+    start_time = time.time()
+    try:
+        if to_ingest:
+            run_pipeline(model, collection, ledger, to_ingest, args.workers, cache, batch_size, dedup)
+    finally:
+        if cache is not None:
+            cache.flush()
+        if args.embed_workers:
+            model.close()
+
+    # An existing quantized index is rebuilt with its own settings so it never goes stale
+    quantize, quantize_dims = args.quantize, args.quantize_dims
+    if not quantize and (to_ingest or to_delete) and os.path.exists(os.path.join(QUANTIZED_INDEX_DIR, "ids.json")):
+        existing = QuantizedIndex.load(QUANTIZED_INDEX_DIR)
+        quantize, quantize_dims = existing.mode, existing.pca_dims
+    if quantize:
+        print(f"Building {quantize} quantized index...")
+        build_from_collection(collection, mode=quantize, dims=quantize_dims)
+
+    # The BM25 index mirrors the collection's texts for hybrid retrieval
+    if not args.no_bm25 and (full or to_ingest or to_delete or not bm25_index_complete(BM25_INDEX_DIR)):
+        print("Building BM25 lexical index...")
+        build_bm25_index(collection)
+
+    # Filings the query analyzer can filter on
+    if full or to_ingest or to_delete or not os.path.exists(METADATA_CATALOG_PATH):
+        build_catalog(collection)
+
+    # Cached answers were generated from the old chunks; running front-ends
+    # reload their retriever, search cache and catalog on the new version stamp
+    if full or to_ingest or to_delete:
+        answer_cache.invalidate()
+        mark_collection_changed()
+
+    # ChromaDB persists automatically in newer versions
+    print("ChromaDB data is automatically persisted to disk")
+    total_time = time.time() - start_time
+    print(f"All documents chunked, embedded and stored in Chroma!")
+    print(f"Total processing time: {total_time:.2f}s")
+
+if __name__ == "__main__":
+    main()
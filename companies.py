@@ -0,0 +1,18 @@
+"""
+Companies covered by the pipeline: used by the metadata fetch and by the question analyzer.
+
+No imports, so the serving front-ends can use it without loading the fetch
+script (dotenv, sec-api, the metadata store).
+"""
+
+# Tickers across various sectors
+TICKERS = ["AAPL", "TSLA", "JPM", "PFE", "XOM", "AMZN", "BA", "NVDA", "DIS", "UNH"]
+
+# Names questions use that are shorter than the registered name, per ticker
+# (the full name without Inc./Corp./Co. is matched from the catalog anyway)
+SHORT_NAMES = {
+    "JPM": ["jpmorgan", "jp morgan"],
+    "XOM": ["exxon", "exxonmobil"],
+    "DIS": ["disney"],
+    "UNH": ["unitedhealthcare"],
+}
@@ -0,0 +1,120 @@
+"""
+Context packing: retrieved chunks → compact, cited passages under a token budget.
+
+Chunks are split with CHUNK_OVERLAP characters of overlap, so neighbours
+from one filing repeat text. Before the prompt is built:
+  - hits from the same source_doc with consecutive chunk_index are merged
+    into one passage and the overlapping text is kept once
+  - passages whose word shingles are DEDUP_THRESHOLD or more contained in
+    better-ranked passages (e.g. boilerplate repeated across years) are
+    dropped
+  - passages are packed best-rank first into the token budget, each under
+    a numbered citation header; numbering follows retrieval rank, so the
+    same evidence always gets the same headers
+"""
+import numpy as np
+from near_dedup import shingle_hashes, DEDUP_THRESHOLD
+from conversation_memory import count_tokens, fit_docs
+
+CONTEXT_TOKEN_BUDGET = 3000  # Max context tokens per prompt (less if history needs the room)
+MIN_OVERLAP = 20  # Shortest shared run (chars) treated as chunk overlap
+MAX_OVERLAP = 400  # Longest overlap searched for (CHUNK_OVERLAP is 200)
+
+def strip_overlap(previous, text, min_overlap=MIN_OVERLAP, max_overlap=MAX_OVERLAP):
+    """`text` without the prefix it shares with the end of `previous`"""
+    head = text[:min_overlap]
+    if len(head) < min_overlap:
+        return text
+    tail = previous[-max_overlap:]
+    pos = tail.find(head)
+    while pos != -1:
+        shared = len(tail) - pos
+        if text[:shared] == tail[pos:]:
+            return text[shared:].lstrip()
+        pos = tail.find(head, pos + 1)
+    return text
+
+class Passage:
+    """Consecutive chunks of one filing, ranked by its best chunk"""
+
+    def __init__(self, doc, rank):
+        self.docs = [doc]
+        self.rank = rank
+        self.metadata = doc.metadata
+        self.text = doc.page_content
+
+    @property
+    def first_index(self):
+        return self.docs[0].metadata.get("chunk_index")
+
+    @property
+    def last_index(self):
+        return self.docs[-1].metadata.get("chunk_index")
+
+    def extend(self, doc, rank):
+        self.text = self.text + "\n" + strip_overlap(self.text, doc.page_content)
+        self.docs.append(doc)
+        self.rank = min(self.rank, rank)
+
+    def header(self, number):
+        meta = self.metadata
+        chunks = f"{self.first_index}" if len(self.docs) == 1 else f"{self.first_index}-{self.last_index}"
+        return (f"[{number}] [{meta.get('ticker')}, {meta.get('filing_type')}, {meta.get('section')}, "
+                f"{meta.get('filing_date')}] ({meta.get('source_doc')} #{chunks})")
+
+def merge_adjacent(docs):
+    """Passages of consecutive same-filing chunks, in best-rank order"""
+    passages, loose = [], []
+    by_doc = {}
+    for rank, doc in enumerate(docs):
+        source, index = doc.metadata.get("source_doc"), doc.metadata.get("chunk_index")
+        if source is None or not isinstance(index, int):
+            loose.append(Passage(doc, rank))
+        else:
+            by_doc.setdefault(source, []).append((index, rank, doc))
+    for hits in by_doc.values():
+        hits.sort(key=lambda hit: hit[0])
+        current = None
+        for index, rank, doc in hits:
+            if current is not None and index == current.last_index:
+                # The same chunk twice (e.g. from two sub-queries)
+                current.rank = min(current.rank, rank)
+            elif current is not None and index == current.last_index + 1:
+                current.extend(doc, rank)
+            else:
+                current = Passage(doc, rank)
+                passages.append(current)
+    return sorted(passages + loose, key=lambda passage: passage.rank)
+
+def drop_near_duplicates(passages, threshold=DEDUP_THRESHOLD):
+    """Passages (best rank first) minus those mostly contained in better ones.
+
+    Containment, not Jaccard: a single chunk repeated inside a longer merged
+    passage is a duplicate even though the two differ in length.
+    """
+    kept, seen = [], np.empty(0, dtype=np.uint64)
+    for passage in passages:
+        shingles = shingle_hashes(passage.text)
+        if len(seen) and np.isin(shingles, seen).mean() >= threshold:
+            continue
+        kept.append(passage)
+        seen = np.union1d(seen, shingles)
+    return kept
+
+def pack_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """(docs used, context text, stats) for the ranked docs within `budget` tokens"""
+    raw_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+    passages = drop_near_duplicates(merge_adjacent(docs))
+    kept, texts = fit_docs(passages, lambda passage: f"{passage.header(0)}\n{passage.text}", budget)
+    # Numbered after fitting, so the citations that reach the prompt are 1..n
+    texts = [text.replace("[0] ", f"[{number}] ", 1) for number, text in enumerate(texts, start=1)]
+    used = [doc for passage in kept for doc in passage.docs]
+    context = "\n\n".join(texts)
+    stats = {
+        "chunks": len(docs),
+        "chunks_used": len(used),
+        "passages": len(kept),
+        "raw_tokens": raw_tokens,
+        "context_tokens": count_tokens(context),
+    }
+    return used, context, stats
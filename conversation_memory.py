@@ -0,0 +1,171 @@
+"""
+Token-budgeted conversation memory and prompt budget.
+
+Every prompt gets at most PROMPT_TOKEN_BUDGET tokens. Chat history takes
+up to HISTORY_TOKEN_BUDGET of it: turns stay verbatim until the budget is
+reached, then all but the last RECENT_TURNS are folded into a running
+summary written by the LLM (capped at SUMMARY_TOKEN_BUDGET). Retrieved
+context gets what is left after the template, question and history;
+lower-ranked chunks that don't fit are dropped. If a long question leaves
+less than MIN_CONTEXT_TOKENS, history and then the question are cut
+instead of going over the budget.
+
+Tokens are estimated at CHARS_PER_TOKEN characters each: close enough for
+English filings text, and free (no tokenizer or API call on the hot path).
+"""
+import math
+
+PROMPT_TOKEN_BUDGET = 6000  # Template + history + question + context
+HISTORY_TOKEN_BUDGET = 1500  # Summary + verbatim recent turns
+SUMMARY_TOKEN_BUDGET = 400  # Running summary of older turns
+RECENT_TURNS = 3  # Turns always kept verbatim (if they fit)
+MIN_CONTEXT_TOKENS = 500  # Context never gets less than this
+MAX_QUESTION_CHARS = 2000  # Longest question the front-ends accept
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a financial analyst and an
+assistant answering from SEC filings. Keep companies, filings, figures and conclusions;
+drop pleasantries. At most {words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+def count_tokens(text):
+    """Estimated token count of text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def truncate_tokens(text, tokens, from_end=False):
+    """text cut to at most `tokens` tokens; from_end keeps the end instead of the beginning"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    if limit <= 3:
+        return ""
+    if from_end:
+        return "..." + text[len(text) - limit + 3:].lstrip()
+    return text[:limit - 3].rstrip() + "..."
+
+def format_turns(turns):
+    return "\n\n".join(f"Q: {turn['question']}\nA: {turn['answer']}" for turn in turns)
+
+def llm_summarizer(llm):
+    """summarize(summary, turns) backed by a LangChain chat model"""
+    def summarize(summary, turns):
+        words = int(SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN / 6)
+        prompt = SUMMARY_PROMPT.format(words=words, summary=summary or "(none)", turns=format_turns(turns))
+        return llm.invoke(prompt).content
+    return summarize
+
+class ConversationMemory:
+    """Recent turns verbatim + running summary of older ones, within a token budget.
+
+    Kept in the Streamlit session; the display history (with sources) is
+    separate and unaffected.
+    """
+
+    def __init__(self, history_budget=HISTORY_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET,
+                 recent_turns=RECENT_TURNS):
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self.recent_turns = recent_turns
+        self.summary = ""
+        self.turns = []
+        self.summarized_turns = 0
+
+    def render(self):
+        """History text for the prompt"""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation:\n{self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        return "\n\n".join(parts)
+
+    def tokens(self):
+        return count_tokens(self.render())
+
+    def add_turn(self, question, answer, summarize=None, defer=False):
+        """Record a turn; with defer=True folding waits for the next compact() (e.g. the next question)"""
+        self.turns.append({"question": question, "answer": answer})
+        if not defer:
+            self.compact(summarize)
+
+    def compact(self, summarize=None):
+        """Fold old turns into the summary once the history is over budget.
+
+        Everything but the last RECENT_TURNS is folded in one summarizer
+        call, so the LLM is asked only every few turns; recent turns are
+        folded too if the history is still over budget (the newest turn is
+        never folded, but is truncated if it alone is too long). Without a
+        summarizer, or if it fails, the summary keeps just the folded questions.
+        Returns the number of turns folded.
+        """
+        fold = 0
+        if self.tokens() > self.history_budget:
+            fold = max(0, len(self.turns) - self.recent_turns)
+            while len(self.turns) - fold > 1 and self._tokens_without(fold) > self.history_budget:
+                fold += 1
+        if fold:
+            folded, self.turns = self.turns[:fold], self.turns[fold:]
+            self.summarized_turns += len(folded)
+            summary = None
+            if summarize is not None:
+                try:
+                    summary = summarize(self.summary, folded)
+                except Exception as e:
+                    print(f"⚠️ Summarizing history failed, keeping questions only: {e}")
+            if summary is None:
+                questions = "\n".join(f"- {turn['question']}" for turn in folded)
+                summary = f"{self.summary}\n{questions}".strip()
+            self.summary = truncate_tokens(summary.strip(), self.summary_budget)
+        if self.tokens() > self.history_budget and self.turns:
+            # A single oversized answer: keep its beginning
+            room = self.history_budget - count_tokens(self.summary) - count_tokens(self.turns[-1]["question"]) - 20
+            self.turns[-1] = {**self.turns[-1], "answer": truncate_tokens(self.turns[-1]["answer"], max(room, 0))}
+        return fold
+
+    def _tokens_without(self, fold):
+        # Upper bound: the summary is capped, the remaining turns are verbatim
+        summary_tokens = self.summary_budget if fold or self.summary else 0
+        return summary_tokens + count_tokens(format_turns(self.turns[fold:]))
+
+    def stats(self):
+        return {"turns_verbatim": len(self.turns), "turns_summarized": self.summarized_turns,
+                "history_tokens": self.tokens()}
+
+def fit_prompt(template, question, history, budget=PROMPT_TOKEN_BUDGET):
+    """(question, history, context tokens) such that the whole prompt stays within `budget`.
+
+    Context gets what the template, question and history leave, but at
+    least MIN_CONTEXT_TOKENS: to make room, the oldest history goes first,
+    then the end of the question.
+    """
+    room = budget - count_tokens(template) - MIN_CONTEXT_TOKENS
+    history = truncate_tokens(history, max(0, room - count_tokens(question)), from_end=True)
+    question = truncate_tokens(question, max(0, room - count_tokens(history)))
+    return question, history, budget - count_tokens(template) - count_tokens(question) - count_tokens(history)
+
+def fit_docs(docs, format_doc, budget):
+    """Docs, in rank order, whose formatted text fits in `budget` tokens.
+
+    The top-ranked chunk is always kept (truncated if needed); lower-ranked
+    chunks that don't fit are dropped. Returns (docs, formatted texts).
+    """
+    kept, texts, used = [], [], 0
+    for doc in docs:
+        text = format_doc(doc)
+        tokens = count_tokens(text) + 1
+        if used + tokens > budget:
+            if kept:
+                continue
+            text = truncate_tokens(text, budget)
+            tokens = budget
+        kept.append(doc)
+        texts.append(text)
+        used += tokens
+    return kept, texts
@@ -2,26 +2,37 @@ import pandas as pd
 import requests
 import os
 import asyncio
+import argparse
+import random
 import re
 from pathlib import Path
 from bs4 import BeautifulSoup
 import hashlib
 from urllib.parse import urlparse
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import yaml
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig
 from crawl4ai.content_filter_strategy import PruningContentFilter
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+from rate_limiter import AsyncRateLimiter, SEC_REQUESTS_PER_SECOND
+from download_manifest import DownloadManifest, MAX_ATTEMPTS, manifest_path_for_shard, shard_rows
+from metadata_store import open_store, frontmatter_records, STORE_PATH, METADATA_CSV
+from streaming_cleaner import clean_filing
 
 # Paths
-METADATA_CSV = "metadata.csv"
 # DOWNLOAD_DIR = "raw_filings"
 CLEANED_DIR = "cleaned_filings"
 # Path(DOWNLOAD_DIR).mkdir(exist_ok=True)
 Path(CLEANED_DIR).mkdir(exist_ok=True)
 
-# Load metadata
-df = pd.read_csv(METADATA_CSV)
+# Download engine config
+MAX_CONCURRENT_FETCHES = 8  # In-flight fetches on the shared crawler
+CLEAN_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Processes for HTML cleaning
+# SEC fair-access policy asks for a descriptive User-Agent ("Company admin@company.com")
+SEC_USER_AGENT = os.getenv("SEC_USER_AGENT")
+RETRIES_PER_RUN = 3  # Attempts per filing within one run
+BACKOFF_SECONDS = 2.0  # First retry delay, doubled each attempt (plus jitter)
 
 # Track failed downloads
 failed = []
@@ -34,35 +45,15 @@ def get_filename_from_metadata(row):
     return f"{ticker}_{form}_{acc_num}"
 
 def create_metadata_frontmatter(row):
-    """Create YAML frontmatter from metadata row"""
-    metadata = {}
-    
-    # Core fields for retrieval system
-    if 'ticker' in row and pd.notna(row['ticker']):
-        metadata['ticker'] = row['ticker']
-    
-    if 'formType' in row and pd.notna(row['formType']):
-        metadata['filing_type'] = row['formType']
-    
-    if 'filedAt' in row and pd.notna(row['filedAt']):
-        metadata['filing_date'] = row['filedAt']
-    
-    if 'accessionNo' in row and pd.notna(row['accessionNo']):
-        metadata['accession_number'] = row['accessionNo']
-    
-    # Additional useful fields
-    if 'companyName' in row and pd.notna(row['companyName']):
-        metadata['company_name'] = row['companyName']
-    elif 'companyNameLong' in row and pd.notna(row['companyNameLong']):
-        metadata['company_name'] = row['companyNameLong']
-    
-    if 'cik' in row and pd.notna(row['cik']):
-        metadata['cik'] = int(row['cik'])  # Convert to int to avoid numpy scalar issues
-    
-    # Use filing type as section
-    metadata['section'] = metadata.get('filing_type', 'Unknown')
-    
-    return metadata
+    """Create YAML frontmatter from metadata row.
+
+    main() precomputes frontmatter for all rows at once (see
+    metadata_store.frontmatter_records); single rows fall back to the same
+    column-wise builder.
+    """
+    if "frontmatter" in row:
+        return row["frontmatter"]
+    return frontmatter_records(pd.DataFrame([dict(row)]))[0]
 
 def add_frontmatter_to_content(content, metadata):
     """Add YAML frontmatter to content"""
@@ -73,7 +64,11 @@ def add_frontmatter_to_content(content, metadata):
     return f"---\n{yaml_header}---\n\n{content}"
 
 def extract_clean_text_from_html(html_content):
-    """Extract clean text from HTML content using the data_preprocess.py approach"""
+    """Extract clean text from HTML content using the data_preprocess.py approach
+
+    Reference implementation; the pipeline uses streaming_cleaner.clean_filing,
+    which tests/test_streaming_cleaner.py checks against this.
+    """
     soup = BeautifulSoup(html_content, "lxml")
     
     body = soup.find("body")
@@ -107,8 +102,9 @@ def clean_markdown_for_chunking(text):
     # Normalize PART headers like "PART I"
     text = re.sub(r"(?m)^PART\s+([IVXLC]+)", r"## PART \1 —", text)
     
-    # Normalize "Item 1. Business" to "### Item 1: Business"
-    text = re.sub(r"(?m)^Item\s+(\d+)[.:]?\s+(.*)", r"### Item \1: \2", text)
+    # Normalize "Item 1. Business" / "ITEM 1A. Risk Factors" / "Item 2.02 Results"
+    # to "### Item 1A: Risk Factors"
+    text = re.sub(r"(?m)^(?:Item|ITEM)\s+(\d+(?:\.\d+)?[A-Z]?)[.:]?\s+(.*)", r"### Item \1: \2", text)
     
     # Optional: upgrade detected ALL CAPS or underlined headers
     text = re.sub(r"(?m)^([A-Z][A-Z\s]+)\n[-=]{3,}", r"#### \1", text)
@@ -118,167 +114,268 @@ def clean_markdown_for_chunking(text):
     
     return text
 
-async def handle_html(url, row_metadata=None):
-    """Handle HTML URLs using simple crawl4ai logic from cr.py"""
-    # Generate dynamic filename
+def html_output_path(url):
+    """Output path for an HTML filing, named after its URL"""
     parsed_url = urlparse(url)
     domain = parsed_url.netloc.replace('.', '_')
     path = parsed_url.path.strip('/').replace('/', '_') or 'home'
-    # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    filename = f"{domain}_{path}"
-    
-    async with AsyncWebCrawler() as crawler:
-        result = await crawler.arun(
-            url=url,
-        )
-        
-        # Add metadata frontmatter if available
-        content = result.markdown
-        if row_metadata is not None:
-            metadata = create_metadata_frontmatter(row_metadata)
-            content = add_frontmatter_to_content(content, metadata)
-        
-        # Save the markdown to a file with dynamic name
-        cleaned_output_file = os.path.join(CLEANED_DIR, f"{filename}.md")
-        with open(cleaned_output_file, "w", encoding="utf-8") as f:
-            f.write(content)
-        
-        print(f"✅ HTML content saved to: {cleaned_output_file}")
-        print(f"📄 Content length: {len(content)} characters")
-        
-        return cleaned_output_file
+    return os.path.join(CLEANED_DIR, f"{domain}_{path}.md")
 
-def handle_txt(url, row_metadata=None):
-    """Handle .txt URLs (SEC filings) using exp.py logic"""
-    # Generate filename based on URL
+def txt_output_path(url):
+    """Output path for a .txt SEC filing, named after its URL"""
     parsed_url = urlparse(url)
     path = parsed_url.path.strip('/').replace('/', '_')
-    # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    filename = f"sec_{path}"
-    
-    async def process_txt():
-        async with AsyncWebCrawler() as crawler:
-            result = await crawler.arun(
-                url=url,
-                config=CrawlerRunConfig(
-                    # Focus on text content
-                    only_text=True,
-                    
-                    # Exclude problematic tags
-                    excluded_tags=["script", "style", "noscript"],
-                    
-                    # Use crawl4ai's custom markdown generator
-                    markdown_generator=DefaultMarkdownGenerator(
-                        content_filter=PruningContentFilter(threshold=0.3)
-                    ),
-                    
-                    # Content processing options
-                    word_count_threshold=10,
-                    
-                    # Parser configuration
-                    parser_type="lxml",
-                    
-                    # Remove forms
-                    remove_forms=True,
-                    
-                    # Verbose logging
-                    verbose=True
-                )
-            )
-            
-            # Get the main content from crawl4ai
-            main_content = result.markdown.fit_markdown
-            
-            # Extract clean text using the data_preprocess.py approach
-            clean_text = extract_clean_text_from_html(main_content)
-            
-            # Clean the markdown content
-            cleaned_content = clean_markdown_for_chunking(clean_text)
-            
-            # Add metadata frontmatter if available
-            if row_metadata is not None:
-                metadata = create_metadata_frontmatter(row_metadata)
-                cleaned_content = add_frontmatter_to_content(cleaned_content, metadata)
-            
-            # Save the cleaned content
-            cleaned_output_file = os.path.join(CLEANED_DIR, f"{filename}.md")
-            with open(cleaned_output_file, 'w', encoding='utf-8') as f:
-                f.write(cleaned_content)
-            
-            print(f"✅ Clean content saved to: {cleaned_output_file}")
-            print(f"📄 Content length: {len(cleaned_content)} characters")
-            
-            return cleaned_output_file
-    
-    # Run the async function
-    return asyncio.run(process_txt())
+    return os.path.join(CLEANED_DIR, f"sec_{path}.md")
 
-def download_and_clean(row):
+def txt_run_config():
+    """crawl4ai config for full-submission .txt filings"""
+    return CrawlerRunConfig(
+        # Focus on text content
+        only_text=True,
+
+        # Exclude problematic tags
+        excluded_tags=["script", "style", "noscript"],
+
+        # Use crawl4ai's custom markdown generator
+        markdown_generator=DefaultMarkdownGenerator(
+            content_filter=PruningContentFilter(threshold=0.3)
+        ),
+
+        # Content processing options
+        word_count_threshold=10,
+
+        # Parser configuration
+        parser_type="lxml",
+
+        # Remove forms
+        remove_forms=True,
+
+        # Verbose logging
+        verbose=True
+    )
+
+def clean_txt_content(main_content):
+    """CPU-heavy cleaning of crawled .txt content; runs in the process pool"""
+    # Single streaming pass, same output as
+    # clean_markdown_for_chunking(extract_clean_text_from_html(main_content))
+    return clean_filing(main_content)
+
+def save_with_frontmatter(path, content, row_metadata=None):
+    """Add metadata frontmatter (if available) and write the markdown file"""
+    if row_metadata is not None:
+        metadata = create_metadata_frontmatter(row_metadata)
+        content = add_frontmatter_to_content(content, metadata)
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return len(content)
+
+class DownloadEngine:
+    """One long-lived crawler shared by all fetches.
+
+    At most MAX_CONCURRENT_FETCHES fetches are in flight, every request
+    waits on a global SEC rate limiter, and cleaning is offloaded to a
+    process pool so the event loop keeps fetching.
+    """
+
+    def __init__(self, crawler, clean_pool, max_concurrent=MAX_CONCURRENT_FETCHES,
+                 requests_per_second=SEC_REQUESTS_PER_SECOND, manifest=None):
+        self.crawler = crawler
+        self.clean_pool = clean_pool
+        self.manifest = manifest
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.limiter = AsyncRateLimiter(requests_per_second)
+
+    async def handle_html(self, url, row_metadata=None):
+        """Handle HTML URLs using simple crawl4ai logic from cr.py"""
+        await self.limiter.acquire()
+        result = await self.crawler.arun(url=url)
+        if not result.success:
+            raise RuntimeError(result.error_message)
+
+        cleaned_output_file = html_output_path(url)
+        length = await asyncio.to_thread(save_with_frontmatter, cleaned_output_file,
+                                         str(result.markdown), row_metadata)
+
+        print(f"✅ HTML content saved to: {cleaned_output_file}")
+        print(f"📄 Content length: {length} characters")
+        return cleaned_output_file
+
+    async def handle_txt(self, url, row_metadata=None):
+        """Handle .txt URLs (SEC filings) using exp.py logic"""
+        await self.limiter.acquire()
+        result = await self.crawler.arun(url=url, config=txt_run_config())
+        if not result.success:
+            raise RuntimeError(result.error_message)
+
+        # Get the main content from crawl4ai and clean it off the event loop
+        main_content = result.markdown.fit_markdown
+        loop = asyncio.get_running_loop()
+        cleaned_content = await loop.run_in_executor(self.clean_pool, clean_txt_content, main_content)
+
+        cleaned_output_file = txt_output_path(url)
+        length = await asyncio.to_thread(save_with_frontmatter, cleaned_output_file,
+                                         cleaned_content, row_metadata)
+
+        print(f"✅ Clean content saved to: {cleaned_output_file}")
+        print(f"📄 Content length: {length} characters")
+        return cleaned_output_file
+
+    async def handle_other(self, url, row_metadata):
+        """Fallback for other file types: plain requests + BeautifulSoup"""
+        await self.limiter.acquire()
+        headers = {"User-Agent": SEC_USER_AGENT} if SEC_USER_AGENT else None
+        res = await asyncio.to_thread(requests.get, url, timeout=20, headers=headers)
+        res.raise_for_status()
+
+        # Clean HTML
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(self.clean_pool, extract_text_fallback, res.text)
+
+        # Save with metadata
+        filename = get_filename_from_metadata(row_metadata)
+        filepath = os.path.join(CLEANED_DIR, f"{filename}.md")
+        await asyncio.to_thread(save_with_frontmatter, filepath, text, row_metadata)
+
+        print(f"✅ Saved with metadata: {filename}.md")
+        return filepath
+
+    async def fetch(self, row):
+        """Fetch, clean and save one metadata row; returns the output path or raises"""
+        url, file_type = select_url(row)
+        if not url:
+            raise ValueError("No valid URL")
+
+        async with self.semaphore:
+            # Determine file type and handle accordingly
+            if file_type == "txt" or url.endswith('.txt'):
+                # Handle SEC .txt files
+                cleaned_file = await self.handle_txt(url, row)
+                print(f"✅ Processed SEC filing: {cleaned_file}")
+            elif file_type == "html" or url.endswith('.html') or url.endswith('.htm'):
+                # Handle HTML files
+                cleaned_file = await self.handle_html(url, row)
+                print(f"✅ Processed HTML file: {cleaned_file}")
+            else:
+                # Fallback to original method for other file types
+                cleaned_file = await self.handle_other(url, row)
+            return cleaned_file
+
+    async def download_and_clean(self, row):
+        """Fetch one row with retries and exponential backoff.
+
+        Every attempt is checkpointed in the manifest (if any); rows that
+        still fail after RETRIES_PER_RUN attempts go to `failed`.
+        """
+        accession = row.get("accessionNo")
+        for attempt in range(1, RETRIES_PER_RUN + 1):
+            try:
+                cleaned_file = await self.fetch(row)
+                if self.manifest is not None and accession:
+                    await asyncio.to_thread(self.manifest.record_success, accession, cleaned_file)
+                return cleaned_file
+            except Exception as e:
+                if self.manifest is not None and accession:
+                    await asyncio.to_thread(self.manifest.record_failure, accession, e)
+                permanent = isinstance(e, ValueError)
+                if permanent or attempt == RETRIES_PER_RUN:
+                    failed.append((row.get("ticker", "UNK"), str(e)))
+                    print(f"❌ Failed: {row.get('ticker')} - {accession} ({e})")
+                    return None
+                delay = BACKOFF_SECONDS * 2 ** (attempt - 1) * (1 + random.random())
+                print(f"🔁 Retry {attempt}/{RETRIES_PER_RUN - 1} for {row.get('ticker')} - {accession} in {delay:.1f}s")
+                # Back off outside the semaphore so other fetches keep going
+                await asyncio.sleep(delay)
+
+def extract_text_fallback(html):
+    soup = BeautifulSoup(html, "lxml")
+    return soup.get_text(separator="\n")
+
+def _as_url(value):
+    """Return value if it is an http(s) URL string (CSV gaps come back as NaN)"""
+    if isinstance(value, str) and value.startswith("http"):
+        return value
+    return None
+
+def select_url(row):
+    """Pick (url, file_type) for a metadata row, preferring the .txt submission"""
     # Check for different file types based on available columns
-    txt_url = row.get("linkToTxt")
-    html_url = row.get("linkToHtml") or row.get("linkToFilingDetails")
-    
+    txt_url = _as_url(row.get("linkToTxt"))
+    html_url = _as_url(row.get("linkToHtml")) or _as_url(row.get("linkToFilingDetails"))
+
     # Determine which URL to use based on what's available
-    if txt_url and txt_url.startswith("http"):
-        url = txt_url
-        file_type = "txt"
+    if txt_url:
         print(f"📄 Using linkToTxt for {row.get('ticker', 'UNK')}")
-    elif html_url and html_url.startswith("http"):
-        url = html_url
-        file_type = "html"
+        return txt_url, "txt"
+    if html_url:
         print(f"🌐 Using linkToHtml/linkToFilingDetails for {row.get('ticker', 'UNK')}")
-    else:
-        # Fallback to original method
-        url = row.get("documentFormatFiles.documentUrl") or row.get("documentUrl")
-        file_type = "unknown"
-        print(f"❓ Using fallback URL for {row.get('ticker', 'UNK')}")
-    
-    if not url or not url.startswith("http"):
-        failed.append((row.get("ticker", "UNK"), "No valid URL"))
-        return
-
-    try:
-        # Determine file type and handle accordingly
-        if file_type == "txt" or url.endswith('.txt'):
-            # Handle SEC .txt files
-            cleaned_file = handle_txt(url, row)
-            print(f"✅ Processed SEC filing: {cleaned_file}")
-        elif file_type == "html" or url.endswith('.html') or url.endswith('.htm'):
-            # Handle HTML files
-            cleaned_file = asyncio.run(handle_html(url, row))
-            print(f"✅ Processed HTML file: {cleaned_file}")
-        else:
-            # Fallback to original method for other file types
-            res = requests.get(url, timeout=20)
-            res.raise_for_status()
-
-            # Clean HTML
-            soup = BeautifulSoup(res.text, "lxml")
-            text = soup.get_text(separator="\n")
-            
-            # Add metadata frontmatter to fallback content
-            metadata = create_metadata_frontmatter(row)
-            content_with_metadata = add_frontmatter_to_content(text, metadata)
-            
-            # Save with metadata
-            filename = get_filename_from_metadata(row)
-            filepath = os.path.join(CLEANED_DIR, f"{filename}.md")
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(content_with_metadata)
-
-            print(f"✅ Saved with metadata: {filename}.md")
-
-    except Exception as e:
-        failed.append((row.get("ticker", "UNK"), str(e)))
-        print(f"❌ Failed: {row.get('ticker')} - {url[:60]}...")
+        return html_url, "html"
 
-if __name__ == "__main__":
-    print(f"📥 Downloading {len(df)} filings...")
+    # Fallback to original method
+    print(f"❓ Using fallback URL for {row.get('ticker', 'UNK')}")
+    url = _as_url(row.get("documentUrl"))
+    return url, "unknown"
+
+async def download_rows(rows, max_concurrent=MAX_CONCURRENT_FETCHES,
+                        requests_per_second=SEC_REQUESTS_PER_SECOND, clean_workers=CLEAN_WORKERS,
+                        manifest=None):
+    """Download and clean many rows with one crawler, a fetch pool and a clean pool"""
+    browser_config = BrowserConfig(headless=True, user_agent=SEC_USER_AGENT) if SEC_USER_AGENT else None
+    with ProcessPoolExecutor(max_workers=clean_workers) as clean_pool:
+        async with AsyncWebCrawler(config=browser_config) as crawler:
+            engine = DownloadEngine(crawler, clean_pool, max_concurrent, requests_per_second, manifest)
+            return await asyncio.gather(*(engine.download_and_clean(row) for row in rows))
 
-    for _, row in df.iterrows():
-        download_and_clean(row)
+def download_and_clean(row):
+    """Download and clean a single metadata row (starts its own crawler)"""
+    return asyncio.run(download_rows([row], max_concurrent=1, clean_workers=1))[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and clean SEC filings listed in the metadata store")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_FETCHES,
+                        help="max in-flight fetches on the shared crawler")
+    parser.add_argument("--rps", type=float, default=SEC_REQUESTS_PER_SECOND,
+                        help="global request rate limit (SEC allows 10/s)")
+    parser.add_argument("--clean-workers", type=int, default=CLEAN_WORKERS,
+                        help="processes used for HTML cleaning")
+    parser.add_argument("--shard", default="0/1",
+                        help="INDEX/COUNT: only process accessions hashing to this shard, e.g. 2/4")
+    parser.add_argument("--retry-exhausted", action="store_true",
+                        help=f"also retry filings that already failed {MAX_ATTEMPTS} times")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore the manifest and download everything again")
+    args = parser.parse_args()
+    shard_index, shard_count = (int(x) for x in args.shard.split("/"))
+
+    # Load metadata and build every row's frontmatter in one column-wise pass
+    df = open_store(STORE_PATH, METADATA_CSV).load()
+    rows = df.astype(object).where(df.notna(), None).to_dict("records")
+    for row, frontmatter in zip(rows, frontmatter_records(df)):
+        row["frontmatter"] = frontmatter
+    rows = shard_rows(rows, shard_index, shard_count)
+
+    manifest = DownloadManifest(manifest_path_for_shard(shard_index, shard_count))
+    if args.fresh:
+        manifest.entries = {}
+    todo = []
+    skipped_done = skipped_exhausted = 0
+    for row in rows:
+        accession = row.get("accessionNo")
+        if manifest.is_done(accession):
+            skipped_done += 1
+        elif manifest.attempts(accession) >= MAX_ATTEMPTS and not args.retry_exhausted:
+            skipped_exhausted += 1
+        else:
+            todo.append(row)
+    print(f"📒 Manifest {manifest.path}: {skipped_done} already done, "
+          f"{skipped_exhausted} skipped after {MAX_ATTEMPTS} failed attempts")
+
+    print(f"📥 Downloading {len(todo)} filings...")
+    start = datetime.now()
+    asyncio.run(download_rows(todo, args.concurrency, args.rps, args.clean_workers, manifest))
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"⏱️ {len(todo)} filings in {elapsed:.1f}s ({len(todo) / elapsed if elapsed else 0:.2f}/s)")
+    print(f"📒 Manifest status: {manifest.summary()}")
 
     if failed:
         print("\n⚠️ Some downloads failed:")
@@ -286,3 +383,6 @@ if __name__ == "__main__":
             print("  -", f)
     else:
         print("🎉 All filings downloaded successfully!")
+
+if __name__ == "__main__":
+    main()
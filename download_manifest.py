@@ -0,0 +1,106 @@
+"""
+Persistent download manifest: accession number → status, output path,
+byte size, content hash, attempt count and last error.
+
+The manifest is checkpointed (atomically) after every completed or failed
+filing, so an interrupted run resumes where it stopped.
+"""
+import os
+import json
+import zlib
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+MANIFEST_PATH = "download_manifest.json"
+MAX_ATTEMPTS = 5  # Failures with this many attempts are skipped unless forced
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def manifest_path_for_shard(index, count, path=MANIFEST_PATH):
+    """One manifest per shard so machines sharing a directory never clobber each other"""
+    if count <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}of{count}{ext}"
+
+def shard_of(accession, count):
+    """Stable shard of an accession number: the same on every run, however the metadata grows.
+
+    Rows without an accession number (None, NaN, "") go to shard 0.
+    """
+    if not isinstance(accession, str) or not accession.strip():
+        return 0
+    return zlib.crc32(accession.strip().encode("utf-8")) % count
+
+def shard_rows(rows, index, count):
+    """Rows whose accession number hashes to shard `index` of `count`"""
+    if count <= 1:
+        return rows
+    shard = [row for row in rows if shard_of(row.get("accessionNo"), count) == index]
+    print(f"🧩 Shard {index}/{count}: {len(shard)} of {len(rows)} filings")
+    return shard
+
+class DownloadManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.entries = {}
+        # Updates arrive from several threads (asyncio.to_thread)
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_done(self, accession):
+        """Finished earlier and the output file is still there with the recorded size"""
+        entry = self.entries.get(accession)
+        if not entry or entry["status"] != "done":
+            return False
+        path = entry.get("output_path")
+        return bool(path) and os.path.exists(path) and os.path.getsize(path) == entry.get("bytes")
+
+    def attempts(self, accession):
+        return self.entries.get(accession, {}).get("attempts", 0)
+
+    def _update(self, accession, **fields):
+        with self.lock:
+            entry = self.entries.setdefault(accession, {"attempts": 0})
+            entry.update(fields)
+            entry["attempts"] += 1
+            entry["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            self.checkpoint()
+
+    def record_success(self, accession, output_path):
+        self._update(
+            accession,
+            status="done",
+            output_path=output_path,
+            bytes=os.path.getsize(output_path),
+            sha256=file_sha256(output_path),
+            last_error=None,
+        )
+
+    def record_failure(self, accession, error):
+        self._update(
+            accession,
+            status="failed",
+            last_error=str(error)[:500],
+        )
+
+    def checkpoint(self):
+        """Write the manifest atomically (callers hold the lock)"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
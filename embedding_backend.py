@@ -0,0 +1,235 @@
+"""
+Pluggable CPU embedding backends for ingestion.
+
+All backends wrap a SentenceTransformer and expose `encode(texts)`:
+  - torch      the PyTorch model (what ingestion used so far)
+  - onnx       the same weights run by ONNX Runtime
+  - onnx-int8  the dynamically int8-quantized ONNX export from the model repo
+
+EmbeddingPool runs one backend per worker process for multi-core boxes.
+
+Texts are bucketed by token length before encoding, so each batch pads to
+a similar length instead of to the longest chunk in the flush. A
+compatibility check compares a backend with the torch model on probe
+texts, so a faster backend can only be used if its vectors stay within
+EMBEDDING_TOLERANCE of the ones already stored in the collection.
+"""
+import os
+import time
+import argparse
+import glob
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_INT8_FILE = "onnx/model_qint8_avx512.onnx"  # Pre-exported in the sentence-transformers model repo
+ENCODE_BATCH_SIZE = 64  # Texts per forward pass, after length bucketing
+EMBEDDING_TOLERANCE = 0.99  # Min cosine similarity to the torch vectors
+POOL_SHARD_SIZE = 64  # Texts per task sent to a pool worker
+
+PROBE_TEXTS = [
+    "Item 1A. Risk Factors. Our business could be adversely affected by supply chain disruptions.",
+    "Net revenues increased 12% to $94.8 billion, driven by higher iPhone and Services sales.",
+    "The Company repurchased 471 million shares of its common stock for $90.2 billion.",
+    "PART II — OTHER INFORMATION",
+    "We are subject to extensive regulation by the SEC, FINRA, the CFTC and other regulators "
+    "in the United States and abroad, and changes in these regulations could affect our results.",
+    "Total research and development expense was $3,969 million for the year ended December 31, 2023, "
+    "an increase of $894 million compared to the prior year, mainly due to headcount growth.",
+]
+
+def load_model(model_name, backend="torch", threads=None):
+    """SentenceTransformer running on CPU with the given backend and thread count"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device="cpu")
+
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if threads:
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = options
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = ONNX_INT8_FILE
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+def cache_name_for(model_name, backend):
+    """Embedding-cache namespace: int8 vectors differ slightly from float ones"""
+    return model_name if backend != "onnx-int8" else f"{model_name}@{backend}"
+
+def token_lengths(tokenizer, max_length, texts):
+    """Token count per text, capped at the model's max sequence length"""
+    encoded = tokenizer(list(texts), add_special_tokens=True, truncation=True, max_length=max_length)
+    return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int32, count=len(texts))
+
+class EmbeddingBackend:
+    def __init__(self, model_name, backend="torch", threads=None, batch_size=ENCODE_BATCH_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.threads = threads
+        self.batch_size = batch_size
+        self.model = load_model(model_name, backend, threads)
+
+    @property
+    def cache_name(self):
+        return cache_name_for(self.model_name, self.backend)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def token_lengths(self, texts):
+        return token_lengths(self.model.tokenizer, self.model.max_seq_length, texts)
+
+    def encode(self, texts):
+        """Float32 vectors aligned with texts, encoded in length-sorted buckets"""
+        result = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not texts:
+            return result
+        order = np.argsort(self.token_lengths(texts), kind="stable")
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            result[bucket] = self.model.encode([texts[i] for i in bucket], batch_size=len(bucket),
+                                               convert_to_numpy=True, show_progress_bar=False)
+        return result
+
+# Per-process backend of an EmbeddingPool worker, loaded once by the initializer
+_worker_backend = None
+
+def _init_pool_worker(model_name, backend, threads, batch_size):
+    global _worker_backend
+    _worker_backend = EmbeddingBackend(model_name, backend, threads, batch_size)
+
+def _encode_shard(texts):
+    return _worker_backend.encode(texts)
+
+def _warm_up_worker(texts):
+    """Encode once (loads the weights and kernels); returns what the parent needs for sharding"""
+    vectors = _worker_backend.encode(texts)
+    model = _worker_backend.model
+    return vectors.shape[1], model.tokenizer, model.max_seq_length
+
+class EmbeddingPool:
+    """EmbeddingBackend sharded across worker processes, one model copy each.
+
+    Workers start (and load their model) once, in the constructor. `encode`
+    cuts texts into POOL_SHARD_SIZE shards, length-sorted first so shards
+    are homogeneous, and reassembles the vectors in input order. `workers`
+    × `threads` should not exceed the number of cores.
+    """
+
+    def __init__(self, model_name, backend="torch", workers=None, threads=None,
+                 batch_size=ENCODE_BATCH_SIZE, shard_size=POOL_SHARD_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_pool_worker,
+            initargs=(model_name, backend, self.threads, batch_size),
+        )
+        # Warm-up: start the worker processes and load their models now, not on the first batch.
+        # The parent keeps only the tokenizer (for length sorting) and the dimension, not a model copy
+        warm = list(self.executor.map(_warm_up_worker, [PROBE_TEXTS[:1]] * self.workers))
+        self.dim, self.tokenizer, self.max_seq_length = warm[0]
+
+    @property
+    def cache_name(self):
+        return cache_name_for(self.model_name, self.backend)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts):
+        """Float32 vectors aligned with texts, computed by all workers in parallel"""
+        result = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not texts:
+            return result
+        order = np.argsort(token_lengths(self.tokenizer, self.max_seq_length, texts), kind="stable")
+        shards = [order[start:start + self.shard_size] for start in range(0, len(order), self.shard_size)]
+        # map yields results in submission order, so each lands back on its own rows
+        vectors = self.executor.map(_encode_shard, [[texts[i] for i in shard] for shard in shards])
+        for shard, shard_vectors in zip(shards, vectors):
+            result[shard] = shard_vectors
+        return result
+
+    def close(self):
+        self.executor.shutdown()
+
+def check_compatibility(backend, reference=None, texts=PROBE_TEXTS, tolerance=EMBEDDING_TOLERANCE):
+    """Min cosine similarity between backend and torch vectors; raises if below tolerance"""
+    if backend.backend == "torch" and reference is None:
+        return 1.0
+    reference = reference or SentenceTransformer(backend.model_name, device="cpu")
+    expected = reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    actual = backend.encode(texts)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    similarity = float((expected * actual).sum(axis=1).min())
+    if similarity < tolerance:
+        raise ValueError(f"{backend.backend} vectors drift from the stored ones "
+                         f"(min cosine {similarity:.4f} < {tolerance})")
+    return similarity
+
+def benchmark(backend, texts, repeats=1):
+    """Chunks per second for backend.encode over texts"""
+    backend.encode(texts[:backend.batch_size])  # Warm-up (session init, allocations)
+    start = time.time()
+    for _ in range(repeats):
+        backend.encode(texts)
+    return repeats * len(texts) / (time.time() - start)
+
+def sample_chunks(markdown_dir, count, chunk_size=1000):
+    """Fixed-size text pieces from the cleaned filings, for benchmarking"""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(markdown_dir, "*.md"))):
+        with open(path, "r", encoding="utf-8") as f:
+            body = f.read()
+        texts.extend(body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+        if len(texts) >= count:
+            break
+    return texts[:count] or PROBE_TEXTS * (count // len(PROBE_TEXTS) + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on CPU")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--threads", type=int, help="intra-op threads per backend (per worker with --workers)")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="also benchmark EmbeddingPool with these worker counts")
+    parser.add_argument("--chunks", type=int, default=1024, help="sample chunks to encode")
+    parser.add_argument("--markdown-dir", default="cleaned_filings")
+    args = parser.parse_args()
+
+    texts = sample_chunks(args.markdown_dir, args.chunks)
+    reference = SentenceTransformer(args.model, device="cpu")
+    baseline = None
+    for name in args.backends:
+        backend = EmbeddingBackend(args.model, name, args.threads)
+        try:
+            similarity = check_compatibility(backend, reference)
+        except ValueError as e:
+            print(f"❌ {name}: {e}")
+            continue
+        rate = benchmark(backend, texts)
+        baseline = baseline or rate
+        print(f"⚡ {name:10s} {rate:8.1f} chunks/s ({rate / baseline:.2f}x), min cosine vs torch {similarity:.4f}")
+        for workers in args.workers or []:
+            pool = EmbeddingPool(args.model, name, workers, args.threads)
+            rate = benchmark(pool, texts)
+            pool.close()
+            print(f"⚡ {name:10s} {rate:8.1f} chunks/s ({rate / baseline:.2f}x) with {workers} workers "
+                  f"x {pool.threads} threads")
+
+if __name__ == "__main__":
+    main()
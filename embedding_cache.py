@@ -0,0 +1,146 @@
+"""
+On-disk embedding cache: (model name, normalized chunk text) → vector.
+
+Vectors live in a fixed-capacity memory-mapped float32 array and a small
+JSON index maps text hashes to slots. When the cache is full the least
+recently used entries are evicted in bulk.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+EMBEDDING_CACHE_DIR = "embedding_cache"
+EMBEDDING_CACHE_SIZE = 500_000  # Max cached vectors per model (~0.75 GB at 384 dims)
+EVICT_FRACTION = 0.1  # Share of entries dropped when the cache is full
+
+def normalize_text(text):
+    """Collapse whitespace; the tokenizer ignores it, so the vector is unchanged"""
+    return " ".join(text.split())
+
+def text_key(text):
+    """Hash of the normalized text used as the cache key"""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+class EmbeddingCache:
+    """Memory-mapped vector cache for a single embedding model.
+
+    Not thread-safe: use it from the one thread that calls encode.
+    """
+
+    def __init__(self, model_name, dim, cache_dir=EMBEDDING_CACHE_DIR, max_entries=EMBEDDING_CACHE_SIZE):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self.dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.dir, exist_ok=True)
+
+        index = None
+        if os.path.exists(self.index_path) and os.path.exists(self.vectors_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("dim") != dim or index.get("capacity") != max_entries:
+                print(f"Embedding cache shape changed, resetting: {self.dir}")
+                index = None
+
+        mode = "r+" if index else "w+"
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(max_entries, dim))
+        index = index or {}
+        self.clock = index.get("clock", 0)
+        # key → [slot, last_used]
+        self.entries = index.get("entries", {})
+        used = {slot for slot, _ in self.entries.values()}
+        self.free_slots = [slot for slot in range(max_entries - 1, -1, -1) if slot not in used]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _evict(self):
+        """Drop the least recently used EVICT_FRACTION of entries.
+
+        The index is persisted before any freed slot is reused, so an index
+        left behind by a crash never maps an evicted key to another text's vector.
+        """
+        count = max(1, int(self.max_entries * EVICT_FRACTION))
+        oldest = sorted(self.entries.items(), key=lambda item: item[1][1])[:count]
+        for key, (slot, _) in oldest:
+            del self.entries[key]
+            self.free_slots.append(slot)
+        self.flush()
+
+    def get_many(self, keys):
+        """Return a list of vectors (None for misses) and bump recency of hits"""
+        self.clock += 1
+        found = []
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is None:
+                found.append(None)
+                continue
+            entry[1] = self.clock
+            # Copy: the slot may be reused by an eviction before the caller reads it
+            found.append(np.array(self.vectors[entry[0]]))
+        return found
+
+    def put_many(self, keys, vectors):
+        self.clock += 1
+        for key, vector in zip(keys, vectors):
+            entry = self.entries.get(key)
+            if entry is None:
+                if not self.free_slots:
+                    self._evict()
+                entry = [self.free_slots.pop(), self.clock]
+                self.entries[key] = entry
+            entry[1] = self.clock
+            self.vectors[entry[0]] = vector
+
+    def encode(self, encode_fn, texts):
+        """Embed texts, calling encode_fn only for texts not already cached.
+
+        Duplicate texts inside one call are encoded once. Returns a float32
+        array aligned with texts.
+        """
+        keys = [text_key(t) for t in texts]
+        cached = self.get_many(keys)
+
+        missing = {}
+        for i, (key, vector) in enumerate(zip(keys, cached)):
+            if vector is None and key not in missing:
+                missing[key] = i
+        self.hits += sum(v is not None for v in cached)
+        self.misses += len(texts) - sum(v is not None for v in cached)
+
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        if missing:
+            new_vectors = np.asarray(encode_fn([texts[i] for i in missing.values()]), dtype=np.float32)
+            self.put_many(list(missing), new_vectors)
+            by_key = dict(zip(missing, new_vectors))
+        else:
+            by_key = {}
+        for i, (key, vector) in enumerate(zip(keys, cached)):
+            result[i] = vector if vector is not None else by_key[key]
+        return result
+
+    def flush(self):
+        """Persist vectors and write the index atomically"""
+        self.vectors.flush()
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model_name": self.model_name,
+                "dim": self.dim,
+                "capacity": self.max_entries,
+                "clock": self.clock,
+                "entries": self.entries,
+            }, f)
+        os.replace(tmp_path, self.index_path)
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        print(f"Embedding cache: {self.hits}/{total} hits ({rate:.1f}%), "
+              f"{len(self.entries)}/{self.max_entries} entries in {self.dir}")
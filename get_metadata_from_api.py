@@ -1,49 +1,155 @@
 # step_0_fetch_metadata_by_ticker.py
 
-from sec_api import QueryApi
 import os
+import re
+import json
+import argparse
 import dotenv
-import pandas as pd
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import RateLimiter
+from metadata_store import open_store, STORE_PATH, METADATA_CSV
+from companies import TICKERS
 
 # Load API Key
 dotenv.load_dotenv()
-query_api = QueryApi(api_key=os.getenv("SEC_API_KEY"))
 
-# Tickers across various sectors
-TICKERS = ["AAPL", "TSLA", "JPM", "PFE", "XOM", "AMZN", "BA", "NVDA", "DIS", "UNH"]
 FILING_TYPES = ["10-K", "10-Q", "8-K", "DEF 14A"]
-FILINGS_PER_PAIR = 20
+FILINGS_PER_PAIR = 100  # Max filings fetched per ticker/form pair (across pages)
+PAGE_SIZE = 50  # sec-api returns at most 50 filings per call
+MAX_OFFSET = 10000  # sec-api rejects "from" beyond this
+QUERY_CONCURRENCY = 4  # ticker/form queries running at once
+QUERY_RATE = 2  # sec-api calls per second, shared by all threads
 
-all_filings = []
+class StubQueryApi:
+    """Offline stand-in for sec_api.QueryApi backed by a JSON list of filings.
 
-for ticker in TICKERS:
-    for filing_type in FILING_TYPES:
-        print(f"Fetching {FILINGS_PER_PAIR} filings: {ticker} - {filing_type}")
+    Understands the queries built by build_query (ticker, formType and an
+    optional filedAt lower bound), sorting by filedAt and from/size paging.
+    """
 
-        query = f"ticker:{ticker} AND formType:{filing_type}"
+    def __init__(self, fixture_path):
+        with open(fixture_path, "r", encoding="utf-8") as f:
+            self.filings = json.load(f)
+        self.calls = 0
+
+    def get_filings(self, search_params):
+        self.calls += 1
+        query = search_params["query"]
+        ticker = re.search(r'ticker:"?([^"\s]+)"?', query).group(1)
+        form = re.search(r'formType:"([^"]+)"', query).group(1)
+        after = re.search(r'filedAt:\{"?([^"\s]+)"? TO \*\}', query)
+
+        matches = [f for f in self.filings if f.get("ticker") == ticker and f.get("formType") == form]
+        if after:
+            matches = [f for f in matches if f["filedAt"] > after.group(1)]
+        matches.sort(key=lambda f: f["filedAt"], reverse=True)
+
+        start = int(search_params.get("from", 0))
+        size = int(search_params.get("size", PAGE_SIZE))
+        return {"total": {"value": len(matches)}, "filings": matches[start:start + size]}
+
+def make_query_api(stub_path=None):
+    """Real sec-api client, or the offline stub if a fixture path is given"""
+    if stub_path:
+        return StubQueryApi(stub_path)
+    from sec_api import QueryApi
+    return QueryApi(api_key=os.getenv("SEC_API_KEY"))
+
+def build_query(ticker, filing_type, filed_after=None):
+    query = f'ticker:{ticker} AND formType:"{filing_type}"'
+    if filed_after:
+        # Exclusive lower bound: only filings newer than the latest stored one
+        query += f' AND filedAt:{{"{filed_after}" TO *}}'
+    return query
+
+def fetch_pair(query_api, limiter, ticker, filing_type, filed_after=None, max_filings=FILINGS_PER_PAIR):
+    """Page through all filings for one ticker/form pair (newest first)"""
+    query = build_query(ticker, filing_type, filed_after)
+    filings = []
+    offset = 0
+    while len(filings) < max_filings and offset < MAX_OFFSET:
+        size = min(PAGE_SIZE, max_filings - len(filings))
         search_params = {
             "query": query,
-            "from": "0",
-            "size": FILINGS_PER_PAIR,
+            "from": str(offset),
+            "size": str(size),
             "sort": [{"filedAt": {"order": "desc"}}],
         }
+        limiter.acquire()
+        response = query_api.get_filings(search_params)
+        page = response.get("filings", [])
+        filings.extend(page)
+        if len(page) < size:
+            break
+        offset += len(page)
+    return filings
+
+def fetch_all(query_api, tickers=TICKERS, filing_types=FILING_TYPES, since=None,
+              max_filings=FILINGS_PER_PAIR, concurrency=QUERY_CONCURRENCY, rate=QUERY_RATE):
+    """Run every ticker/form query concurrently under one shared rate limiter.
+
+    `since` maps (ticker, formType) to the latest filedAt already stored;
+    those pairs only ask for newer filings (incremental mode).
+    """
+    limiter = RateLimiter(rate)
+    since = since or {}
+    all_filings = []
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {}
+        for ticker in tickers:
+            for filing_type in filing_types:
+                filed_after = since.get((ticker, filing_type))
+                print(f"Fetching up to {max_filings} filings: {ticker} - {filing_type}"
+                      + (f" (after {filed_after})" if filed_after else ""))
+                future = pool.submit(fetch_pair, query_api, limiter, ticker, filing_type,
+                                     filed_after, max_filings)
+                futures[future] = (ticker, filing_type)
+
+        for future in as_completed(futures):
+            ticker, filing_type = futures[future]
+            try:
+                filings = future.result()
+                print(f"Found {len(filings)} filings for {ticker} - {filing_type}")
+                all_filings.extend(filings)
+            except Exception as e:
+                print(f"Error: {ticker} - {filing_type}: {e}")
+
+    return all_filings
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch SEC filing metadata with sec-api")
+    parser.add_argument("--full", action="store_true",
+                        help="refetch everything instead of only filings newer than the store")
+    parser.add_argument("--max-per-pair", type=int, default=FILINGS_PER_PAIR,
+                        help="max filings per ticker/form pair")
+    parser.add_argument("--concurrency", type=int, default=QUERY_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=QUERY_RATE, help="API calls per second")
+    parser.add_argument("--stub", default=os.getenv("SEC_API_STUB"),
+                        help="JSON fixture served by StubQueryApi instead of calling sec-api")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--no-csv", action="store_true",
+                        help=f"don't write the whole store to {METADATA_CSV} (still read by older tools)")
+    args = parser.parse_args()
 
-        try:
-            response = query_api.get_filings(search_params)
-            filings = response.get("filings", [])
-            print(f"Found {len(filings)} filings for {ticker} - {filing_type}")
+    store = open_store(args.store, METADATA_CSV)
+    since = None
+    if not args.full and len(store):
+        since = store.latest_filed_at()
+        print(f"Incremental mode: {len(store)} filings already in {args.store}")
 
-            all_filings.extend(filings)
-            sleep(1.2)  # Rate limit protection
+    query_api = make_query_api(args.stub)
+    filings = fetch_all(query_api, since=since, max_filings=args.max_per_pair,
+                        concurrency=args.concurrency, rate=args.rate)
 
-        except Exception as e:
-            print(f"Error: {ticker} - {filing_type}: {e}")
+    if filings:
+        store.upsert_records(filings)
+        print(f"\nNew filings fetched: {len(filings)}, total stored: {len(store)} → {args.store}")
+    else:
+        print("No new filings fetched. Check your network or API key if this is unexpected.")
+    if not args.no_csv:
+        store.export_csv(METADATA_CSV)
+        print(f"Exported {len(store)} filings → {METADATA_CSV}")
 
-# Save to CSV
-if all_filings:
-    df = pd.DataFrame.from_records(all_filings)
-    df.to_csv("metadata.csv", index=False)
-    print(f"\nTotal filings saved: {len(df)} → metadata.csv")
-else:
-    print("No filings fetched. Check your network or API key.")
+if __name__ == "__main__":
+    main()
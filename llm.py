@@ -1,40 +1,16 @@
-import os
-from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+import time
 # from langchain_core.documents import Document
-from langchain_core.runnables import RunnableLambda
 from langchain_core.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+import resources
+from answer_stream import TimedStream
+from retrieval import chunk_ids
+from query_analyzer import decomposed_search, describe
+from conversation_memory import fit_prompt
+from context_packing import pack_context, CONTEXT_TOKEN_BUDGET
 
-# Load .env with GOOGLE_API_KEY
-load_dotenv()
-
-# Config
-CHROMA_DB_DIR = "chroma_db"
-COLLECTION_NAME = "sec_filings"
-
-# Initialize embedding model (same as used earlier)
-embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-# Connect to Chroma DB
-vectorstore = Chroma(
-    collection_name=COLLECTION_NAME,
-    embedding_function=embedding_model,
-    persist_directory=CHROMA_DB_DIR
-)
-
-# Retriever with optional metadata filters
-retriever = vectorstore.as_retriever(search_kwargs={
-    "k": 5  # top-k chunks
-})
-
-# Initialize Gemini 2.0 Flash via LangChain
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    temperature=0.2,
-    google_api_key=os.getenv("GEMINI_API_KEY")
-)
+# Gemini (and, below, search, analyzer and reranker) come from the shared
+# resource layer: loaded once per process, same instances as app.py
+llm = resources.get_llm()
 
 # Prompt template
 prompt = PromptTemplate.from_template("""
@@ -50,26 +26,34 @@ Context:
 Helpful Answer:
 """)
 
-# Chain: retrieve → prompt → Gemini
-def format_docs(docs):
-    return "\n\n".join(
-        f"[{d.metadata.get('ticker')}, {d.metadata.get('filing_type')}, {d.metadata.get('section')}, {d.metadata.get('filing_date')}]:\n{d.page_content}"
-        for d in docs
-    )
-
-chain = (
-    RunnableLambda(lambda q: retriever.get_relevant_documents(q))
-    | RunnableLambda(lambda docs: {
-        "context": format_docs(docs),
-        "question": docs[0].metadata.get("original_query", "") if docs else ""
-    })
-    | prompt
-    | llm
-)
-
 # ⌨️ Ask a question
 if __name__ == "__main__":
     query = input("Ask a financial research question: ")
-    result = chain.invoke(query)
+    start = time.perf_counter()
+    query_embedding, docs, analysis = decomposed_search(resources.get_search(), resources.get_analyzer(), query,
+                                                        reranker=resources.get_reranker())
+    if analysis["where"] is not None:
+        print(f"🎯 Filter: {describe(analysis)}")
+    if analysis.get("rerank"):
+        rerank = analysis["rerank"]
+        outcome = "over budget, kept bi-encoder order" if rerank["fallback"] else "reranked"
+        print(f"🔀 {rerank['pairs']} candidates {outcome} in {rerank['seconds'] * 1000:.0f} ms")
+    # Merge adjacent chunks, drop overlap and near-duplicates, keep the prompt within budget
+    question, _, budget = fit_prompt(prompt.template, query, "")
+    docs, context, packing = pack_context(docs, min(CONTEXT_TOKEN_BUDGET, budget))
+    print(f"📦 Context: {packing['chunks_used']}/{packing['chunks']} chunks in {packing['passages']} passages, "
+          f"{packing['context_tokens']} tokens (raw {packing['raw_tokens']})")
+    answer_cache = resources.get_answer_cache()
+    evidence = chunk_ids(docs)
     print("\nGemini Answer:\n")
-    print(result.content)
+    answer = answer_cache.get(query_embedding, evidence, scope=prompt.template)
+    if answer is not None:
+        print(answer)
+        print(f"\n💾 cached answer, {time.perf_counter() - start:.2f}s")
+    else:
+        # Tokens are printed as they arrive
+        stream = TimedStream(llm.stream(prompt.format(context=context, question=question)), start=start)
+        for text in stream:
+            print(text, end="", flush=True)
+        print(f"\n\n⏱️ {stream.summary()}")
+        answer_cache.put(query_embedding, evidence, stream.text, question=query, scope=prompt.template)
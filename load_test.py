@@ -0,0 +1,82 @@
+"""
+Load test for qa_service.py: concurrent POST /query, then latency, throughput and server metrics.
+
+    uvicorn qa_service:app --port 8000
+    python load_test.py --concurrency 16 --requests 200 --retrieve-only
+
+--retrieve-only skips Gemini (no API quota used) and measures embedding
+batching, the retrieval pool and the caches; add --distinct so every
+request is a new question and misses the retrieval cache.
+"""
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+QUESTIONS = [
+    "What are Tesla's main risk factors?",
+    "How did Apple describe supply chain risks in its latest 10-K?",
+    "Compare Microsoft and Alphabet cloud revenue growth",
+    "What did JPMorgan say about credit losses in 2023?",
+    "Executive compensation at Amazon in the proxy statement",
+    "NVIDIA data center demand outlook",
+    "Meta's regulatory risks in Europe",
+    "Berkshire Hathaway insurance underwriting results",
+]
+
+def post(url, payload, timeout):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the QA service")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service base URL")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests")
+    parser.add_argument("--k", type=int, default=None, help="Chunks per request (service default if unset)")
+    parser.add_argument("--retrieve-only", action="store_true", help="Skip the LLM call")
+    parser.add_argument("--distinct", action="store_true", help="Make every question unique (no cache hits)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    def one(i):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if args.distinct:
+            question = f"{question} (request {i})"
+        payload = {"query": question, "k": args.k, "retrieve_only": args.retrieve_only}
+        start = time.perf_counter()
+        try:
+            post(f"{args.url}/query", payload, args.timeout)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, str(e)
+
+    print(f"🚀 {args.requests} requests, {args.concurrency} concurrent → {args.url}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds for seconds, error in results if error is None]
+    errors = [error for _, error in results if error is not None]
+    print(f"✅ {len(latencies)} ok, {len(errors)} failed in {elapsed:.2f}s → {len(latencies) / elapsed:.1f} req/s")
+    print(f"⏱️ latency p50 {1000 * percentile(latencies, 0.5):.0f} ms · "
+          f"p95 {1000 * percentile(latencies, 0.95):.0f} ms · max {1000 * max(latencies, default=0):.0f} ms")
+    if errors:
+        print(f"⚠️ First error: {errors[0]}")
+    with urllib.request.urlopen(f"{args.url}/metrics", timeout=args.timeout) as response:
+        metrics = json.loads(response.read())
+    embedding = metrics["embedding"]
+    print(f"📦 Embedding batches: {embedding['batches']} for {embedding['embedded']} queries "
+          f"(avg {embedding['avg_batch']:.1f}, largest {embedding['largest_batch']})")
+    print(f"📊 Server metrics: {json.dumps(metrics, indent=2)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Typed filing-metadata store (SQLite) with an accession-number index.
+
+Replaces re-reading metadata.csv and walking it with iterrows(): every
+script loads the columns it needs in one query, and the YAML frontmatter
+fields are derived for all filings at once with column operations.
+"""
+import os
+import json
+import sqlite3
+import pandas as pd
+
+STORE_PATH = "metadata.db"
+METADATA_CSV = "metadata.csv"
+
+# Column → SQLite type. Nested sec-api fields (entities, documentFormatFiles, ...) are not kept.
+COLUMNS = {
+    "accessionNo": "TEXT PRIMARY KEY",
+    "cik": "INTEGER",
+    "ticker": "TEXT",
+    "companyName": "TEXT",
+    "companyNameLong": "TEXT",
+    "formType": "TEXT",
+    "filedAt": "TEXT",
+    "periodOfReport": "TEXT",
+    "description": "TEXT",
+    "linkToTxt": "TEXT",
+    "linkToHtml": "TEXT",
+    "linkToFilingDetails": "TEXT",
+    "documentUrl": "TEXT",  # Primary document, from documentFormatFiles
+}
+
+def primary_document_url(filing):
+    """URL of the filing's main document: the documentFormatFiles entry of its form type, else the first"""
+    files = filing.get("documentFormatFiles") or []
+    for entry in files:
+        if entry.get("type") == filing.get("formType") and entry.get("documentUrl"):
+            return entry["documentUrl"]
+    return next((entry["documentUrl"] for entry in files if entry.get("documentUrl")), None)
+
+class FilingStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(f'"{name}" {kind}' for name, kind in COLUMNS.items())
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS filings ({columns})")
+        # Stores created before a column was added get it (empty)
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(filings)")}
+        for name, kind in COLUMNS.items():
+            if name not in existing:
+                self.conn.execute(f'ALTER TABLE filings ADD COLUMN "{name}" {kind}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_ticker_form ON filings ("ticker", "formType", "filedAt")')
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM filings").fetchone()[0]
+
+    def upsert_frame(self, df):
+        """Insert or replace filings from a DataFrame (unknown columns are ignored)"""
+        if df.empty or "accessionNo" not in df:
+            return 0
+        frame = df.reindex(columns=list(COLUMNS))
+        frame = frame[frame["accessionNo"].notna()].drop_duplicates("accessionNo", keep="last")
+        frame["cik"] = pd.to_numeric(frame["cik"], errors="coerce").astype("Int64")
+        frame = frame.astype(object).where(frame.notna(), None)
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        names = ", ".join(f'"{name}"' for name in COLUMNS)
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO filings ({names}) VALUES ({placeholders})",
+                                  frame.itertuples(index=False, name=None))
+        return len(frame)
+
+    def upsert_records(self, records):
+        """Insert or replace raw sec-api filing dicts"""
+        records = [{**record, "documentUrl": primary_document_url(record)} for record in records]
+        return self.upsert_frame(pd.DataFrame.from_records(records))
+
+    def load(self, columns=None, accessions=None):
+        """Load filings (optionally only some columns / accession numbers) as a DataFrame"""
+        names = ", ".join(f'"{name}"' for name in (columns or COLUMNS))
+        query = f"SELECT {names} FROM filings"
+        if accessions is not None:
+            # Go through a temp table: SQLite limits the number of bound parameters
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (accessionNo TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((a,) for a in accessions))
+            query += " WHERE accessionNo IN (SELECT accessionNo FROM wanted)"
+        df = pd.read_sql_query(query, self.conn)
+        if "cik" in df:
+            df["cik"] = df["cik"].astype("Int64")
+        return df
+
+    def latest_filed_at(self):
+        """Latest filedAt stored per (ticker, formType)"""
+        rows = self.conn.execute(
+            'SELECT "ticker", "formType", MAX("filedAt") FROM filings GROUP BY "ticker", "formType"'
+        ).fetchall()
+        return {(ticker, form): filed_at for ticker, form, filed_at in rows}
+
+    def import_csv(self, csv_path=METADATA_CSV):
+        """One-off migration from the old metadata.csv"""
+        return self.upsert_frame(pd.read_csv(csv_path))
+
+    def export_csv(self, csv_path=METADATA_CSV):
+        self.load().to_csv(csv_path, index=False)
+
+def open_store(path=STORE_PATH, csv_path=METADATA_CSV):
+    """Open the store, importing metadata.csv the first time if it exists"""
+    is_new = not os.path.exists(path)
+    store = FilingStore(path)
+    if is_new and os.path.exists(csv_path):
+        count = store.import_csv(csv_path)
+        print(f"📦 Imported {count} filings from {csv_path} into {path}")
+    return store
+
+def frontmatter_frame(df):
+    """Frontmatter fields for every filing, built column-wise.
+
+    Same fields and fallbacks as the old per-row helpers: filing_type falls
+    back to filingType, filing_date to filingDate, company_name to
+    companyNameLong, and section defaults to the filing type.
+    """
+    def column(name):
+        return df[name] if name in df else pd.Series(None, index=df.index, dtype=object)
+
+    fm = pd.DataFrame(index=df.index)
+    fm["ticker"] = column("ticker")
+    fm["filing_type"] = column("formType").fillna(column("filingType"))
+    fm["filing_date"] = column("filedAt").fillna(column("filingDate"))
+    fm["accession_number"] = column("accessionNo")
+    fm["company_name"] = column("companyName").fillna(column("companyNameLong"))
+    fm["cik"] = pd.to_numeric(column("cik"), errors="coerce").astype("Int64")
+    fm["section"] = fm["filing_type"].fillna("Unknown")
+    return fm
+
+def frontmatter_records(df):
+    """List of frontmatter dicts aligned with df rows, with missing fields dropped"""
+    fm = frontmatter_frame(df)
+    # to_json turns <NA>/NaN into null and numpy scalars into plain ints in one C pass
+    records = json.loads(fm.to_json(orient="records"))
+    return [{key: value for key, value in record.items() if value is not None} for record in records]
@@ -0,0 +1,245 @@
+"""
+Near-duplicate chunk elimination with MinHash signatures and LSH banding.
+
+Consecutive filings of one company repeat boilerplate (risk factors,
+forward-looking statements, legal proceedings) nearly verbatim, and a
+filing repeats itself (tables of contents, exhibits quoting the body).
+Each chunk gets a MinHash signature over word shingles; LSH bands find
+earlier chunks that probably overlap, and a chunk whose estimated Jaccard
+similarity with one of them reaches DEDUP_THRESHOLD is never embedded:
+  - a copy within the same filing is not stored at all
+  - a copy from another filing is stored as one row per filing that
+    reuses the stored vector, so its ticker/filing_type/filing_date
+    filters still find it
+
+The chunk whose vector was computed (the root) records every copy in its
+metadata:
+  - dup_count     number of collapsed or vector-sharing chunks
+  - dup_sources   comma-separated source_doc names they came from
+
+A shared row holds its own copy of the vector, so no file depends on
+another being stored. The index lives in SQLite (dedup_index.db) so
+incremental runs dedup against everything ingested before.
+"""
+import re
+import zlib
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+DEDUP_INDEX_PATH = "dedup_index.db"
+NUM_PERM = 64  # MinHash permutations per signature
+BANDS = 8  # LSH bands of NUM_PERM // BANDS rows: candidates from ~0.77 similarity up
+SHINGLE_SIZE = 5  # Words per shingle
+DEDUP_THRESHOLD = 0.85  # Estimated Jaccard similarity at which a chunk is a duplicate
+PRIME = 4294967291  # Largest 32-bit prime: (a * x + b) stays below 2**64
+
+# canon: every stored chunk, root_id being the chunk its vector was computed for.
+# dups: chunks matched to a root, stored = 1 for rows sharing its vector from another filing
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS canon (chunk_id TEXT PRIMARY KEY, source_doc TEXT, signature BLOB, root_id TEXT);
+    CREATE TABLE IF NOT EXISTS bands (key INTEGER, chunk_id TEXT);
+    CREATE TABLE IF NOT EXISTS dups (chunk_id TEXT PRIMARY KEY, source_doc TEXT,
+                                     canonical_id TEXT, canonical_doc TEXT, stored INTEGER);
+    CREATE INDEX IF NOT EXISTS idx_bands_key ON bands (key);
+    CREATE INDEX IF NOT EXISTS idx_canon_doc ON canon (source_doc);
+    CREATE INDEX IF NOT EXISTS idx_canon_root ON canon (root_id);
+    CREATE INDEX IF NOT EXISTS idx_dups_doc ON dups (source_doc);
+    CREATE INDEX IF NOT EXISTS idx_dups_canonical ON dups (canonical_id);
+    CREATE INDEX IF NOT EXISTS idx_dups_canonical_doc ON dups (canonical_doc);
+"""
+
+WORD_RE = re.compile(r"\w+")
+_rng = np.random.default_rng(20240101)
+PERM_A = _rng.integers(1, PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+PERM_B = _rng.integers(0, PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """crc32 of every run of `size` lowercased words (stable across processes)"""
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+def minhash(text):
+    """uint32 MinHash signature of NUM_PERM values"""
+    hashes = shingle_hashes(text)
+    return ((PERM_A * hashes + PERM_B) % PRIME).min(axis=1).astype(np.uint32)
+
+def band_keys(signature, bands=BANDS):
+    """One signed 64-bit key per band (SQLite INTEGER range)"""
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        digest = hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(),
+                                 digest_size=8, person=band.to_bytes(2, "little")).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(a == b))
+
+class DedupIndex:
+    """Persistent LSH index of stored chunks plus the duplicates folded into or sharing them.
+
+    Used from the encode thread (filter_batch) and the writer thread
+    (refresh_metadata), so every method takes the lock.
+    """
+
+    def __init__(self, path=DEDUP_INDEX_PATH, threshold=DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.kept = 0
+        self.shared = 0
+        self.collapsed = 0
+
+    def reset(self):
+        """Empty the index (recreating the tables, so older layouts are replaced)"""
+        with self.lock, self.conn:
+            self.conn.executescript("DROP TABLE IF EXISTS canon; DROP TABLE IF EXISTS bands; "
+                                    "DROP TABLE IF EXISTS dups;" + SCHEMA)
+
+    def _find(self, signature, keys, source_doc):
+        """(chunk_id, source_doc, root_id) of the most similar stored chunk above the threshold.
+
+        A match in `source_doc` itself wins over a closer one in another filing.
+        """
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self.conn.execute(
+            f"SELECT DISTINCT c.chunk_id, c.source_doc, c.root_id, c.signature FROM bands b "
+            f"JOIN canon c ON c.chunk_id = b.chunk_id WHERE b.key IN ({placeholders})", keys
+        ).fetchall()
+        best, best_rank = None, None
+        for chunk_id, doc, root_id, blob in rows:
+            score = similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            rank = (doc == source_doc, score)
+            if score >= self.threshold and (best_rank is None or rank > best_rank):
+                best, best_rank = (chunk_id, doc, root_id), rank
+        return best
+
+    def _store(self, chunk_id, source_doc, signature, keys, root_id):
+        self.conn.execute("INSERT OR REPLACE INTO canon VALUES (?, ?, ?, ?)",
+                          (chunk_id, source_doc, signature.tobytes(), root_id))
+        self.conn.executemany("INSERT INTO bands VALUES (?, ?)", ((key, chunk_id) for key in keys))
+
+    def filter_batch(self, signatures, metadatas, ids):
+        """Sort a batch into chunks to embed, to store with a shared vector, and to drop.
+
+        Returns (keep, shared, canonical_ids): indices of chunks to embed,
+        {index: root chunk id} of chunks from another filing that are stored
+        with their root's vector, and the roots whose dup metadata changed.
+        Chunks earlier in the same batch count as stored.
+        """
+        keep, shared, canonical_ids = [], {}, set()
+        with self.lock, self.conn:
+            for i, (signature, metadata, chunk_id) in enumerate(zip(signatures, metadatas, ids)):
+                signature = np.asarray(signature, dtype=np.uint32)
+                keys = band_keys(signature)
+                source_doc = metadata["source_doc"]
+                match = self._find(signature, keys, source_doc)
+                if match is None:
+                    self._store(chunk_id, source_doc, signature, keys, chunk_id)
+                    keep.append(i)
+                    continue
+                match_id, match_doc, root_id = match
+                if match_doc == source_doc:
+                    # Collapsed into the stored copy of this filing
+                    self.conn.execute("INSERT OR REPLACE INTO dups VALUES (?, ?, ?, ?, 0)",
+                                      (chunk_id, source_doc, match_id, match_doc))
+                    canonical_ids.add(match_id)
+                else:
+                    root_doc = self.conn.execute("SELECT source_doc FROM canon WHERE chunk_id = ?",
+                                                 (root_id,)).fetchone()[0]
+                    self._store(chunk_id, source_doc, signature, keys, root_id)
+                    self.conn.execute("INSERT OR REPLACE INTO dups VALUES (?, ?, ?, ?, 1)",
+                                      (chunk_id, source_doc, root_id, root_doc))
+                    shared[i] = root_id
+                    canonical_ids.add(root_id)
+        self.kept += len(keep)
+        self.shared += len(shared)
+        self.collapsed += len(ids) - len(keep) - len(shared)
+        return keep, shared, canonical_ids
+
+    def forget_docs(self, docs):
+        """Drop stored chunks and duplicates of `docs`.
+
+        Rows of other filings that shared a dropped root's vector keep their
+        own copy and become roots themselves. Returns ids of surviving
+        chunks that lost duplicates, whose metadata needs a refresh.
+        """
+        if not docs:
+            return set()
+        docs = list(docs)
+        placeholders = ", ".join("?" for _ in docs)
+        with self.lock, self.conn:
+            touched = {chunk_id for (chunk_id,) in self.conn.execute(
+                f"SELECT DISTINCT canonical_id FROM dups WHERE source_doc IN ({placeholders}) "
+                f"AND canonical_doc NOT IN ({placeholders})", docs + docs)}
+            self.conn.execute(f"UPDATE canon SET root_id = chunk_id WHERE source_doc NOT IN ({placeholders}) "
+                              f"AND root_id IN (SELECT chunk_id FROM canon WHERE source_doc IN ({placeholders}))",
+                              docs + docs)
+            self.conn.execute(f"DELETE FROM dups WHERE source_doc IN ({placeholders}) "
+                              f"OR canonical_doc IN ({placeholders})", docs + docs)
+            self.conn.execute(f"DELETE FROM bands WHERE chunk_id IN "
+                              f"(SELECT chunk_id FROM canon WHERE source_doc IN ({placeholders}))", docs)
+            self.conn.execute(f"DELETE FROM canon WHERE source_doc IN ({placeholders})", docs)
+        return touched
+
+    def dup_metadata(self, canonical_ids):
+        """canonical id → {"dup_count", "dup_sources"} from the recorded duplicates"""
+        result = {chunk_id: {"dup_count": 0, "dup_sources": ""} for chunk_id in canonical_ids}
+        with self.lock:
+            for chunk_id in canonical_ids:
+                rows = self.conn.execute("SELECT source_doc FROM dups WHERE canonical_id = ?",
+                                         (chunk_id,)).fetchall()
+                result[chunk_id] = {
+                    "dup_count": len(rows),
+                    "dup_sources": ",".join(sorted({doc for (doc,) in rows})),
+                }
+        return result
+
+    @staticmethod
+    def fill_shared(collection, ids, embeddings, vector_of):
+        """Put each shared row's root vector into `embeddings` (None placeholders).
+
+        Roots come from the same batch or from the collection, where every
+        earlier batch has already been written.
+        """
+        position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        missing = sorted({root for root in vector_of.values() if root not in position})
+        stored = {}
+        if missing:
+            found = collection.get(ids=missing, include=["embeddings"])
+            stored = {chunk_id: np.asarray(vector).tolist() for chunk_id, vector in zip(found["ids"], found["embeddings"])}
+        for chunk_id, root in vector_of.items():
+            vector = embeddings[position[root]] if root in position else stored.get(root)
+            if vector is None:
+                raise ValueError(f"vector of {root} (shared by {chunk_id}) not found")
+            embeddings[position[chunk_id]] = vector
+        return embeddings
+
+    def refresh_metadata(self, collection, canonical_ids):
+        """Rewrite dup_count / dup_sources on the stored canonical chunks"""
+        if not canonical_ids:
+            return
+        found = collection.get(ids=list(canonical_ids), include=["metadatas"])
+        if not found["ids"]:
+            return
+        dup_fields = self.dup_metadata(found["ids"])
+        metadatas = [{**(metadata or {}), **dup_fields[chunk_id]}
+                     for chunk_id, metadata in zip(found["ids"], found["metadatas"])]
+        collection.update(ids=found["ids"], metadatas=metadatas)
+
+    def report(self):
+        total = self.kept + self.shared + self.collapsed
+        rate = 100 * (self.shared + self.collapsed) / total if total else 0.0
+        print(f"🧬 Near-duplicates: {self.shared + self.collapsed}/{total} chunks not embedded ({rate:.1f}%): "
+              f"{self.collapsed} collapsed, {self.shared} stored with a shared vector, {self.kept} embedded")
@@ -0,0 +1,325 @@
+"""
+Async HTTP QA service over the shared resources (resources.py).
+
+    uvicorn qa_service:app --port 8000
+    curl -s localhost:8000/query -H 'Content-Type: application/json' \
+         -d '{"query": "What are Tesla'"'"'s risk factors?", "k": 5}'
+
+POST /query   {"query", "k", "filters": {"tickers", "filing_types", "years"},
+               "stream", "retrieve_only"}
+GET  /metrics throughput, latency, queue depths, embedding batch sizes, caches
+GET  /health  resources.health() (503 if not ready; startup fails if warm-up did)
+
+Concurrency model:
+  - each query is embedded on the event loop before retrieval: EmbeddingBatcher
+    coalesces concurrent requests into micro-batches (up to EMBED_MAX_BATCH,
+    waiting at most EMBED_MAX_WAIT_MS after the first) for one model call
+  - retrieval (search, filters, reranking, packing) then runs with that
+    embedding in a bounded thread pool of RETRIEVAL_WORKERS; requests beyond
+    that wait in its queue
+  - Gemini calls are awaited (ainvoke / astream), so any number run at once
+
+Uses the same shared resources, filters, answer cache and context packing
+as app.py; the service is stateless (no chat history).
+"""
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from langchain_core.prompts import PromptTemplate
+import resources
+from retrieval import source_records, chunk_ids
+from query_analyzer import decomposed_search, describe
+from context_packing import pack_context, CONTEXT_TOKEN_BUDGET
+from conversation_memory import fit_prompt, MAX_QUESTION_CHARS
+from answer_stream import chunk_text
+from reranker import RERANK_CANDIDATES
+
+RETRIEVAL_WORKERS = 8  # Concurrent retrievals
+EMBED_MAX_BATCH = 32  # Queries per embedding call
+EMBED_MAX_WAIT_MS = 5  # Wait after the first queued query for others to join its batch
+METRICS_WINDOW_SECONDS = 60  # Window for throughput and latency percentiles
+
+prompt = PromptTemplate.from_template("""
+You are a financial research analyst AI assistant.
+Answer the following question using only the context below.
+Cite the source (ticker, filing_type, section, filing_date) where relevant.
+
+Question: {question}
+
+Context:
+{context}
+
+Helpful Answer:
+""")
+
+class Filters(BaseModel):
+    """Explicit filters; each given field replaces what is extracted from the question"""
+    model_config = ConfigDict(extra="forbid")
+
+    tickers: list[str] = []
+    filing_types: list[str] = []
+    years: list[int] = []
+
+class QueryRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    query: str = Field(min_length=1, max_length=MAX_QUESTION_CHARS)
+    k: int | None = Field(None, ge=1, le=RERANK_CANDIDATES)
+    filters: Filters | None = None
+    stream: bool = False
+    retrieve_only: bool = False
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embed requests into micro-batches for one encode call"""
+
+    def __init__(self, embeddings, executor, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.embedded = 0
+        self.largest_batch = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def embed(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.embeddings.embed_documents, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.embedded += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize(), "batches": self.batches, "embedded": self.embedded,
+                "avg_batch": self.embedded / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch}
+
+class Metrics:
+    """Request counters, in-flight gauges and windowed latency"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.retrieval_waiting = 0
+        self.llm_in_flight = 0
+        self.recent = deque()  # (finished at, seconds)
+
+    def finish(self, seconds, error=False):
+        now = time.time()
+        with self.lock:
+            self.errors += error
+            self.recent.append((now, seconds))
+            while self.recent and self.recent[0][0] < now - METRICS_WINDOW_SECONDS:
+                self.recent.popleft()
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            latencies = sorted(seconds for _, seconds in self.recent)
+            window = min(METRICS_WINDOW_SECONDS, now - self.started) or 1.0
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+            return {"requests": self.requests, "errors": self.errors, "in_flight": self.in_flight,
+                    "retrieval_queue_depth": self.retrieval_waiting, "llm_in_flight": self.llm_in_flight,
+                    "throughput_rps": len(latencies) / window,
+                    "latency_p50_ms": 1000 * percentile(0.5), "latency_p95_ms": 1000 * percentile(0.95),
+                    "uptime_seconds": now - self.started}
+
+state = {}
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load models and indexes before accepting traffic; don't serve at all if that failed
+    await asyncio.to_thread(resources.warm_up, False)
+    report = await asyncio.to_thread(resources.health)
+    if not report["ready"]:
+        error = report["warmup"].get("error") or report.get("collection_error")
+        print(f"❌ Warm-up failed, not starting: {error}")
+        raise RuntimeError(f"warm-up failed: {error}")
+    retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    embed_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+    batcher = EmbeddingBatcher(resources.get_embeddings(), embed_pool)
+    batcher.start()
+    state.update(retrieval_pool=retrieval_pool, batcher=batcher, metrics=Metrics())
+    yield
+    await batcher.stop()
+    retrieval_pool.shutdown(wait=False, cancel_futures=True)
+    embed_pool.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="SEC Filings QA", lifespan=lifespan)
+
+def retrieve(request, embedding):
+    """Blocking retrieval for one embedded request: filtered/decomposed search, reranking, packing"""
+    # Same retriever and result cache as the other front-ends
+    embedding, docs, analysis = decomposed_search(resources.get_search(), resources.get_analyzer(), request.query,
+                                                  k=request.k, reranker=resources.get_reranker(),
+                                                  filters=request.filters.model_dump() if request.filters else None,
+                                                  embedding=embedding)
+    question, _, budget = fit_prompt(prompt.template, request.query, "")
+    docs, context, packing = pack_context(docs, min(CONTEXT_TOKEN_BUDGET, budget))
+    return embedding, docs, question, context, analysis, packing
+
+async def run_retrieval(request, embedding):
+    metrics = state["metrics"]
+    loop = asyncio.get_running_loop()
+    queued = {"waiting": True}
+    with metrics.lock:
+        metrics.retrieval_waiting += 1
+
+    def leave_queue():
+        # Once, whether the task starts or the request is cancelled before it does
+        with metrics.lock:
+            if queued["waiting"]:
+                queued["waiting"] = False
+                metrics.retrieval_waiting -= 1
+
+    def task():
+        leave_queue()
+        return retrieve(request, embedding)
+
+    try:
+        return await loop.run_in_executor(state["retrieval_pool"], task)
+    finally:
+        leave_queue()
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="query is empty")
+    metrics = state["metrics"]
+    start = time.perf_counter()
+    with metrics.lock:
+        metrics.requests += 1
+        metrics.in_flight += 1
+    streaming = False
+    try:
+        # Embedded here, not in the retrieval pool, so a micro-batch isn't capped at RETRIEVAL_WORKERS
+        embedding = await state["batcher"].embed(request.query)
+        embedding, docs, question, context, analysis, packing = await run_retrieval(request, embedding)
+        body = {"query": request.query, "filter": describe(analysis), "sources": source_records(docs),
+                "packing": packing, "timings": {"retrieval_seconds": time.perf_counter() - start}}
+        if not request.retrieve_only:
+            answer_cache = resources.get_answer_cache()
+            evidence = chunk_ids(docs)
+            cached = await asyncio.to_thread(answer_cache.get, embedding, evidence, prompt.template)
+            text = prompt.format(context=context, question=question)
+            if request.stream and cached is None:
+                # Finishing (metrics, cache) moves to the stream
+                streaming = True
+                return StreamingResponse(stream_answer(text, embedding, evidence, request.query, start),
+                                         media_type="text/plain; charset=utf-8")
+            answer = cached
+            if answer is None:
+                answer = await generate(text)
+                await asyncio.to_thread(answer_cache.put, embedding, evidence, answer, request.query,
+                                        prompt.template)
+            body.update(answer=answer, cached=cached is not None)
+        body["timings"]["total_seconds"] = time.perf_counter() - start
+        metrics.finish(body["timings"]["total_seconds"])
+        return body
+    except Exception:
+        # Bad input is rejected by QueryRequest (422) before this point; details stay in the server log
+        traceback.print_exc()
+        metrics.finish(time.perf_counter() - start, error=True)
+        raise HTTPException(status_code=500, detail="internal error")
+    finally:
+        if not streaming:
+            with metrics.lock:
+                metrics.in_flight -= 1
+
+async def generate(text):
+    """Awaited Gemini call: the event loop serves other requests meanwhile"""
+    metrics = state["metrics"]
+    with metrics.lock:
+        metrics.llm_in_flight += 1
+    try:
+        return (await resources.get_llm().ainvoke(text)).content
+    finally:
+        with metrics.lock:
+            metrics.llm_in_flight -= 1
+
+async def stream_answer(text, embedding, evidence, question, start):
+    """Answer tokens as they arrive, then cached for next time"""
+    metrics = state["metrics"]
+    parts = []
+    error = False
+    with metrics.lock:
+        metrics.llm_in_flight += 1
+    try:
+        async for chunk in resources.get_llm().astream(text):
+            piece = chunk_text(chunk)
+            if piece:
+                parts.append(piece)
+                yield piece
+        await asyncio.to_thread(resources.get_answer_cache().put, embedding, evidence, "".join(parts),
+                                question, prompt.template)
+    except Exception:
+        error = True
+        raise
+    finally:
+        with metrics.lock:
+            metrics.llm_in_flight -= 1
+            metrics.in_flight -= 1
+        metrics.finish(time.perf_counter() - start, error=error)
+
+@app.get("/metrics")
+async def get_metrics():
+    snapshot = state["metrics"].snapshot()
+    snapshot["embedding"] = state["batcher"].stats()
+    snapshot["retrieval_cache"] = resources.get_search().cache.stats()
+    snapshot["answer_cache"] = await asyncio.to_thread(resources.get_answer_cache().stats)
+    reranker = resources.get_reranker()
+    if reranker is not None:
+        snapshot["reranker"] = reranker.stats()
+    return snapshot
+
+@app.get("/health")
+async def health():
+    report = await asyncio.to_thread(resources.health)
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
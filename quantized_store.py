@@ -0,0 +1,277 @@
+"""
+Compact first-pass vector index with full-precision rescoring.
+
+Chunk vectors are exported from the Chroma collection into:
+  - codes.bin   int8 (per-dimension scale) or 1-bit sign codes, optionally
+                after a PCA projection to fewer dimensions; held in RAM
+  - full.f32    the original float32 vectors, memory-mapped and only read
+                for the few candidates being rescored
+  - ids.json    chunk ids aligned with both arrays
+
+A query scans the codes for the best `k * RESCORE_FACTOR` candidates,
+rescores those with the exact vectors and returns the top k. Documents
+are hydrated from Chroma by id, so the collection stays the source of truth.
+"""
+import os
+import json
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+QUANTIZED_INDEX_DIR = "quantized_index"
+QUANTIZATION_MODES = ("int8", "binary")
+RESCORE_FACTOR = 10  # First-pass candidates per requested result
+EXPORT_PAGE_SIZE = 5000  # Vectors read from Chroma per get() call
+SCAN_BLOCK_SIZE = 65536  # Codes scored at a time (bounds temporary memory)
+PCA_SAMPLE_SIZE = 50_000  # Vectors used to fit the projection
+
+# Set bits per byte value, for Hamming distances on packed binary codes
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+def export_vectors(collection, page_size=EXPORT_PAGE_SIZE):
+    """All (ids, float32 vectors) of a Chroma collection, read page by page"""
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    if not ids:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return ids, np.concatenate(vectors)
+
+def fit_pca(vectors, dims, sample_size=PCA_SAMPLE_SIZE, seed=0):
+    """(mean, components) of the top `dims` principal directions"""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > sample_size:
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return mean.astype(np.float32), vt[:dims].astype(np.float32)
+
+class QuantizedIndex:
+    def __init__(self, ids, codes, full, mode, scale=None, mean=None, components=None):
+        self.ids = ids
+        self.codes = codes
+        self.full = full
+        self.mode = mode
+        self.scale = scale
+        self.mean = mean
+        self.components = components
+        self.pca_dims = None if components is None else components.shape[0]
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, vectors, mode="int8", dims=None, index_dir=QUANTIZED_INDEX_DIR):
+        """Quantize vectors and write the index files to index_dir"""
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        os.makedirs(index_dir, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        mean = components = None
+        reduced = vectors
+        if dims and dims < vectors.shape[1]:
+            mean, components = fit_pca(vectors, dims)
+            reduced = (vectors - mean) @ components.T
+
+        scale = None
+        if mode == "binary" and mean is None:
+            # Sign bits around the per-dimension mean (PCA output is already centered)
+            mean = vectors.mean(axis=0)
+            reduced = vectors - mean
+        if mode == "int8":
+            # Symmetric per-dimension scale so the largest value maps to 127
+            scale = np.maximum(np.abs(reduced).max(axis=0), 1e-12).astype(np.float32) / 127
+            codes = np.clip(np.rint(reduced / scale), -127, 127).astype(np.int8)
+        else:
+            codes = np.packbits(reduced > 0, axis=1)
+
+        full = np.memmap(os.path.join(index_dir, "full.f32"), dtype=np.float32,
+                         mode="w+", shape=vectors.shape)
+        full[:] = vectors
+        full.flush()
+        codes.tofile(os.path.join(index_dir, "codes.bin"))
+        arrays = {"scale": scale, "mean": mean, "components": components}
+        np.savez(os.path.join(index_dir, "params.npz"),
+                 **{name: value for name, value in arrays.items() if value is not None})
+
+        tmp_path = os.path.join(index_dir, "ids.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "mode": mode,
+                "dim": vectors.shape[1],
+                "pca_dims": None if components is None else int(components.shape[0]),
+                "code_shape": list(codes.shape),
+                "ids": list(ids),
+            }, f)
+        # ids.json is written last: its presence marks a complete index
+        os.replace(tmp_path, os.path.join(index_dir, "ids.json"))
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir=QUANTIZED_INDEX_DIR):
+        with open(os.path.join(index_dir, "ids.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        dtype = np.int8 if meta["mode"] == "int8" else np.uint8
+        codes = np.fromfile(os.path.join(index_dir, "codes.bin"), dtype=dtype).reshape(meta["code_shape"])
+        full = np.memmap(os.path.join(index_dir, "full.f32"), dtype=np.float32, mode="r",
+                         shape=(len(meta["ids"]), meta["dim"]))
+        params = np.load(os.path.join(index_dir, "params.npz"))
+        return cls(meta["ids"], codes, full, meta["mode"],
+                   scale=params["scale"] if "scale" in params else None,
+                   mean=params["mean"] if "mean" in params else None,
+                   components=params["components"] if "components" in params else None)
+
+    def _project(self, query):
+        if self.mean is not None:
+            query = query - self.mean
+        if self.components is not None:
+            query = query @ self.components.T
+        return query
+
+    def candidates(self, query, count, rows=None):
+        """Rows of the `count` best first-pass matches (optionally among `rows` only)"""
+        q = self._project(np.asarray(query, dtype=np.float32))
+        if self.mode == "int8":
+            # Asymmetric: float query against int8 codes, folding the scale into the query
+            q = q * self.scale
+        else:
+            q_bits = np.packbits(q > 0)
+
+        rows = np.arange(len(self.ids)) if rows is None else np.asarray(rows)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCAN_BLOCK_SIZE):
+            block = self.codes[rows[start:start + SCAN_BLOCK_SIZE]]
+            if self.mode == "int8":
+                scores[start:start + len(block)] = block @ q
+            else:
+                # Fewer differing bits = closer; negate so higher is better
+                scores[start:start + len(block)] = -POPCOUNT[block ^ q_bits].sum(axis=1, dtype=np.int32)
+
+        count = min(count, len(rows))
+        if count == 0:
+            return rows[:0]
+        top = np.argpartition(-scores, count - 1)[:count]
+        return rows[top]
+
+    def search(self, query, k=5, rescore_factor=RESCORE_FACTOR, rows=None):
+        """(ids, scores) of the top k after exact rescoring of the first-pass candidates"""
+        query = np.asarray(query, dtype=np.float32)
+        candidates = np.sort(self.candidates(query, k * rescore_factor, rows))
+        if rescore_factor <= 0 or len(candidates) == 0:
+            return [], []
+        # Sorted rows keep memmap reads sequential
+        exact = self.full[candidates] @ query
+        order = np.argsort(-exact)[:k]
+        return [self.ids[candidates[i]] for i in order], exact[order].tolist()
+
+    def memory_report(self):
+        """Bytes held in RAM for the first pass vs. a float32 index"""
+        float_bytes = len(self.ids) * self.full.shape[1] * 4
+        code_bytes = self.codes.nbytes
+        return {"float32_bytes": float_bytes, "code_bytes": code_bytes,
+                "ratio": float_bytes / code_bytes if code_bytes else 0.0}
+
+def evaluate_recall(index, vectors, k=5, queries=200, rescore_factor=RESCORE_FACTOR, seed=0):
+    """Recall@k against exact search, using stored vectors as queries.
+
+    Returns first-pass recall (codes only) and recall after rescoring.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+    first_pass = rescored = 0
+    start = time.time()
+    for row in picks:
+        query = vectors[row]
+        exact = set(np.argpartition(-(vectors @ query), k - 1)[:k].tolist())
+        rough = index.candidates(query, k)
+        first_pass += len(exact & set(rough.tolist()))
+        ids, _ = index.search(query, k, rescore_factor)
+        rescored += len(exact & {index.row_of[i] for i in ids})
+    total = len(picks) * k
+    return {
+        "queries": len(picks),
+        "first_pass_recall": first_pass / total if total else 0.0,
+        "rescored_recall": rescored / total if total else 0.0,
+        "ms_per_query": 1000 * (time.time() - start) / len(picks) if len(picks) else 0.0,
+    }
+
+def print_report(index, vectors, k=5):
+    memory = index.memory_report()
+    recall = evaluate_recall(index, vectors, k)
+    dims = index.codes.shape[1] * (8 if index.mode == "binary" else 1)
+    print(f"📉 Quantized index ({index.mode}, {dims} dims, {len(index)} vectors): "
+          f"{memory['code_bytes'] / 1e6:.1f} MB in RAM vs {memory['float32_bytes'] / 1e6:.1f} MB float32 "
+          f"({memory['ratio']:.1f}x smaller)")
+    print(f"🎯 Recall@{k} over {recall['queries']} queries: first pass {recall['first_pass_recall']:.3f}, "
+          f"after rescoring top {k * RESCORE_FACTOR} {recall['rescored_recall']:.3f} "
+          f"({recall['ms_per_query']:.1f} ms/query incl. exact baseline)")
+
+def build_from_collection(collection, mode="int8", dims=None, index_dir=QUANTIZED_INDEX_DIR, report=True):
+    """Export the collection's vectors and (re)build the quantized index"""
+    ids, vectors = export_vectors(collection)
+    if not ids:
+        print("Collection is empty, no quantized index built")
+        return None
+    index = QuantizedIndex.build(ids, vectors, mode=mode, dims=dims, index_dir=index_dir)
+    if report:
+        print_report(index, vectors)
+    return index
+
+class QuantizedRetriever(BaseRetriever):
+    """LangChain retriever over a QuantizedIndex, hydrating documents from Chroma.
+
+    `search_kwargs` accepts k and an optional Chroma `filter`; with a filter
+    the matching ids are looked up first and only those rows are scanned.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: QuantizedIndex
+    vectorstore: object
+    embeddings: object
+    search_kwargs: dict = {"k": 5}
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        query_vector = self.embeddings.embed_query(query)
+        return self.search_by_vector(query_vector, self.search_kwargs.get("k", 5),
+                                     self.search_kwargs.get("filter"))
+
+    def search_by_vector(self, query_vector, k=5, where=None):
+        """Top-k documents for an already embedded query"""
+        rows = None
+        if where:
+            allowed = self.vectorstore.get(where=where, include=[])["ids"]
+            rows = [self.index.row_of[i] for i in allowed if i in self.index.row_of]
+
+        ids, scores = self.index.search(query_vector, k, rows=rows)
+        if not ids:
+            return []
+        found = self.vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {i: (doc, meta) for i, doc, meta in zip(found["ids"], found["documents"], found["metadatas"])}
+        docs = []
+        for chunk_id, score in zip(ids, scores):
+            if chunk_id not in by_id:
+                # Deleted from Chroma since the index was built
+                continue
+            text, metadata = by_id[chunk_id]
+            docs.append(Document(page_content=text, metadata={**(metadata or {}), "score": score}, id=chunk_id))
+        return docs
+
+def make_retriever(vectorstore, embeddings, search_kwargs, index_dir=QUANTIZED_INDEX_DIR):
+    """Quantized retriever when an index has been built, else the plain Chroma retriever"""
+    if os.path.exists(os.path.join(index_dir, "ids.json")):
+        index = QuantizedIndex.load(index_dir)
+        print(f"Using quantized index ({index.mode}, {len(index)} vectors) from {index_dir}")
+        return QuantizedRetriever(index=index, vectorstore=vectorstore, embeddings=embeddings,
+                                  search_kwargs=search_kwargs)
+    return vectorstore.as_retriever(search_kwargs=search_kwargs)
@@ -0,0 +1,260 @@
+"""
+Metadata filter pushdown: tickers, form types and years from the question.
+
+"What did TSLA say in its 2023 10-K about supply chain?" should only search
+Tesla's 10-K chunks. The analyzer matches the question against a catalog
+of the filings actually in the collection (ticker, company name, form
+type, filing date) and turns what it finds into a Chroma `where` filter on
+ticker, filing_type and filing_date. filing_date is stored as an ISO
+string, so years become a `$in` over the catalog's matching dates.
+
+Questions naming several companies ("Compare R&D spending of Tesla and
+Apple") are decomposed: one sub-query per company, each with its own
+filter, retrieved concurrently and merged round-robin under a shared
+chunk budget, so one company cannot crowd out the other.
+
+The catalog (metadata_catalog.json) is written by chuncking_and_embedding.py
+whenever the collection changes. filtered_search falls back to unfiltered
+results when the filtered partition returns fewer than k chunks.
+"""
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from companies import TICKERS, SHORT_NAMES
+
+METADATA_CATALOG_PATH = "metadata_catalog.json"
+EXPORT_PAGE_SIZE = 5000  # Metadatas read from Chroma per get() call
+# Annual reports for fiscal year N are mostly filed by the end of March of N+1
+FISCAL_YEAR_SPILLOVER = "-03-31"
+
+FORM_PATTERNS = [
+    ("10-K", re.compile(r"\b10-?\s?K\b|\bannual report", re.IGNORECASE)),
+    ("10-Q", re.compile(r"\b10-?\s?Q\b|\bquarterly report", re.IGNORECASE)),
+    ("8-K", re.compile(r"\b8-?\s?K\b|\bcurrent report", re.IGNORECASE)),
+    ("DEF 14A", re.compile(r"\bDEF\s?14A\b|\bproxy\b", re.IGNORECASE)),
+]
+YEAR_RE = re.compile(r"\b(?:FY\s?)?((?:19|20)\d{2})\b", re.IGNORECASE)
+LATEST_RE = re.compile(r"\b(?:latest|most recent|newest)\b", re.IGNORECASE)
+MAX_SUBQUERIES = 5  # Entities retrieved separately in one question
+CONTEXT_BUDGET = 8  # Chunks shared by all sub-queries of a multi-entity question
+MIN_PER_ENTITY = 2  # Chunks each entity gets regardless of the budget
+TICKER_RE = re.compile(r"\b[A-Z]{1,5}\b")
+# Dropped from company names to get the name people actually type
+NAME_SUFFIXES = frozenset(
+    "inc incorporated corp corporation co company group holdings plc ltd llc the com de".split())
+
+# Sub-query retrievals; separate from the hybrid retriever's pool so they never wait on each other
+_executor = ThreadPoolExecutor(max_workers=MAX_SUBQUERIES, thread_name_prefix="subquery")
+
+def export_catalog(collection, page_size=EXPORT_PAGE_SIZE):
+    """Distinct (ticker, company_name, filing_type, filing_date) of a Chroma collection"""
+    filings = set()
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for metadata in page["metadatas"]:
+            metadata = metadata or {}
+            filings.add(tuple(str(metadata.get(field) or "") for field in
+                              ("ticker", "company_name", "filing_type", "filing_date")))
+        offset += len(page["ids"])
+    return sorted(filings)
+
+def build_catalog(collection, path=METADATA_CATALOG_PATH):
+    """Export the collection's filings and write the catalog atomically"""
+    filings = export_catalog(collection)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fields": ["ticker", "company_name", "filing_type", "filing_date"], "filings": filings}, f)
+    os.replace(tmp_path, path)
+    print(f"🗂️ Metadata catalog: {len(filings)} filings in {path}")
+    return filings
+
+def load_catalog(path=METADATA_CATALOG_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return [tuple(filing) for filing in json.load(f)["filings"]]
+
+def company_aliases(name):
+    """Lowercase name a question may use: "JPMORGAN CHASE & CO" → {"jpmorgan chase"}
+
+    Only the full name: a first word alone ("walt", "general", "american")
+    is too often an ordinary word. Shorter names come from SHORT_NAMES.
+    """
+    words = [w for w in re.findall(r"[a-z0-9&]+", name.lower()) if w not in NAME_SUFFIXES and w != "&"]
+    return {" ".join(words)} if words else set()
+
+class QueryAnalyzer:
+    """Question → metadata constraints → Chroma `where` filter"""
+
+    def __init__(self, filings, tickers=TICKERS, short_names=SHORT_NAMES):
+        self.filings = filings
+        self.tickers = set(tickers) | {f[0] for f in filings if f[0]}
+        self.form_types = {f[2] for f in filings if f[2]}
+        aliases = {}
+        for ticker, company, _, _ in filings:
+            if ticker and company:
+                for alias in company_aliases(company):
+                    aliases.setdefault(alias, set()).add(ticker)
+        for ticker, names in short_names.items():
+            if ticker in self.tickers:
+                for name in names:
+                    aliases.setdefault(name, set()).add(ticker)
+        self.alias_tickers = aliases
+        self.alias_re = None
+        if aliases:
+            # Longest first, so "jpmorgan chase" wins over a shorter overlapping alias
+            ordered = sorted(aliases, key=len, reverse=True)
+            self.alias_re = re.compile(r"\b(" + "|".join(re.escape(a) for a in ordered) + r")\b")
+
+    def analyze(self, question, filters=None):
+        """{"tickers", "filing_types", "years", "latest", "where"}; where is None if nothing matched.
+
+        `filters` ({"tickers", "filing_types", "years"}, e.g. from an API
+        caller) replaces what is extracted from the question, per field.
+        """
+        filters = filters or {}
+        tickers = {t for t in TICKER_RE.findall(question) if t in self.tickers}
+        if self.alias_re is not None:
+            for alias in self.alias_re.findall(question.lower()):
+                tickers |= self.alias_tickers[alias]
+        forms = {form for form, pattern in FORM_PATTERNS if pattern.search(question)}
+        if self.form_types:
+            forms &= self.form_types
+        years = {int(y) for y in YEAR_RE.findall(question)}
+        if filters.get("tickers"):
+            tickers = {t.upper() for t in filters["tickers"]}
+        if filters.get("filing_types"):
+            forms = set(filters["filing_types"])
+        if filters.get("years"):
+            years = {int(y) for y in filters["years"]}
+        latest = bool(LATEST_RE.search(question)) and not years
+        analysis = {"tickers": sorted(tickers), "filing_types": sorted(forms), "years": sorted(years),
+                    "latest": latest, "where": None}
+        if tickers or forms or years:
+            analysis["where"] = self.where(tickers, forms, years, latest)
+        return analysis
+
+    @staticmethod
+    def _in_years(filing_date, years):
+        """Filed in one of the years, or early enough in the next to report on it"""
+        date = filing_date[:10]
+        for year in years:
+            if date[:4] == str(year) or str(year + 1) <= date <= f"{year + 1}{FISCAL_YEAR_SPILLOVER}":
+                return True
+        return False
+
+    def where(self, tickers, forms, years, latest=False):
+        """Chroma filter for the constraints (an impossible one if no filing matches)"""
+        clauses = []
+        if tickers:
+            clauses.append({"ticker": {"$in": sorted(tickers)}})
+        if forms:
+            clauses.append({"filing_type": {"$in": sorted(forms)}})
+        if years or latest:
+            matching = [f for f in self.filings
+                        if (not tickers or f[0] in tickers) and (not forms or f[2] in forms)
+                        and (not years or self._in_years(f[3], years))]
+            if latest and matching:
+                # Newest filing per (ticker, form)
+                newest = {}
+                for filing in matching:
+                    key = (filing[0], filing[2])
+                    if key not in newest or filing[3] > newest[key][3]:
+                        newest[key] = filing
+                matching = list(newest.values())
+            dates = sorted({f[3] for f in matching if f[3]})
+            if years or dates:
+                clauses.append({"filing_date": {"$in": dates or [""]}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def filtered_search(search, analyzer, query, k=None, reranker=None, filters=None, embedding=None):
+    """(query embedding, documents, analysis) with the question's filter pushed down.
+
+    If the filtered partition yields fewer than k chunks, the rest is filled
+    from an unfiltered search (filtered chunks stay first). With a reranker,
+    reranker.candidates chunks are fetched and the best k kept. A given
+    embedding (e.g. from a batched embedding call) is used instead of
+    embedding the query again.
+    """
+    analysis = analyzer.analyze(query, filters) if analyzer is not None else {"where": None}
+    k = k or search.default_k
+    fetch = max(k, reranker.candidates) if reranker is not None else k
+    embedding, docs = search.search_with_embedding(query, where=analysis["where"], k=fetch, embedding=embedding)
+    analysis["fallback"] = False
+    if analysis["where"] is not None and len(docs) < k:
+        _, unfiltered = search.search_with_embedding(query, k=fetch, embedding=embedding)
+        seen = {doc.id for doc in docs}
+        docs = docs + [doc for doc in unfiltered if doc.id not in seen][:fetch - len(docs)]
+        analysis["fallback"] = True
+    if reranker is not None:
+        docs, analysis["rerank"] = reranker.rerank(query, docs, k)
+    return embedding, docs, analysis
+
+def describe(analysis):
+    """Short label of the applied filter, e.g. "TSLA · 10-K · 2023" """
+    parts = [", ".join(analysis.get("tickers", [])), ", ".join(analysis.get("filing_types", [])),
+             ", ".join(str(y) for y in analysis.get("years", [])), "latest" if analysis.get("latest") else ""]
+    label = " · ".join(p for p in parts if p)
+    if analysis.get("subqueries"):
+        label += " (" + ", ".join(f"{sub['ticker']}: {sub['found']}" for sub in analysis["subqueries"]) + " chunks)"
+    if analysis.get("fallback"):
+        label += " (+ unfiltered)"
+    return label
+
+def decompose(analyzer, analysis):
+    """Per-entity sub-analyses of a multi-company question ([] if there is one or none)"""
+    tickers = analysis["tickers"][:MAX_SUBQUERIES]
+    if len(tickers) < 2:
+        return []
+    return [{**analysis, "tickers": [ticker],
+             "where": analyzer.where({ticker}, set(analysis["filing_types"]), set(analysis["years"]),
+                                     analysis["latest"])}
+            for ticker in tickers]
+
+def decomposed_search(search, analyzer, query, k=None, budget=CONTEXT_BUDGET, reranker=None, filters=None,
+                      embedding=None):
+    """Like filtered_search, but multi-company questions get one concurrent retrieval per company.
+
+    The query is embedded once and shared by the sub-queries. The budget
+    is k when one is given (then never exceeded), else `budget`. Each
+    company gets max(MIN_PER_ENTITY, budget // companies) chunks, merged by
+    rank across companies and cut at the budget. With a reranker, each company's
+    share of reranker.candidates is fetched, all of them are scored in one
+    batch, and each company's list is reordered by those scores.
+    """
+    analysis = analyzer.analyze(query, filters) if analyzer is not None else {"where": None, "tickers": []}
+    parts = decompose(analyzer, analysis)
+    if not parts:
+        return filtered_search(search, analyzer, query, k, reranker, filters, embedding)
+
+    embedding = embedding if embedding is not None else search.embed(query)
+    budget = k or budget
+    per_entity = max(MIN_PER_ENTITY, budget // len(parts))
+    fetch = max(per_entity, reranker.candidates // len(parts)) if reranker is not None else per_entity
+    futures = [_executor.submit(search.search_with_embedding, query, part["where"], fetch, embedding)
+               for part in parts]
+    results = [future.result()[1] for future in futures]
+    if reranker is not None:
+        candidates = [doc for entity_docs in results for doc in entity_docs]
+        scores, analysis["rerank"] = reranker.scores(query, candidates)
+        if scores is not None:
+            score_of = {id(doc): score for doc, score in zip(candidates, scores)}
+            results = [reranker.order(entity_docs, [score_of[id(doc)] for doc in entity_docs])
+                       for entity_docs in results]
+
+    docs, seen = [], set()
+    for rank in range(per_entity):
+        for entity_docs in results:
+            if rank < len(entity_docs) and entity_docs[rank].id not in seen:
+                seen.add(entity_docs[rank].id)
+                docs.append(entity_docs[rank])
+    analysis["fallback"] = False
+    analysis["subqueries"] = [{"ticker": part["tickers"][0], "where": part["where"],
+                               "found": min(len(found), per_entity)}
+                              for part, found in zip(parts, results)]
+    # Without an explicit k, every company keeps at least its top chunk
+    return embedding, docs[:k or max(budget, len(parts))], analysis
@@ -0,0 +1,53 @@
+"""
+Token-bucket rate limiters shared by the SEC downloaders.
+
+SEC EDGAR allows at most 10 requests per second per client; every fetch
+(crawler, requests fallback, sec-api query) should acquire a token first.
+"""
+import time
+import asyncio
+import threading
+
+SEC_REQUESTS_PER_SECOND = 8  # Stay safely below the SEC cap of 10/s
+
+class AsyncRateLimiter:
+    """Token bucket for asyncio tasks: `await limiter.acquire()` before each request"""
+
+    def __init__(self, rate=SEC_REQUESTS_PER_SECOND, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RateLimiter:
+    """Thread-safe token bucket for worker threads: `limiter.acquire()` blocks until allowed"""
+
+    def __init__(self, rate=SEC_REQUESTS_PER_SECOND, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
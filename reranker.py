@@ -0,0 +1,148 @@
+"""
+Optional cross-encoder reranking between retrieval and context packing.
+
+The bi-encoder top-5 is often off-target, and raising k only inflates the
+prompt. With reranking on, retrieval fetches RERANK_CANDIDATES chunks, a
+small cross-encoder scores all (question, chunk) pairs in one batched CPU
+call, and the best k are kept.
+
+Reranking has a hard latency budget: scoring runs on a worker thread and
+if it has not finished within RERANK_BUDGET_SECONDS of the call, waiting
+for the worker included, the bi-encoder order is used instead. A call
+that is still queued behind other requests' scoring at that point is
+cancelled, so it never runs. The measured cost per pair also caps how
+many candidates are sent, so a slow machine reranks fewer chunks rather
+than timing out.
+
+Enable with RERANK=1 in the environment (.env works).
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from sentence_transformers import CrossEncoder
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 50  # Chunks fetched for reranking
+RERANK_BUDGET_SECONDS = 0.8  # Wait at most this long for scores
+RERANK_BATCH_SIZE = 64  # Pairs per forward pass (one pass for the default candidates)
+RERANK_MAX_TOKENS = 256  # Question + chunk tokens seen by the cross-encoder
+MIN_RERANK_CANDIDATES = 10  # Never cap the candidate count below this
+EWMA_WEIGHT = 0.3  # Weight of a faster call in the seconds-per-pair estimate
+
+class Reranker:
+    """Batched CPU cross-encoder with a latency budget and timing metrics"""
+
+    def __init__(self, model_name=RERANK_MODEL, candidates=RERANK_CANDIDATES, budget=RERANK_BUDGET_SECONDS,
+                 model=None):
+        # `model`: anything with CrossEncoder.predict (tests pass a stand-in)
+        self.model = model or CrossEncoder(model_name, device="cpu", max_length=RERANK_MAX_TOKENS)
+        self.candidates = candidates
+        self.budget = budget
+        # One worker: a call that overran keeps it busy, and the next call's wait counts against its budget
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self.lock = threading.Lock()
+        self.seconds_per_pair = None
+        self.calls = 0
+        self.fallbacks = 0
+        self.queue_timeouts = 0
+        self.total_seconds = 0.0
+        self.last = None  # Stats of the most recent call, for stats() only (calls overlap)
+        # Load weights and kernels now, not inside the first budgeted call
+        self._predict([("warm up", "warm up")])
+        self.seconds_per_pair = None
+
+    def _predict(self, pairs):
+        start = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        seconds = (time.perf_counter() - start) / len(pairs)
+        self._observe(seconds)
+        return [float(score) for score in scores]
+
+    def _observe(self, seconds, at_least=False):
+        """Update the cost estimate: rises at once when the machine is slower, decays slowly.
+
+        at_least: `seconds` is only a lower bound (a call cut off by the
+        budget), so it can raise the estimate but never lower it.
+        """
+        with self.lock:
+            if self.seconds_per_pair is None or seconds > self.seconds_per_pair:
+                self.seconds_per_pair = seconds
+            elif not at_least:
+                self.seconds_per_pair = EWMA_WEIGHT * seconds + (1 - EWMA_WEIGHT) * self.seconds_per_pair
+
+    def max_pairs(self):
+        """Candidates that fit the budget at the measured cost per pair"""
+        with self.lock:
+            if not self.seconds_per_pair:
+                return self.candidates
+            return min(self.candidates, max(MIN_RERANK_CANDIDATES, int(0.8 * self.budget / self.seconds_per_pair)))
+
+    def scores(self, query, docs):
+        """(score per doc, None for docs beyond the pair cap; or None if over budget) and this call's stats.
+
+        Both the wait for the worker and the scoring come out of one
+        budget, counted from this call; a call still queued when it runs
+        out is cancelled.
+        """
+        if not docs:
+            return [], {"pairs": 0, "seconds": 0.0, "wait_seconds": 0.0, "fallback": False}
+        start = time.perf_counter()
+        deadline = start + self.budget
+        count = min(len(docs), self.max_pairs())
+        pairs = [(query, doc.page_content) for doc in docs[:count]]
+        picked_up = {}
+        started = threading.Event()
+
+        def run():
+            picked_up["at"] = time.perf_counter()
+            started.set()
+            return self._predict(pairs)
+
+        future = self.executor.submit(run)
+        result, queued_out = None, False
+        if not started.wait(timeout=self.budget) and future.cancel():
+            # Still behind other calls' scoring: never runs, and says nothing about the cost per pair
+            queued_out = True
+        else:
+            # Picked up just as the budget ran out (cancel lost the race)
+            started.wait()
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except TimeoutError:
+                # Ran until the deadline: at least this slow; don't wait for the overrunning call to find out
+                future.cancel()
+                self._observe(max(0.0, deadline - picked_up["at"]) / count, at_least=True)
+        seconds = time.perf_counter() - start
+        stats = {"pairs": count, "seconds": seconds, "fallback": result is None,
+                 "wait_seconds": picked_up.get("at", start + seconds) - start}
+        with self.lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            if result is None:
+                self.fallbacks += 1
+            self.queue_timeouts += queued_out
+            self.last = stats
+        if result is None:
+            return None, stats
+        return result + [None] * (len(docs) - count), stats
+
+    def order(self, docs, scores):
+        """Docs by cross-encoder score; unscored docs keep bi-encoder order after the scored ones"""
+        if scores is None:
+            return list(docs)
+        ranked = sorted(range(len(docs)), key=lambda i: (scores[i] is None, -(scores[i] or 0.0), i))
+        return [docs[i] for i in ranked]
+
+    def rerank(self, query, docs, k):
+        """(best k docs, or the first k in bi-encoder order if the budget ran out; this call's stats)"""
+        scores, stats = self.scores(query, docs)
+        return self.order(docs, scores)[:k], stats
+
+    def stats(self):
+        max_pairs = self.max_pairs()
+        with self.lock:
+            return {"calls": self.calls, "fallbacks": self.fallbacks, "queue_timeouts": self.queue_timeouts,
+                    "avg_ms": 1000 * self.total_seconds / self.calls if self.calls else 0.0,
+                    "ms_per_pair": 1000 * (self.seconds_per_pair or 0.0),
+                    "max_pairs": max_pairs,
+                    "last": dict(self.last) if self.last else None}
@@ -0,0 +1,205 @@
+"""
+Process-wide shared resources for the QA front-ends.
+
+The embedding model, the Chroma vector store, the retriever, the search
+cache, the answer cache and the Gemini client are created once per
+process, on first use or by a background warm-up at server start, and
+then shared by every
+Streamlit rerun and session (and by llm.py). Creation is guarded by a lock
+so concurrent sessions never load a second copy. When ingestion changes
+the collection (new collection_version.txt stamp), the vector store handle
+(a rebuild recreates the collection under a new id), the retriever with
+its quantized/BM25 indexes, the search cache and the filter catalog are
+dropped and rebuilt on next use.
+
+    python resources.py   # load everything, print the health report, exit 1 if not ready
+"""
+import os
+import sys
+import json
+import time
+import threading
+from dotenv import load_dotenv
+from langchain_chroma import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_google_genai import ChatGoogleGenerativeAI
+from quantized_store import make_retriever, QuantizedRetriever
+from bm25_index import make_hybrid_retriever, HybridRetriever
+from retrieval import CachedSearch, RetrievalCache, collection_version
+from answer_cache import AnswerCache
+from query_analyzer import QueryAnalyzer, build_catalog, load_catalog, METADATA_CATALOG_PATH
+
+load_dotenv()
+
+CHROMA_DB_DIR = "chroma_db"
+COLLECTION_NAME = "sec_filings"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+LLM_MODEL = "gemini-1.5-flash"
+LLM_TEMPERATURE = 0.2
+RETRIEVER_K = 5
+RERANK = os.getenv("RERANK", "0") == "1"  # Cross-encoder reranking, see reranker.py
+WARMUP_QUERY = "risk factors"
+
+_lock = threading.RLock()
+_resources = {}
+_load_seconds = {}
+_warmup = {"status": "cold", "error": None, "seconds": None}
+_ready = threading.Event()
+# Bound to the collection (its handle, index files, catalog, cached results): reloaded after re-ingestion
+COLLECTION_RESOURCES = ("vectorstore", "retriever", "search", "analyzer")
+_collection = {"version": collection_version()}
+
+def _get(name, factory):
+    """Create a resource once per process (double-checked under the lock)"""
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+    with _lock:
+        if name not in _resources:
+            start = time.time()
+            _resources[name] = factory()
+            _load_seconds[name] = round(time.time() - start, 3)
+        return _resources[name]
+
+def _check_collection_version():
+    """Drop collection-derived resources once ingestion stamped a new collection version"""
+    version = collection_version()
+    if version == _collection["version"]:
+        return
+    with _lock:
+        if version == _collection["version"]:
+            return
+        for name in COLLECTION_RESOURCES:
+            _resources.pop(name, None)
+            _load_seconds.pop(name, None)
+        _collection["version"] = version
+    print("🔄 Collection changed: reloading vector store, retriever, search cache and filter catalog")
+
+def get_embeddings():
+    return _get("embeddings", lambda: HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL))
+
+def get_vectorstore():
+    _check_collection_version()
+    return _get("vectorstore", lambda: Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=get_embeddings(),
+        persist_directory=CHROMA_DB_DIR
+    ))
+
+def get_retriever():
+    _check_collection_version()
+    # Uses the quantized first-pass index (int8/binary + exact rescoring) if one was built,
+    # fused with BM25 lexical matches if that index was built
+    def build():
+        search_kwargs = {"k": RETRIEVER_K}
+        vector_retriever = make_retriever(get_vectorstore(), get_embeddings(), search_kwargs)
+        return make_hybrid_retriever(vector_retriever, get_vectorstore(), get_embeddings(), search_kwargs)
+    return _get("retriever", build)
+
+def get_search():
+    """Cached search shared by all sessions (the cache is thread-safe)"""
+    _check_collection_version()
+    return _get("search", lambda: CachedSearch(get_retriever(), get_embeddings(), RetrievalCache()))
+
+def get_analyzer():
+    """Question → metadata filter, over the catalog of ingested filings"""
+    _check_collection_version()
+    def build():
+        if os.path.exists(METADATA_CATALOG_PATH):
+            return QueryAnalyzer(load_catalog(METADATA_CATALOG_PATH))
+        # Collection ingested before the catalog existed
+        return QueryAnalyzer(build_catalog(get_vectorstore()._collection))
+    return _get("analyzer", build)
+
+def get_reranker():
+    """Cross-encoder reranker, or None unless RERANK=1"""
+    if not RERANK:
+        return None
+    # Imported here so the cross-encoder code is only loaded when reranking is on
+    from reranker import Reranker
+    return _get("reranker", Reranker)
+
+def get_answer_cache():
+    """Semantic answer cache (SQLite, shared with other processes)"""
+    return _get("answer_cache", AnswerCache)
+
+def get_llm():
+    return _get("llm", lambda: ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        temperature=LLM_TEMPERATURE,
+        google_api_key=os.getenv("GEMINI_API_KEY")
+    ))
+
+def _warm():
+    start = time.time()
+    try:
+        get_llm()
+        get_answer_cache()
+        get_analyzer()
+        get_reranker()
+        search = get_search()
+        # One real query: loads tokenizer/model weights and pages in the vector index
+        search.search(WARMUP_QUERY)
+        search.cache.clear()
+        _warmup.update(status="ready", seconds=round(time.time() - start, 3))
+    except Exception as e:
+        _warmup.update(status="failed", error=str(e), seconds=round(time.time() - start, 3))
+    finally:
+        _ready.set()
+
+def warm_up(background=True):
+    """Load every resource once; in a daemon thread unless background=False"""
+    with _lock:
+        if _warmup["status"] != "cold":
+            return
+        _warmup["status"] = "warming"
+    if background:
+        threading.Thread(target=_warm, name="resource-warmup", daemon=True).start()
+    else:
+        _warm()
+
+def wait_until_ready(timeout=None):
+    """Block until warm-up finished; True if it succeeded"""
+    warm_up()
+    _ready.wait(timeout)
+    return _warmup["status"] == "ready"
+
+def health():
+    """Readiness report: warm-up state, what is loaded, and whether the collection answers"""
+    report = {
+        "ready": _warmup["status"] == "ready",
+        "warmup": dict(_warmup),
+        "loaded": dict(_load_seconds),
+        "collection_version": _collection["version"],
+    }
+    vectorstore = _resources.get("vectorstore")
+    if vectorstore is not None:
+        try:
+            report["collection_count"] = vectorstore._collection.count()
+        except Exception as e:
+            report["ready"] = False
+            report["collection_error"] = str(e)
+    retriever = _resources.get("retriever")
+    if retriever is not None:
+        report["hybrid"] = isinstance(retriever, HybridRetriever)
+        vector_retriever = retriever.vector_retriever if report["hybrid"] else retriever
+        report["quantized_index"] = isinstance(vector_retriever, QuantizedRetriever)
+    search = _resources.get("search")
+    if search is not None:
+        report["retrieval_cache"] = search.cache.stats()
+    analyzer = _resources.get("analyzer")
+    if analyzer is not None:
+        report["catalog_filings"] = len(analyzer.filings)
+    reranker = _resources.get("reranker")
+    if reranker is not None:
+        report["reranker"] = reranker.stats()
+    answer_cache = _resources.get("answer_cache")
+    if answer_cache is not None:
+        report["answer_cache"] = answer_cache.stats()
+    return report
+
+if __name__ == "__main__":
+    warm_up(background=False)
+    report = health()
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ready"] else 1)
@@ -0,0 +1,146 @@
+"""
+Cached retrieval for the QA front-ends.
+
+Results are cached per (normalized query text, metadata filter, k) in a
+small LRU together with the query embedding, so a repeated question costs
+neither an embedding call nor a vector search. An embedding computed
+elsewhere (e.g. for an answer cache) can be passed in to skip the model.
+Turns keep only compact source records (id, metadata, snippet) for display.
+
+Ingestion stamps COLLECTION_VERSION_PATH whenever it changes the
+collection, so long-running processes can drop stale caches and indexes.
+"""
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from embedding_cache import normalize_text
+
+RETRIEVAL_CACHE_SIZE = 256  # Cached (query, filter, k) results
+SNIPPET_CHARS = 800  # Characters of each chunk kept with a turn for display
+COLLECTION_VERSION_PATH = "collection_version.txt"  # Rewritten by ingestion after every change
+
+def collection_version(path=COLLECTION_VERSION_PATH):
+    """Stamp of the last ingestion that changed the collection ("" if none recorded)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+def mark_collection_changed(path=COLLECTION_VERSION_PATH):
+    """Write a new version stamp atomically (call after the indexes and catalog are rebuilt)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, path)
+
+class RetrievalCache:
+    """Thread-safe LRU of (query, filter, k) → (query embedding, documents)"""
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query, where=None, k=5):
+        # all-MiniLM-L6-v2 is uncased and ignores extra whitespace, so these map to one vector
+        return normalize_text(query).lower(), json.dumps(where, sort_keys=True), k
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, embedding, docs):
+        with self.lock:
+            self.entries[key] = (embedding, docs)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                "hit_rate": self.hits / total if total else 0.0}
+
+def search_by_vector(retriever, vector, k, where=None):
+    """Top-k documents for an embedded query, with metadata "score".
+
+    `retriever` is what make_retriever returned: a QuantizedRetriever or a
+    Chroma VectorStoreRetriever.
+    """
+    if hasattr(retriever, "search_by_vector"):
+        return retriever.search_by_vector(vector, k, where)
+    results = retriever.vectorstore.similarity_search_by_vector_with_relevance_scores(
+        vector, k=k, filter=where)
+    docs = []
+    for doc, score in results:
+        doc.metadata = {**doc.metadata, "score": score}
+        docs.append(doc)
+    return docs
+
+class CachedSearch:
+    """Vector search through a RetrievalCache.
+
+    `retriever` is a HybridRetriever (BM25 + vector, see bm25_index.py)
+    or what make_retriever returned (see search_by_vector).
+    """
+
+    def __init__(self, retriever, embeddings, cache=None):
+        self.retriever = retriever
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else RetrievalCache()
+        self.default_k = retriever.search_kwargs.get("k", 5)
+
+    def _search(self, query, vector, k, where):
+        if hasattr(self.retriever, "hybrid_search"):
+            return self.retriever.hybrid_search(query, vector, k, where)
+        return search_by_vector(self.retriever, vector, k, where)
+
+    def embed(self, query):
+        return self.embeddings.embed_query(query)
+
+    def search_with_embedding(self, query, where=None, k=None, embedding=None):
+        """(query embedding, documents); cached, and embedded only if no embedding is given"""
+        k = k or self.default_k
+        key = self.cache.key(query, where, k)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry[0], list(entry[1])
+        embedding = embedding if embedding is not None else self.embed(query)
+        docs = self._search(query, embedding, k, where)
+        self.cache.put(key, embedding, docs)
+        return embedding, list(docs)
+
+    def search(self, query, where=None, k=None, embedding=None):
+        """Documents for query (see search_with_embedding)"""
+        return self.search_with_embedding(query, where, k, embedding)[1]
+
+def chunk_ids(docs):
+    """Ids of the retrieved chunks (the answer cache's evidence); a content hash if a store returns none"""
+    return [getattr(doc, "id", None) or hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=8).hexdigest()
+            for doc in docs]
+
+def source_records(docs, snippet_chars=SNIPPET_CHARS):
+    """What a chat turn keeps about its evidence: id, metadata and a snippet"""
+    return [{
+        "id": getattr(doc, "id", None),
+        "metadata": dict(doc.metadata),
+        "snippet": doc.page_content[:snippet_chars],
+        "truncated": len(doc.page_content) > snippet_chars,
+    } for doc in docs]
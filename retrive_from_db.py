@@ -16,12 +16,18 @@ vectorstore = Chroma(
     persist_directory=CHROMA_DB_DIR
 )
 
-# Basic retriever
-retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-
 # Sample test query
 query = input("Enter your test query: ")
 
+# Optional section pre-filter, e.g. "Item 1A" (Risk Factors) or "Item 7" (MD&A)
+section = input("Filter by section (blank for all): ").strip()
+
+# Basic retriever
+search_kwargs = {"k": 5}
+if section:
+    search_kwargs["filter"] = {"section": section}
+retriever = vectorstore.as_retriever(search_kwargs=search_kwargs)
+
 # Run retrieval
 results = retriever.get_relevant_documents(query)
 
@@ -34,6 +40,7 @@ for i, doc in enumerate(results, 1):
     print(f"   - Ticker       : {meta.get('ticker')}")
     print(f"   - Filing Type  : {meta.get('filing_type')}")
     print(f"   - Section      : {meta.get('section')}")
+    print(f"   - Heading Path : {meta.get('heading_path')}")
     print(f"   - Filing Date  : {meta.get('filing_date')}")
     print(f"   - Source Doc   : {meta.get('source_doc')}")
     print(f"   - Chunk Index  : {meta.get('chunk_index')}")
@@ -0,0 +1,164 @@
+"""
+Single-pass cleaner for crawled filings: HTML/SGML → text → section headers.
+
+Replaces extract_clean_text_from_html + clean_markdown_for_chunking, which
+build a full BeautifulSoup tree, walk it three times (script/style,
+display:none, ix*/xbrl* tags) and then run five regex passes over the text.
+
+Here the markup is fed in blocks to an lxml target parser: no tree is
+built, skipped elements are dropped as their start tag arrives, and text is
+collected as it streams by. The header rules are one precompiled
+alternation applied in a single re.sub. The output matches the legacy
+functions (see tests/test_streaming_cleaner.py).
+"""
+import re
+from lxml import etree
+
+FEED_SIZE = 1 << 16  # Characters handed to the parser at a time
+SKIP_TAGS = ("script", "style")
+SKIP_PREFIXES = ("xbrl", "ix")  # Inline XBRL wrappers, dropped with their content
+HIDDEN_STYLE = "display:none"
+
+class _TextCollector:
+    """lxml parser target: keeps the text of <body> outside skipped elements.
+
+    Mirrors BeautifulSoup semantics: adjacent data events form one string,
+    comments and processing instructions split strings, each string is
+    stripped and empty ones are dropped. If the document has no <body>,
+    the text of the whole document is used.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.depth = 0
+        self.body_depth = None
+        self.body_done = False
+        # Depth of the outermost skipped element (None = not skipping), per scope
+        self.skip_all = None
+        self.skip_body = None
+        self.all_texts = []
+        self.body_texts = []
+
+    def _flush_text(self):
+        if not self.pending:
+            return
+        text = "".join(self.pending).strip()
+        self.pending = []
+        if not text:
+            return
+        if self.body_depth is not None and not self.body_done:
+            if self.skip_body is None:
+                self.body_texts.append(text)
+        elif self.body_depth is None and self.skip_all is None:
+            self.all_texts.append(text)
+
+    @staticmethod
+    def _skipped(tag, attrib):
+        if tag in SKIP_TAGS or tag.startswith(SKIP_PREFIXES):
+            return True
+        style = attrib.get("style")
+        return bool(style) and HIDDEN_STYLE in style
+
+    def start(self, tag, attrib):
+        self._flush_text()
+        self.depth += 1
+        if tag == "body" and self.body_depth is None:
+            self.body_depth = self.depth
+            # Text outside <body> is only needed for body-less documents
+            self.all_texts = []
+            return
+        if self._skipped(tag, attrib):
+            if self.skip_all is None:
+                self.skip_all = self.depth
+            if self.body_depth is not None and not self.body_done and self.skip_body is None:
+                self.skip_body = self.depth
+
+    def end(self, tag):
+        self._flush_text()
+        if self.skip_all == self.depth:
+            self.skip_all = None
+        if self.skip_body == self.depth:
+            self.skip_body = None
+        if self.body_depth == self.depth:
+            self.body_done = True
+        self.depth -= 1
+
+    def data(self, text):
+        self.pending.append(text)
+
+    def comment(self, text):
+        self._flush_text()
+
+    def pi(self, target, data=None):
+        self._flush_text()
+
+    def doctype(self, *args):
+        self._flush_text()
+
+    def close(self):
+        self._flush_text()
+        return self.body_texts if self.body_depth is not None else self.all_texts
+
+def iter_pieces(text, size=FEED_SIZE):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+def extract_text(pieces):
+    """Visible body text of an HTML/SGML document given as an iterable of str pieces"""
+    if isinstance(pieces, str):
+        pieces = iter_pieces(pieces)
+    parser = etree.HTMLParser(target=_TextCollector(), recover=True)
+    fed = False
+    for piece in pieces:
+        if piece:
+            parser.feed(piece)
+            fed = True
+    if not fed:
+        return ""
+    return "\n".join(parser.close())
+
+# The legacy passes, in order: Table of Contents, PART, Item, underlined
+# ALL-CAPS headers, blank-line runs. As one alternation, a match can start
+# before (and swallow) text an earlier pass would already have rewritten;
+# the guards and fix-ups below reproduce the sequential result.
+_PART = r"PART\s+(?P<{name}>[IVXLC]+)"
+HEADER_RE = re.compile(
+    r"(?m)"
+    r"(?P<toc>^Table of Contents)"
+    r"|^" + _PART.format(name="roman") +
+    r"|(?P<item>^(?:Item|ITEM)\s+(?P<num>\d+(?:\.\d+)?[A-Z]?)[.:]?(?P<gap>\s+)"
+    # An Item whose title is on a following line absorbs that line after the
+    # PART / Table of Contents passes have rewritten it
+    r"(?P<title>^" + _PART.format(name="title_roman") + r".*|.*))"
+    # Caps headers may span lines, but never across a PART line (already a "##" header by then)
+    r"|(?P<caps>^(?P<caps_text>[A-Z](?:(?!^PART\s+[IVXLC])[A-Z\s])+)\n[-=]{3,}(?P<caps_after>\n*))"
+    r"|(?P<newlines>\n{3,})"
+)
+NEWLINES_RE = re.compile(r"\n{3,}")
+TITLE_PART_RE = re.compile(r"^PART\s+([IVXLC]+)")
+
+def _rewrite_header(m):
+    if m.group("toc"):
+        return "## Table of Contents"
+    if m.group("roman"):
+        return f"## PART {m.group('roman')} —"
+    if m.group("item"):
+        title = m.group("title")
+        if m.group("gap").endswith("\n"):
+            if m.group("title_roman"):
+                title = TITLE_PART_RE.sub(r"## PART \1 —", title, count=1)
+            elif title.startswith("Table of Contents"):
+                title = "## " + title
+        return f"### Item {m.group('num')}: {title}"
+    if m.group("caps"):
+        # The blank-line pass ran after this one, over the header and what follows it
+        return NEWLINES_RE.sub("\n\n", f"#### {m.group('caps_text')}{m.group('caps_after')}")
+    return "\n\n"
+
+def normalize_headers(text):
+    """Markdown section headers + collapsed blank lines, in one regex pass"""
+    return HEADER_RE.sub(_rewrite_header, text)
+
+def clean_filing(pieces):
+    """Drop-in for clean_markdown_for_chunking(extract_clean_text_from_html(html))"""
+    return normalize_headers(extract_text(pieces))
@@ -0,0 +1,219 @@
+"""
+Streaming frontmatter reader and generator-based text splitter.
+
+Large full-submission filings are read in fixed-size blocks and split in
+windows, so memory per file is bounded by WINDOW_SIZE instead of file size.
+Chunks follow the same RecursiveCharacterTextSplitter size/overlap rules.
+"""
+import re
+import yaml
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+BLOCK_SIZE = 1 << 16  # Characters read from disk at a time
+WINDOW_SIZE = 1 << 16  # Characters split at a time (must be well above chunk_size)
+
+def read_frontmatter(f):
+    """Parse YAML frontmatter from an open text file.
+
+    Returns (metadata, first_body_text). The file is left positioned just
+    after the closing '---' line, so the body can be streamed from it.
+    """
+    first = f.readline()
+    if not first.startswith("---"):
+        return {}, first
+
+    # Text after the opening marker on the same line is part of the YAML block
+    lines = [first[3:]]
+    for line in f:
+        if line.strip() == "---":
+            break
+        lines.append(line)
+    metadata = yaml.safe_load("".join(lines)) or {}
+    return metadata, ""
+
+def iter_blocks(f, first="", block_size=BLOCK_SIZE):
+    """Yield the rest of an open text file in blocks, starting with `first`"""
+    if first:
+        yield first
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        yield block
+
+class StreamingTextSplitter:
+    """Incremental wrapper around RecursiveCharacterTextSplitter.
+
+    Text is fed in arbitrary pieces; whenever the buffer reaches the window
+    size it is cut at the strongest separator, split, and every chunk except
+    the last is yielded. The last chunk is pushed back in front of the buffer
+    so it is re-split together with the following text — no short chunks
+    appear at window seams and the overlap between neighbours is preserved.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=None, window_size=WINDOW_SIZE):
+        if window_size < 4 * chunk_size:
+            raise ValueError("window_size must be at least 4x chunk_size")
+        self.separators = separators or ["\n\n", "\n", ".", " "]
+        self.chunk_size = chunk_size
+        self.window_size = window_size
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=self.separators
+        )
+        self.buffer = ""
+
+    def _find_cut(self):
+        """Cut position inside the window, just before the strongest separator"""
+        for sep in self.separators:
+            idx = self.buffer.rfind(sep, self.chunk_size, self.window_size)
+            if idx > 0:
+                return idx
+        return self.window_size
+
+    def feed(self, text):
+        """Add text and yield every chunk that can no longer change"""
+        self.buffer += text
+        while len(self.buffer) >= self.window_size:
+            cut = self._find_cut()
+            head, rest = self.buffer[:cut], self.buffer[cut:]
+            chunks = self.splitter.split_text(head)
+            if len(chunks) > 1:
+                yield from chunks[:-1]
+                self.buffer = chunks[-1] + rest
+            else:
+                yield from chunks
+                self.buffer = rest
+
+    def flush(self):
+        """Yield the chunks of whatever is still buffered"""
+        buffer, self.buffer = self.buffer, ""
+        if buffer.strip():
+            yield from self.splitter.split_text(buffer)
+
+    def split_stream(self, pieces):
+        """Split an iterable of text pieces into a stream of chunks"""
+        for piece in pieces:
+            yield from self.feed(piece)
+        yield from self.flush()
+
+# Section headers as written by clean_markdown_for_chunking ("## PART I —",
+# "### Item 1A: Risk Factors") or left raw ("PART II", "ITEM 7. MD&A")
+PART_RE = re.compile(r"^(?:#+\s*)?PART\s+([IVXLC]+)\b[\s—–.:-]*(.*)$")
+ITEM_RE = re.compile(r"^(?:#+\s*)?(?:Item|ITEM)\s+(\d+(?:\.\d+)?[A-Z]?)\b[\s—–.:-]*(.*)$")
+TOC_RE = re.compile(r"^(?:#+\s*)?Table of Contents\b", re.IGNORECASE)
+MAX_HEADER_LENGTH = 150  # Longer lines are prose that merely starts with "Item 7 ..."
+
+def iter_lines(blocks, max_length=WINDOW_SIZE):
+    """Re-cut text blocks into lines (keeping the newline).
+
+    A single line longer than max_length is emitted in pieces so memory
+    stays bounded even for files without newlines.
+    """
+    rest = ""
+    for block in blocks:
+        rest += block
+        start = 0
+        while True:
+            end = rest.find("\n", start)
+            if end < 0:
+                break
+            yield rest[start:end + 1]
+            start = end + 1
+        rest = rest[start:]
+        while len(rest) > max_length:
+            yield rest[:max_length]
+            rest = rest[max_length:]
+    if rest:
+        yield rest
+
+def parse_header(line):
+    """Classify a line as ("part", key, title), ("item", key, title), ("toc", ...) or None"""
+    text = line.strip()
+    if not text or len(text) > MAX_HEADER_LENGTH:
+        return None
+    match = ITEM_RE.match(text)
+    if match:
+        return "item", f"Item {match.group(1)}", match.group(2).strip(" #")
+    match = PART_RE.match(text)
+    if match:
+        return "part", f"PART {match.group(1)}", match.group(2).strip(" #")
+    if TOC_RE.match(text):
+        return "toc", "Table of Contents", ""
+    return None
+
+class SectionAwareSplitter:
+    """Split a filing body along its PART / Item structure.
+
+    Every chunk is tagged with the section it belongs to and chunks never
+    span two Items: the streaming splitter is flushed at each header. Header
+    lines inside the (first) table of contents are kept in a single "Table of
+    Contents" section until a header repeats, which marks the start of the
+    actual body, instead of producing one tiny section per entry.
+
+    Header lines are not split as text: they are put in front of the first
+    chunk of their section, so a long opening paragraph never leaves them
+    as a bare chunk. Headers with no body before the next one ("PART I"
+    then "Item 1") go in front together; the repeated "Table of Contents"
+    back-links are dropped.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=None,
+                 window_size=WINDOW_SIZE, default_section="Unknown"):
+        self.splitter = StreamingTextSplitter(chunk_size, chunk_overlap, separators, window_size)
+        self.default_section = default_section
+
+    def split_stream(self, blocks):
+        """Yield (chunk, section_metadata) for an iterable of text blocks"""
+        part = ""
+        section = {"section": self.default_section, "section_title": "", "part": "", "heading_path": ""}
+        toc_seen = in_toc = has_body = False
+        toc_items = set()
+        heading = []  # Header lines waiting for the first chunk of their section
+
+        def attach(chunks):
+            for chunk in chunks:
+                if heading:
+                    chunk = "".join(heading).strip() + "\n\n" + chunk
+                    heading.clear()
+                yield chunk, section
+
+        for line in iter_lines(blocks):
+            header = parse_header(line)
+            if header is not None:
+                kind, key, title = header
+                if kind == "toc":
+                    if toc_seen:
+                        # "Table of Contents" back-link repeated on every page
+                        continue
+                    toc_seen = in_toc = True
+                    new_section = {"section": key, "section_title": "", "part": part, "heading_path": key}
+                elif in_toc and key not in toc_items:
+                    # Still listing the table of contents
+                    toc_items.add(key)
+                    new_section = None
+                else:
+                    in_toc = False
+                    if kind == "part":
+                        part = key
+                        path = f"{key} — {title}" if title else key
+                    else:
+                        path = f"{part} > {key}" if part else key
+                        path += f": {title}" if title else ""
+                    new_section = {"section": key, "section_title": title, "part": part, "heading_path": path}
+
+                if new_section is not None:
+                    if has_body:
+                        yield from attach(self.splitter.flush())
+                    section = new_section
+                    heading.append(line)
+                    has_body = False
+                    continue
+
+            if line.strip():
+                has_body = True
+            yield from attach(self.splitter.feed(line))
+
+        # Trailing headers without a body are dropped
+        yield from attach(self.splitter.flush())
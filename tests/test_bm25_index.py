@@ -0,0 +1,100 @@
+"""
+Offline test for bm25_index.py: tokenizer, BM25 ranking, metadata filters and RRF fusion.
+Run from the repo root: python tests/test_bm25_index.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bm25_index import BM25Index, tokenize, reciprocal_rank_fusion
+
+CHUNKS = {
+    "tsla_rf": "Tesla (TSLA) risk factors: supply chain disruptions for battery cells.",
+    "aapl_rev": "Apple net sales were $383,285 million in fiscal 2023.",
+    "item7a": "Item 7A. Quantitative and Qualitative Disclosures About Market Risk",
+    "generic": "The Company is subject to risks. The risks are described in this report.",
+}
+
+METADATA = {
+    "tsla_rf": {"ticker": "TSLA", "filing_type": "10-K", "filing_date": "2024-01-29"},
+    "aapl_rev": {"ticker": "AAPL", "filing_type": "10-K", "filing_date": "2023-11-03"},
+    "item7a": {"ticker": "AAPL", "filing_type": "10-Q", "filing_date": "2023-08-04"},
+    "generic": {"ticker": "TSLA", "filing_type": "8-K", "filing_date": "2023-07-19"},
+}
+
+def build(tmp):
+    return BM25Index.build([(list(CHUNKS), list(CHUNKS.values()), [METADATA[i] for i in CHUNKS])], index_dir=tmp)
+
+def test_tokenize_keeps_exact_filing_tokens():
+    assert tokenize("Item 1A. Risk Factors") == ["item", "1a", "risk", "factors"]
+    assert "383285" in tokenize("$383,285 million")
+    assert "at&t" in tokenize("AT&T Inc.")
+
+def test_exact_tokens_rank_first():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build(tmp)
+        assert index.search("TSLA supply chain")[0][0] == "tsla_rf"
+        assert index.search("383,285")[0] == ["aapl_rev"]
+        assert index.search("item 7a")[0][0] == "item7a"
+        assert index.search("unknownterm") == ([], [])
+
+def test_rows_restrict_and_reload():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build(tmp)
+        ids, _ = index.search("risk risks", rows=[index.row_of["generic"], index.row_of["aapl_rev"]])
+        assert ids == ["generic"]
+        reloaded = BM25Index.load(tmp)
+        assert reloaded.search("risk factors") == index.search("risk factors")
+
+def test_metadata_filters_are_evaluated_on_the_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        build(tmp)
+        index = BM25Index.load(tmp)
+        where = {"$and": [{"ticker": {"$in": ["TSLA"]}}, {"filing_type": {"$in": ["10-K", "8-K"]}}]}
+        assert sorted(index.search("risk risks supply", mask=index.row_mask(where))[0]) == ["generic", "tsla_rf"]
+        assert index.search("risks", mask=index.row_mask({"filing_date": "2023-07-19"}))[0] == ["generic"]
+        assert index.row_mask({"ticker": {"$nin": ["TSLA"]}}).sum() == 2
+        assert index.row_mask({"ticker": {"$in": ["MSFT"]}}).sum() == 0
+        # Fields and operators the index doesn't cover are left to Chroma
+        assert index.row_mask({"section": "Item 1A"}) is None
+        assert index.row_mask({"filing_date": {"$gte": "2023-01-01"}}) is None
+
+def test_rebuild_with_fewer_documents_replaces_every_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        build(tmp)
+        index = BM25Index.build([(["item7a"], [CHUNKS["item7a"]], [METADATA["item7a"]])], index_dir=tmp)
+        assert index.ids == ["item7a"]
+        reloaded = BM25Index.load(tmp)
+        assert reloaded.ids == ["item7a"] and len(reloaded.doc_lens) == 1
+        assert reloaded.search("item 7a risk")[0] == ["item7a"]
+        assert reloaded.search("tesla") == ([], [])
+        assert not [name for name in os.listdir(tmp) if "tmp" in name]
+
+def test_files_from_different_builds_are_rejected():
+    with tempfile.TemporaryDirectory() as old, tempfile.TemporaryDirectory() as new:
+        build(old)
+        BM25Index.build([(["item7a"], [CHUNKS["item7a"]], [METADATA["item7a"]])], index_dir=new)
+        # Crash or concurrent read mid-rebuild: new postings next to old ids
+        os.replace(os.path.join(new, "postings.npz"), os.path.join(old, "postings.npz"))
+        try:
+            BM25Index.load(old)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("mixed builds loaded")
+
+def test_rrf_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])
+    assert max(fused, key=fused.get) == "b"
+    assert fused["a"] > fused["d"]
+
+if __name__ == "__main__":
+    test_tokenize_keeps_exact_filing_tokens()
+    test_exact_tokens_rank_first()
+    test_rows_restrict_and_reload()
+    test_metadata_filters_are_evaluated_on_the_index()
+    test_rebuild_with_fewer_documents_replaces_every_file()
+    test_files_from_different_builds_are_rejected()
+    test_rrf_rewards_agreement()
+    print("✅ BM25 index tests passed")
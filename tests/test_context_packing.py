@@ -0,0 +1,64 @@
+"""
+Offline test for context_packing.py: adjacent-chunk merging, overlap stripping,
+near-duplicate removal and budgeted packing.
+Run from the repo root: python tests/test_context_packing.py
+"""
+import os
+import sys
+import random
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_packing import pack_context, strip_overlap
+from conversation_memory import count_tokens
+
+rng = random.Random(7)
+TEXT = " ".join(rng.choice(["revenue", "risk", "supply", "chain", "battery", "cells", "demand", "margin"])
+                for _ in range(900))
+
+def window(start, end):
+    """Chunk on word boundaries, like the splitter: overlapping windows of TEXT"""
+    start = TEXT.rfind(" ", 0, start) + 1 if start else 0
+    end = TEXT.find(" ", end)
+    return TEXT[start:end if end != -1 else len(TEXT)]
+
+def chunk(chunk_id, text, index, source="tsla_10k.md"):
+    metadata = {"ticker": "TSLA", "filing_type": "10-K", "section": "Item 1A", "filing_date": "2024-01-29",
+                "source_doc": source, "chunk_index": index}
+    return SimpleNamespace(id=chunk_id, page_content=text, metadata=metadata)
+
+def test_strip_overlap():
+    assert strip_overlap("alpha beta gamma delta epsilon zeta", "delta epsilon zeta eta theta", 5) == "eta theta"
+    assert strip_overlap("alpha beta gamma", "unrelated text here", 5) == "unrelated text here"
+
+def test_adjacent_chunks_merge_and_duplicates_drop():
+    c0, c1, c2 = window(0, 1000), window(800, 1800), window(1600, 2600)
+    docs = [
+        chunk("c1", c1, 1),
+        chunk("other", "Apple services revenue grew on App Store and iCloud subscriptions.", 4, "aapl_10k.md"),
+        chunk("c0", c0, 0),
+        chunk("c2", c2, 2),
+        chunk("boilerplate", c1, 9, "tsla_10k_2023.md"),
+    ]
+    used, context, stats = pack_context(docs, 5000)
+    assert [d.id for d in used] == ["c0", "c1", "c2", "other"]
+    assert stats["passages"] == 2
+    first, second = context.split("\n\n")
+    assert first.startswith("[1] [TSLA, 10-K, Item 1A, 2024-01-29] (tsla_10k.md #0-2)\n")
+    # Overlap kept once: the merged passage is exactly the underlying text
+    assert first.split("\n", 1)[1].replace("\n", " ") == window(0, 2600)
+    assert second.startswith("[2] [TSLA, 10-K, Item 1A, 2024-01-29] (aapl_10k.md #4)")
+    assert stats["context_tokens"] < stats["raw_tokens"]
+
+def test_budget_keeps_best_ranked_passages():
+    docs = [chunk(f"c{i}", " ".join(f"term{i}x{j}" for j in range(100)), i * 10) for i in range(4)]
+    used, context, stats = pack_context(docs, 500)
+    assert count_tokens(context) <= 500
+    assert [d.id for d in used] == ["c0", "c1"]
+    assert context.count("\n[") == 1 and "[2] " in context
+
+if __name__ == "__main__":
+    test_strip_overlap()
+    test_adjacent_chunks_merge_and_duplicates_drop()
+    test_budget_keeps_best_ranked_passages()
+    print("✅ context packing tests passed")
@@ -0,0 +1,82 @@
+"""
+Offline test for conversation_memory.py: history budget, summarization and context fitting.
+Run from the repo root: python tests/test_conversation_memory.py
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversation_memory import ConversationMemory, fit_docs, fit_prompt, count_tokens, MIN_CONTEXT_TOKENS
+
+def test_history_stays_within_budget_and_summarizes_in_batches():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append([turn["question"] for turn in turns])
+        return f"{summary} " + " ".join(turn["question"] for turn in turns)
+
+    memory = ConversationMemory(history_budget=300, summary_budget=50, recent_turns=3)
+    for i in range(12):
+        memory.add_turn(f"q{i}", "a" * 200, summarize)
+        assert memory.tokens() <= 300
+    # Verbatim until the budget is hit, then everything but the recent turns in one call
+    assert calls[0] == ["q0", "q1", "q2"]
+    assert len(calls) < 12
+    assert [turn["question"] for turn in memory.turns] == ["q9", "q10", "q11"]
+    assert "q0" in memory.summary
+
+def test_oversized_answer_is_truncated_and_failed_summary_keeps_questions():
+    def failing(summary, turns):
+        raise RuntimeError("quota")
+
+    memory = ConversationMemory(history_budget=200, summary_budget=40)
+    memory.add_turn("first", "short", failing)
+    memory.add_turn("huge", "x" * 5000, failing)
+    assert memory.tokens() <= 200
+    assert "first" in memory.summary
+    assert memory.turns[-1]["answer"].endswith("...")
+
+def test_deferred_turns_are_folded_by_the_next_compact():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(len(turns))
+        return "summary"
+
+    memory = ConversationMemory(history_budget=100, summary_budget=20, recent_turns=1)
+    for i in range(4):
+        memory.add_turn(f"q{i}", "a" * 200, summarize, defer=True)
+    assert calls == [] and len(memory.turns) == 4
+    memory.compact(summarize)
+    assert calls == [3] and [turn["question"] for turn in memory.turns] == ["q3"]
+    assert memory.tokens() <= 100
+
+def test_context_keeps_ranked_chunks_that_fit():
+    docs = [SimpleNamespace(text="a" * 400), SimpleNamespace(text="b" * 4000), SimpleNamespace(text="c" * 200)]
+    kept, texts = fit_docs(docs, lambda d: d.text, 200)
+    assert [t[0] for t in texts] == ["a", "c"]
+    assert sum(count_tokens(t) for t in texts) <= 200
+    # The top chunk is kept even if it alone is too long
+    kept, texts = fit_docs(docs[1:2], lambda d: d.text, 100)
+    assert len(kept) == 1 and count_tokens(texts[0]) <= 101
+
+def test_long_question_and_history_are_cut_to_fit_the_prompt():
+    template = "t" * 400
+    question, history, context = fit_prompt(template, "short question", "h" * 800, budget=1000)
+    assert (question, history) == ("short question", "h" * 800) and context == 1000 - 100 - 4 - 200
+    # History goes first (its oldest part), then the end of the question
+    question, history, context = fit_prompt(template, "q" * 1200 + "end", "old " + "h" * 3000, budget=1000)
+    assert history.startswith("...") and history.endswith("h") and "old" not in history
+    question, history, context = fit_prompt(template, "q" * 5000, "h" * 800, budget=1000)
+    assert history == "" and question.endswith("...")
+    assert context == MIN_CONTEXT_TOKENS
+    assert count_tokens(template) + count_tokens(question) + count_tokens(history) + context <= 1000
+
+if __name__ == "__main__":
+    test_history_stays_within_budget_and_summarizes_in_batches()
+    test_oversized_answer_is_truncated_and_failed_summary_keeps_questions()
+    test_deferred_turns_are_folded_by_the_next_compact()
+    test_context_keeps_ranked_chunks_that_fit()
+    test_long_question_and_history_are_cut_to_fit_the_prompt()
+    print("✅ conversation memory tests passed")
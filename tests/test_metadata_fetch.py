@@ -0,0 +1,76 @@
+"""
+Offline test for get_metadata_from_api.py using StubQueryApi.
+Run from the repo root: python tests/test_metadata_fetch.py
+"""
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import get_metadata_from_api as gm
+from metadata_store import FilingStore
+
+def make_fixture(path):
+    filings = []
+    for ticker in ["AAPL", "TSLA"]:
+        for form in ["10-K", "DEF 14A"]:
+            for i in range(120):
+                filings.append({
+                    "accessionNo": f"{ticker}-{form}-{i:04d}",
+                    "ticker": ticker,
+                    "formType": form,
+                    "filedAt": f"20{10 + i // 12:02d}-{i % 12 + 1:02d}-01T00:00:00-04:00",
+                })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(filings, f)
+    return filings
+
+def test_paginates_and_merges_incrementally():
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = os.path.join(tmp, "filings.json")
+        filings = make_fixture(fixture)
+        api = gm.StubQueryApi(fixture)
+
+        # Full fetch: 100 per pair needs two pages of 50
+        fetched = gm.fetch_all(api, tickers=["AAPL", "TSLA"], filing_types=["10-K", "DEF 14A"],
+                               max_filings=100, rate=1000)
+        assert len(fetched) == 400
+        assert api.calls == 8
+        store = FilingStore(os.path.join(tmp, "metadata.db"))
+        store.upsert_records(fetched)
+        assert len(store) == 400
+
+        # Two newer AAPL 10-Ks appear; incremental mode only fetches those
+        newer = [dict(filings[0], accessionNo=f"AAPL-new-{i}", filedAt=f"2030-0{i + 1}-01T00:00:00-04:00")
+                 for i in range(2)]
+        with open(fixture, "w", encoding="utf-8") as f:
+            json.dump(filings + newer, f)
+        api = gm.StubQueryApi(fixture)
+        fetched = gm.fetch_all(api, tickers=["AAPL", "TSLA"], filing_types=["10-K", "DEF 14A"],
+                               since=store.latest_filed_at(), max_filings=100, rate=1000)
+        assert sorted(f["accessionNo"] for f in fetched) == ["AAPL-new-0", "AAPL-new-1"]
+
+        # Re-upserting an existing filing does not duplicate it
+        store.upsert_records(fetched + fetched[:1])
+        assert len(store) == 402
+        store.conn.close()
+        print("✅ pagination + incremental fetch OK")
+
+def test_primary_document_url_is_stored_and_old_stores_gain_the_column():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metadata.db")
+        old = sqlite3.connect(path)
+        old.execute('CREATE TABLE filings ("accessionNo" TEXT PRIMARY KEY, "ticker" TEXT, "formType" TEXT)')
+        old.close()
+        store = FilingStore(path)
+        store.upsert_records([{"accessionNo": "a1", "ticker": "AAPL", "formType": "10-K", "documentFormatFiles": [
+            {"type": "EX-21", "documentUrl": "https://sec.gov/ex21.htm"},
+            {"type": "10-K", "documentUrl": "https://sec.gov/aapl-10k.htm"}]}])
+        assert store.load(["documentUrl"])["documentUrl"].tolist() == ["https://sec.gov/aapl-10k.htm"]
+        store.conn.close()
+
+if __name__ == "__main__":
+    test_paginates_and_merges_incrementally()
+    test_primary_document_url_is_stored_and_old_stores_gain_the_column()
@@ -0,0 +1,74 @@
+"""
+Offline test for near_dedup.py: same-filing collapse, cross-filing vector sharing and forgetting files.
+Run from the repo root: python tests/test_near_dedup.py
+"""
+import os
+import sys
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from near_dedup import DedupIndex, minhash
+
+WORDS = "revenue risk supply chain battery cells demand margin litigation credit tariff".split()
+
+def text(seed):
+    local = random.Random(seed)
+    return " ".join(local.choice(WORDS) for _ in range(200))
+
+BOILERPLATE = text(1)
+
+class Collection:
+    """Just enough of a Chroma collection for fill_shared / refresh_metadata"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def get(self, ids, include):
+        found = [chunk_id for chunk_id in ids if chunk_id in self.rows]
+        key = include[0]
+        return {"ids": found, key: [self.rows[chunk_id][key] for chunk_id in found]}
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.rows[chunk_id]["metadatas"] = metadata
+
+def batch(*chunks):
+    """(signatures, metadatas, ids) of (chunk id, source_doc, text) triples"""
+    return ([minhash(body) for _, _, body in chunks], [{"source_doc": doc} for _, doc, _ in chunks],
+            [chunk_id for chunk_id, _, _ in chunks])
+
+def test_copies_collapse_within_a_filing_and_share_vectors_across_filings():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = DedupIndex(os.path.join(tmp, "dedup.db"))
+        keep, shared, canonical_ids = index.filter_batch(*batch(
+            ("a0", "q1.md", BOILERPLATE), ("a1", "q1.md", text(2)), ("a2", "q1.md", BOILERPLATE),
+            ("b0", "q2.md", BOILERPLATE), ("b1", "q2.md", BOILERPLATE)))
+        assert keep == [0, 1]
+        # The q2 copy is stored with a0's vector; q2's second copy collapses into it
+        assert shared == {3: "a0"}
+        assert canonical_ids == {"a0", "b0"}
+        dup = index.dup_metadata(["a0", "b0"])
+        assert dup["a0"] == {"dup_count": 2, "dup_sources": "q1.md,q2.md"}
+        assert dup["b0"] == {"dup_count": 1, "dup_sources": "q2.md"}
+
+        collection = Collection()
+        collection.rows["a0"] = {"embeddings": [0.5, 0.5], "metadatas": {}}
+        embeddings = DedupIndex.fill_shared(collection, ["c0", "b0"], [[1.0, 0.0], None], {"b0": "a0"})
+        assert embeddings == [[1.0, 0.0], [0.5, 0.5]]
+
+def test_forgetting_the_root_filing_keeps_the_shared_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = DedupIndex(os.path.join(tmp, "dedup.db"))
+        index.filter_batch(*batch(("a0", "q1.md", BOILERPLATE), ("b0", "q2.md", BOILERPLATE)))
+        assert index.forget_docs(["q1.md"]) == set()
+        # b0 now holds the only vector: a later copy shares it
+        _, shared, _ = index.filter_batch(*batch(("c0", "q3.md", BOILERPLATE)))
+        assert shared == {0: "b0"}
+        assert index.forget_docs(["q3.md"]) == {"b0"}
+        assert index.dup_metadata(["b0"])["b0"]["dup_count"] == 0
+
+if __name__ == "__main__":
+    test_copies_collapse_within_a_filing_and_share_vectors_across_filings()
+    test_forgetting_the_root_filing_keeps_the_shared_rows()
+    print("✅ near-dedup tests passed")
@@ -0,0 +1,172 @@
+"""
+Offline test for qa_service.py: cross-request embedding micro-batching, alone and behind /query,
+startup checks and the retrieval queue gauge.
+Run from the repo root: python tests/test_qa_service.py
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import resources
+import qa_service
+from qa_service import EmbeddingBatcher
+from query_analyzer import QueryAnalyzer
+
+class Embeddings:
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(0.05)
+        return [[float(len(text))] for text in texts]
+
+def test_concurrent_queries_share_one_embedding_call():
+    embeddings = Embeddings()
+
+    async def run():
+        batcher = EmbeddingBatcher(embeddings, ThreadPoolExecutor(max_workers=1), max_batch=8, max_wait_ms=20)
+        batcher.start()
+        vectors = await asyncio.gather(*[batcher.embed("q" * i) for i in range(1, 11)])
+        await batcher.stop()
+        return vectors, batcher.stats()
+
+    vectors, stats = asyncio.run(run())
+    # Each caller gets its own vector back, in order
+    assert vectors == [[float(i)] for i in range(1, 11)]
+    assert [len(batch) for batch in embeddings.batches] == [8, 2]
+    assert stats["batches"] == 2 and stats["largest_batch"] == 8
+
+class Search:
+    """Stand-in for retrieval.CachedSearch: the service must hand it the query embedding"""
+    default_k = 3
+
+    def __init__(self):
+        self.cache = SimpleNamespace(stats=lambda: {})
+
+    def embed(self, query):
+        raise AssertionError("query embedded inside the retrieval pool")
+
+    def search_with_embedding(self, query, where=None, k=None, embedding=None):
+        assert embedding is not None
+        time.sleep(0.02)
+        return embedding, [SimpleNamespace(id=f"{query}-{i}", page_content=f"chunk {i} of {query}",
+                                           metadata={"ticker": "TSLA", "source_doc": query, "chunk_index": i})
+                           for i in range(k or self.default_k)]
+
+class LLM:
+    async def ainvoke(self, text):
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(content="answer")
+
+class AnswerCache:
+    def get(self, *args):
+        return None
+
+    def put(self, *args):
+        pass
+
+def test_concurrent_queries_are_batched_beyond_the_retrieval_pool():
+    embeddings = Embeddings()
+    stubs = {"warm_up": lambda background=True: None, "get_embeddings": lambda: embeddings,
+             "get_search": Search, "get_reranker": lambda: None, "get_answer_cache": AnswerCache,
+             "get_analyzer": lambda: QueryAnalyzer([("TSLA", "Tesla, Inc.", "10-K", "2024-01-29")]),
+             "get_llm": LLM, "health": lambda: {"ready": True}}
+    originals = {name: getattr(resources, name) for name in stubs}
+    requests = 3 * qa_service.RETRIEVAL_WORKERS
+
+    async def run():
+        async with qa_service.lifespan(qa_service.app):
+            transport = httpx.ASGITransport(app=qa_service.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                responses = await asyncio.gather(*[client.post("/query", json={"query": f"Tesla risks {i}"})
+                                                   for i in range(requests)])
+                invalid = await client.post("/query", json={"query": "Tesla", "filters": {"tickers": "TSLA"}})
+                return responses, invalid, qa_service.state["batcher"].stats()
+
+    try:
+        for name, stub in stubs.items():
+            setattr(resources, name, stub)
+        responses, invalid, stats = asyncio.run(run())
+    finally:
+        for name, original in originals.items():
+            setattr(resources, name, original)
+    assert [response.status_code for response in responses] == [200] * requests
+    assert all(response.json()["answer"] == "answer" for response in responses)
+    assert invalid.status_code == 422
+    # Embedded on the event loop, so one batch can hold more queries than there are retrieval threads
+    assert len(embeddings.batches) < requests
+    assert stats["largest_batch"] > qa_service.RETRIEVAL_WORKERS
+
+def test_failed_warm_up_stops_startup():
+    report = {"ready": False, "warmup": {"status": "failed", "error": "no collection"}}
+    originals = {name: getattr(resources, name) for name in ("warm_up", "health")}
+
+    async def run():
+        async with qa_service.lifespan(qa_service.app):
+            raise AssertionError("service started after a failed warm-up")
+
+    try:
+        resources.warm_up = lambda background=True: None
+        resources.health = lambda: report
+        asyncio.run(run())
+    except RuntimeError as e:
+        assert "no collection" in str(e)
+    else:
+        raise AssertionError("lifespan did not fail")
+    finally:
+        for name, original in originals.items():
+            setattr(resources, name, original)
+
+def test_cancelled_requests_leave_the_retrieval_queue():
+    originals = dict(qa_service.state)
+    release = threading.Event()
+
+    async def run():
+        pool = ThreadPoolExecutor(max_workers=1)
+        qa_service.state.update(retrieval_pool=pool, metrics=qa_service.Metrics())
+        pool.submit(release.wait)  # Keeps the only retrieval thread busy
+        request = qa_service.QueryRequest(query="Tesla risks")
+        waiting = asyncio.create_task(qa_service.run_retrieval(request, [0.0]))
+        await asyncio.sleep(0.05)
+        depth = qa_service.state["metrics"].retrieval_waiting
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        release.set()
+        pool.shutdown()
+        return depth, qa_service.state["metrics"].retrieval_waiting
+
+    try:
+        assert asyncio.run(run()) == (1, 0)
+    finally:
+        release.set()
+        qa_service.state.clear()
+        qa_service.state.update(originals)
+
+def test_embedding_errors_reach_every_caller():
+    class Failing:
+        def embed_documents(self, texts):
+            raise RuntimeError("model not loaded")
+
+    async def run():
+        batcher = EmbeddingBatcher(Failing(), ThreadPoolExecutor(max_workers=1))
+        batcher.start()
+        results = await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+if __name__ == "__main__":
+    test_concurrent_queries_share_one_embedding_call()
+    test_concurrent_queries_are_batched_beyond_the_retrieval_pool()
+    test_failed_warm_up_stops_startup()
+    test_cancelled_requests_leave_the_retrieval_queue()
+    test_embedding_errors_reach_every_caller()
+    print("✅ qa service tests passed")
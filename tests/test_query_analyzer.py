@@ -0,0 +1,94 @@
+"""
+Offline test for query_analyzer.py: filter extraction, unfiltered fallback and decomposition.
+Run from the repo root: python tests/test_query_analyzer.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from query_analyzer import QueryAnalyzer, filtered_search, decomposed_search, describe
+
+CATALOG = [
+    ("TSLA", "Tesla, Inc.", "10-K", "2023-01-31T16:00:00-05:00"),
+    ("TSLA", "Tesla, Inc.", "10-K", "2024-01-29T16:00:00-05:00"),
+    ("TSLA", "Tesla, Inc.", "8-K", "2023-07-19T16:00:00-04:00"),
+    ("AAPL", "Apple Inc.", "10-K", "2022-10-28T18:01:14-04:00"),
+    ("AAPL", "Apple Inc.", "10-K", "2023-11-03T18:04:37-04:00"),
+    ("JPM", "JPMORGAN CHASE & CO", "DEF 14A", "2023-04-05T10:00:00-04:00"),
+]
+
+def test_ticker_form_and_fiscal_year():
+    analysis = QueryAnalyzer(CATALOG).analyze("What did TSLA say in its 2023 10-K about supply chain?")
+    assert analysis["where"] == {"$and": [
+        {"ticker": {"$in": ["TSLA"]}},
+        {"filing_type": {"$in": ["10-K"]}},
+        # Filed in 2023, or by March 2024 for fiscal 2023
+        {"filing_date": {"$in": ["2023-01-31T16:00:00-05:00", "2024-01-29T16:00:00-05:00"]}},
+    ]}
+    assert describe(analysis) == "TSLA · 10-K · 2023"
+
+def test_company_names_and_latest():
+    analyzer = QueryAnalyzer(CATALOG)
+    analysis = analyzer.analyze("Apple's risk factors in the latest annual report")
+    assert analysis["tickers"] == ["AAPL"] and analysis["latest"]
+    assert {"filing_date": {"$in": ["2023-11-03T18:04:37-04:00"]}} in analysis["where"]["$and"]
+    assert analyzer.analyze("JPMorgan Chase executive pay in the proxy")["where"] == {"$and": [
+        {"ticker": {"$in": ["JPM"]}}, {"filing_type": {"$in": ["DEF 14A"]}}]}
+    # Lowercase words are never tickers, and a question without entities is unfiltered
+    assert analyzer.analyze("what is a good ba degree?")["where"] is None
+    # Only full names and listed short names: a name's first word alone is not a company
+    analyzer = QueryAnalyzer(CATALOG + [("DIS", "Walt Disney Co", "10-K", "2023-11-21"),
+                                        ("GE", "GENERAL ELECTRIC CO", "10-K", "2024-02-02")])
+    assert analyzer.analyze("Walt Disney and General Electric revenue")["tickers"] == ["DIS", "GE"]
+    assert analyzer.analyze("Disney parks revenue")["tickers"] == ["DIS"]
+    assert analyzer.analyze("What did Walt say in general about electric cars?")["tickers"] == []
+
+def test_thin_results_fall_back_to_unfiltered():
+    def doc(chunk_id):
+        return SimpleNamespace(id=chunk_id)
+
+    class Search:
+        default_k = 3
+
+        def search_with_embedding(self, query, where=None, k=None, embedding=None):
+            docs = [doc("t1")] if where else [doc("x1"), doc("t1"), doc("x2"), doc("x3")]
+            return embedding or [0.0], docs[:k]
+
+    _, docs, analysis = filtered_search(Search(), QueryAnalyzer(CATALOG), "Tesla 8-K")
+    assert [d.id for d in docs] == ["t1", "x1", "x2"]
+    assert analysis["fallback"]
+
+def test_multi_company_questions_retrieve_each_company_concurrently():
+    class Search:
+        default_k = 5
+        embeds = 0
+
+        def embed(self, query):
+            self.embeds += 1
+            return [0.0]
+
+        def search_with_embedding(self, query, where=None, k=None, embedding=None):
+            time.sleep(0.2)
+            ticker = where["$and"][0]["ticker"]["$in"][0]
+            return embedding, [SimpleNamespace(id=f"{ticker}{i}") for i in range(k)]
+
+    search = Search()
+    start = time.perf_counter()
+    _, docs, analysis = decomposed_search(search, QueryAnalyzer(CATALOG), "Compare Tesla and Apple 10-K risk factors")
+    assert time.perf_counter() - start < 0.35
+    assert search.embeds == 1
+    # Round-robin by rank under the shared budget: neither company crowds out the other
+    assert [d.id for d in docs] == ["AAPL0", "TSLA0", "AAPL1", "TSLA1", "AAPL2", "TSLA2", "AAPL3", "TSLA3"]
+    assert [sub["ticker"] for sub in analysis["subqueries"]] == ["AAPL", "TSLA"]
+    # An explicit k is the budget
+    _, docs, _ = decomposed_search(search, QueryAnalyzer(CATALOG), "Compare Tesla and Apple 10-K risk factors", k=3)
+    assert [d.id for d in docs] == ["AAPL0", "TSLA0", "AAPL1"]
+
+if __name__ == "__main__":
+    test_ticker_form_and_fiscal_year()
+    test_company_names_and_latest()
+    test_thin_results_fall_back_to_unfiltered()
+    test_multi_company_questions_retrieve_each_company_concurrently()
+    print("✅ query analyzer tests passed")
@@ -0,0 +1,76 @@
+"""
+Offline test for reranker.py: ordering, latency-budget fallback, candidate capping and queueing.
+Uses a stand-in model with a controllable cost per pair.
+Run from the repo root: python tests/test_reranker.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reranker import Reranker
+
+class WordOverlapModel:
+    """Scores a pair by shared words; sleeps `seconds_per_pair` per pair"""
+
+    def __init__(self, seconds_per_pair=0.0):
+        self.seconds_per_pair = seconds_per_pair
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.batches.append(len(pairs))
+        time.sleep(self.seconds_per_pair * len(pairs))
+        return [len(set(query.split()) & set(text.split())) for query, text in pairs]
+
+DOCS = [SimpleNamespace(page_content=text) for text in
+        ["unrelated boilerplate", "tesla battery supply chain risk", "supply chain", "tesla"] * 10]
+QUERY = "tesla supply chain risk"
+
+def test_reranks_in_one_batch():
+    model = WordOverlapModel()
+    reranker = Reranker(model=model, candidates=50, budget=1.0)
+    top, stats = reranker.rerank(QUERY, DOCS, 3)
+    assert [d.page_content for d in top] == ["tesla battery supply chain risk"] * 3
+    assert model.batches[-1] == len(DOCS)
+    assert not stats["fallback"] and stats["pairs"] == len(DOCS)
+
+def test_over_budget_falls_back_then_caps_candidates():
+    model = WordOverlapModel()
+    reranker = Reranker(model=model, candidates=50, budget=0.3)
+    model.seconds_per_pair = 0.02  # 40 pairs = 0.8s, well over budget
+    top, stats = reranker.rerank(QUERY, DOCS, 3)
+    assert top == DOCS[:3]
+    assert stats["fallback"] and stats["seconds"] < 0.45
+    time.sleep(1.0)  # let the overrunning call finish
+    # The measured cost now caps the candidates so the next call fits the budget
+    top, stats = reranker.rerank(QUERY, DOCS, 3)
+    assert not stats["fallback"]
+    assert stats["pairs"] < len(DOCS)
+    assert top[0].page_content == "tesla battery supply chain risk"
+    assert reranker.stats()["fallbacks"] == 1
+
+def test_waiting_for_the_worker_counts_against_the_budget():
+    model = WordOverlapModel()
+    reranker = Reranker(model=model, candidates=50, budget=0.5)
+    model.seconds_per_pair = 0.0075  # 40 pairs = 0.3s: within budget, but three calls need 0.9s of worker time
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(lambda _: reranker.rerank(QUERY, DOCS, 3), range(3)))
+    stats = sorted((stats for _, stats in results), key=lambda stats: stats["wait_seconds"])
+    # The second call starts with 0.2s left and runs out; the third never leaves the queue
+    assert [s["fallback"] for s in stats] == [False, True, True]
+    assert 0.25 < stats[1]["wait_seconds"] < 0.45 and stats[2]["wait_seconds"] >= 0.5
+    # Every call returns within the budget, end to end
+    assert max(s["seconds"] for s in stats) < 0.6
+    time.sleep(0.4)
+    # The cancelled call never ran; neither queueing nor a cut-off call lowered the cost per pair
+    assert model.batches[1:] == [len(DOCS), len(DOCS)]
+    assert reranker.stats()["queue_timeouts"] == 1
+    assert reranker.max_pairs() == 50
+
+if __name__ == "__main__":
+    test_reranks_in_one_batch()
+    test_over_budget_falls_back_then_caps_candidates()
+    test_waiting_for_the_worker_counts_against_the_budget()
+    print("✅ reranker tests passed")
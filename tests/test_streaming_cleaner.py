@@ -0,0 +1,134 @@
+"""
+Equivalence test + benchmark: streaming_cleaner.clean_filing vs the legacy
+BeautifulSoup cleaner (extract_clean_text_from_html + clean_markdown_for_chunking).
+
+Run from the repo root:
+    python tests/test_streaming_cleaner.py                 # synthetic filing
+    python tests/test_streaming_cleaner.py raw/*.htm       # your own filings
+"""
+import os
+import sys
+import time
+import random
+import difflib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csv_data_collect_preprocess import extract_clean_text_from_html, clean_markdown_for_chunking
+from streaming_cleaner import clean_filing, iter_pieces, normalize_headers
+
+def legacy_clean(html):
+    return clean_markdown_for_chunking(extract_clean_text_from_html(html))
+
+SAMPLES = [
+    # Markup removal
+    "<html><head><title>T</title><style>p{}</style></head><body><p>Hello</p>"
+    "<script>var x = 1;</script><p>World &amp; co</p></body></html>",
+    "<body><div style=\"color:red;display:none\">hidden <b>deep</b></div><div style=\"display: none\">kept</div></body>",
+    "<body><ix:header><ix:hidden>dei</ix:hidden></ix:header><p>Revenue <ix:nonfraction>42</ix:nonfraction> "
+    "million</p><xbrli:context>ctx</xbrli:context></body>",
+    "<body>before<!-- note -->after<?pi x?>tail</body>",
+    "no body at all, just text\n\nPART I\nItem 1. Business",
+    "<html><head><title>Only head</title></head></html>",
+    "<body><pre>  keep\n\n\n\n  inner  </pre>  \n  </body>",
+    # Header rules
+    "Table of Contents\nPART I\nItem 1. Business\nItem 1A: Risk Factors\nITEM 7 MD&A",
+    "PART\nII\nOther\n\n\n\nItem 2.02 Results of Operations",
+    "Item 1.\nPART II\nItem 3.\nTable of Contents here\nItem 4.\n\nPART\n\nIII rest",
+    "SELECTED FINANCIAL DATA\n-----\nbody\nRISK\nFACTORS\n=====\n\n\n\nnext",
+    "SUMMARY\nPART III\n----\nx",
+    "HEADER\n\n\n\n---\n\n\nafter",
+    "PART CONTENTS\nItem 9B. Other Information\n\n\n\n\nEND",
+]
+
+def random_document(rng):
+    """Markup + header soup that exercises pass interactions"""
+    pieces = [
+        "PART", "PART I", "PART\nII", "Item 1.", "ITEM 7", "Item 2.02", "Table of Contents",
+        "RISK FACTORS", "----", "====", "\n", "\n\n\n", " ", "text", "Net sales", "1A", "<b>", "</b>",
+        "<div style=\"display:none\">", "</div>", "<ix:nonfraction>", "</ix:nonfraction>",
+        "<!-- c -->", "<script>x</script>", "&amp;", "<p>", "</p>", "<br/>",
+    ]
+    body = "".join(rng.choice(pieces) + rng.choice(["", " ", "\n"]) for _ in range(rng.randint(5, 60)))
+    return f"<html><body>{body}</body></html>" if rng.random() < 0.7 else body
+
+def make_filing(sections=200, seed=0):
+    """Synthetic inline-XBRL 10-K, roughly 2 MB"""
+    rng = random.Random(seed)
+    parts = ["<html><head><style>.x{color:red}</style></head><body>",
+             "<div style=\"display:none\"><ix:header>" + "<ix:hidden>dei</ix:hidden>" * 50 + "</ix:header></div>",
+             "<p>Table of Contents</p>"]
+    for i in range(sections):
+        if i % 50 == 0:
+            parts.append(f"<p>PART {['I', 'II', 'III', 'IV'][i // 50 % 4]}</p>")
+        parts.append(f"<p><b>Item {i % 16}{'A' if i % 3 else ''}. Section {i}</b></p>")
+        for _ in range(8):
+            words = " ".join(rng.choice(["revenue", "risk", "the", "Company", "net", "income", "of"])
+                             for _ in range(60))
+            parts.append(f"<p>{words} <ix:nonfraction name=\"us-gaap:Revenues\">{rng.randint(1, 10**6)}"
+                         f"</ix:nonfraction> million.</p><script>track({i})</script>")
+        parts.append("<table><tr><td>2023</td><td>&#160;</td><td>1,234</td></tr></table>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def first_difference(expected, actual):
+    diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(), "legacy", "streaming", lineterm="", n=1)
+    return "\n".join(list(diff)[:20])
+
+def test_matches_legacy_on_samples():
+    for html in SAMPLES:
+        expected, actual = legacy_clean(html), clean_filing(html)
+        assert actual == expected, f"{html!r}\n{first_difference(expected, actual)}"
+
+def test_matches_legacy_on_random_documents():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        html = random_document(rng)
+        expected, actual = legacy_clean(html), clean_filing(html)
+        assert actual == expected, f"{html!r}\n{first_difference(expected, actual)}"
+
+def test_header_rules_match_sequential_passes():
+    rng = random.Random(99)
+    for _ in range(5000):
+        text = random_document(rng).replace("<", " ").replace(">", " ")
+        assert normalize_headers(text) == clean_markdown_for_chunking(text), repr(text)
+
+def test_block_size_does_not_change_output():
+    html = make_filing(sections=20)
+    whole = clean_filing(html)
+    assert clean_filing(iter_pieces(html, 7)) == whole
+    assert clean_filing(iter_pieces(html, 4096)) == whole
+
+def benchmark(name, html, repeats=3):
+    def best(fn):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn(html)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    legacy_time, expected = best(legacy_clean)
+    stream_time, actual = best(clean_filing)
+    status = "identical" if actual == expected else "DIFFERENT"
+    print(f"{name}: {len(html) / 1e6:.1f} MB, legacy {legacy_time:.2f}s, streaming {stream_time:.2f}s "
+          f"({legacy_time / stream_time:.1f}x), output {status}")
+    if actual != expected:
+        print(first_difference(expected, actual))
+    return actual == expected
+
+if __name__ == "__main__":
+    test_matches_legacy_on_samples()
+    test_matches_legacy_on_random_documents()
+    test_header_rules_match_sequential_passes()
+    test_block_size_does_not_change_output()
+    print("✅ streaming cleaner matches the legacy cleaner")
+
+    paths = sys.argv[1:]
+    if paths:
+        results = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                results.append(benchmark(os.path.basename(path), f.read()))
+        print(f"{sum(results)}/{len(results)} files identical")
+    else:
+        benchmark("synthetic 10-K", make_filing())
@@ -0,0 +1,56 @@
+"""
+Offline test for streaming_splitter.py: section tagging, headings kept with their body, TOC back-links dropped.
+Run from the repo root: python tests/test_streaming_splitter.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from streaming_splitter import SectionAwareSplitter
+
+LONG = " ".join(f"Tesla designs and sells electric vehicles, sentence {i}." for i in range(60))
+BODY = f"""## Table of Contents
+
+PART I
+Item 1. Business
+Item 1A. Risk Factors
+
+## PART I — Financial Information
+
+### Item 1: Business
+
+{LONG}
+
+Table of Contents
+
+### Item 1A: Risk Factors
+
+Supply chain disruptions could harm our business.
+
+Table of Contents
+"""
+
+def split(text, chunk_size=300):
+    splitter = SectionAwareSplitter(chunk_size, 50, window_size=4 * chunk_size)
+    return list(splitter.split_stream([text]))
+
+def test_headings_lead_their_first_chunk():
+    chunks = split(BODY)
+    assert all(len(chunk) > 40 for chunk, _ in chunks)
+    business = [chunk for chunk, section in chunks if section["section"] == "Item 1"]
+    assert business[0].startswith("## PART I — Financial Information\n### Item 1: Business\n\nTesla designs")
+    assert chunks[-1] == ("### Item 1A: Risk Factors\n\nSupply chain disruptions could harm our business.",
+                          chunks[-1][1])
+    assert chunks[-1][1]["heading_path"] == "PART I > Item 1A: Risk Factors"
+
+def test_table_of_contents_back_links_are_dropped():
+    chunks = split(BODY)
+    assert chunks[0][1]["section"] == "Table of Contents"
+    assert sum("Table of Contents" in chunk for chunk, _ in chunks) == 1
+    # A trailing heading with nothing under it produces no chunk
+    assert split("## PART II — Other Information\n") == []
+
+if __name__ == "__main__":
+    test_headings_lead_their_first_chunk()
+    test_table_of_contents_back_links_are_dropped()
+    print("✅ streaming splitter tests passed")